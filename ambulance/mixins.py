@@ -0,0 +1,18 @@
+from django.db.models import Exists, OuterRef
+
+from emstrack.mixins import BasePermissionMixin
+
+from .models import AmbulanceCall, Call
+
+
+# Call permissions
+class CallPermissionMixin(BasePermissionMixin):
+
+    filter_field = 'ambulancecall__ambulance_id'
+    profile_field = 'ambulances'
+    queryset = Call.objects.all()
+
+    def get_permission_filter(self, user, flag):
+        # calls with an ambulance the user has permission on, without a row per ambulance
+        ambulances = self.get_effective_permissions(user, flag).values('object_id')
+        return Exists(AmbulanceCall.objects.filter(call=OuterRef('pk'), ambulance_id__in=ambulances))
@@ -152,6 +152,9 @@ class Ambulance(PublishMixin,
     # default value for _loaded_values
     _loaded_values = None
 
+    # number of position updates replaced by the next save, recorded in its AmbulanceUpdate
+    coalesced = 0
+
     @classmethod
     def from_db(cls, db, field_names, values):
 
@@ -214,8 +217,10 @@ class Ambulance(PublishMixin,
                               'location', 'timestamp',
                               'comment', 'updated_by', 'updated_on')}
             data['ambulance'] = self
+            data['coalesced'] = self.coalesced
             obj = AmbulanceUpdate(**data)
             obj.save()
+            self.coalesced = 0
 
             # logger.debug('UPDATE SAVED')
 
@@ -246,9 +251,10 @@ class Ambulance(PublishMixin,
 
         # just created?
         if created:
-            # invalidate permissions cache
-            from mqtt.cache_clear import mqtt_cache_clear
-            mqtt_cache_clear()
+            # invalidate permissions cache of the users that can see all ambulances
+            from login.permissions import get_permission_users
+            from mqtt.cache_clear import mqtt_user_cache_clear
+            mqtt_user_cache_clear(get_permission_users(ambulance=self.id))
 
     def publish(self, **kwargs):
 
@@ -258,13 +264,17 @@ class Ambulance(PublishMixin,
 
     def delete(self, *args, **kwargs):
 
-        # invalidate permissions cache
-        from mqtt.cache_clear import mqtt_cache_clear
-        mqtt_cache_clear()
+        # users with permissions on this ambulance
+        from login.permissions import get_permission_users
+        user_ids = list(get_permission_users(ambulance=self.id))
 
         # delete from Ambulance
         super().delete(*args, **kwargs)
 
+        # invalidate permissions cache of the affected users
+        from mqtt.cache_clear import mqtt_user_cache_clear
+        mqtt_user_cache_clear(user_ids)
+
     def get_absolute_url(self):
         return reverse('ambulance:detail', kwargs={'pk': self.id})
 
@@ -306,6 +316,9 @@ class AmbulanceUpdate(UpdatedByHistoryModel):
     # timestamp, indexed
     timestamp = models.DateTimeField(_('timestamp'), db_index=True, default=timezone.now)
 
+    # number of position updates replaced by this one when coalescing
+    coalesced = models.PositiveIntegerField(_('coalesced'), default=0)
+
     class Meta:
         indexes = [
             models.Index(
@@ -12,6 +12,9 @@ from emstrack.latlon import calculate_orientation
 
 logger = logging.getLogger(__name__)
 
+# rows per INSERT when creating ambulance updates in bulk
+BULK_UPDATE_BATCH_SIZE = 1000
+
 
 # Ambulance serializers
 
@@ -95,8 +98,6 @@ class AmbulanceUpdateListSerializer(serializers.ListSerializer):
 
             with transaction.atomic():
 
-                # loop through updates
-                instances = []
                 n = len(validated_data)
 
                 # short return
@@ -110,17 +111,18 @@ class AmbulanceUpdateListSerializer(serializers.ListSerializer):
                                                            'orientation', 'location', 'comment')}
 
                 # loop through
+                instances = []
                 for k in range(0, n-1):
 
                     # process update
                     data = process_update(validated_data[k], data)
 
                     # create update object
-                    obj = AmbulanceUpdate(**data)
-                    obj.save()
+                    instances.append(AmbulanceUpdate(**data))
 
-                    # append to objects list
-                    instances.append(obj)
+                # save update objects in bulk
+                instances = AmbulanceUpdate.objects.bulk_create(instances,
+                                                                batch_size=BULK_UPDATE_BATCH_SIZE)
 
                 # on last update, update ambulance instead
 
@@ -1153,3 +1153,33 @@ class TestAmbulanceBulkUpdates(TestSetup):
         # logout
         client.logout()
 
+    def test_large_batch(self):
+
+        # Bulk update ambulance a1 with a long offline history
+        a = self.a1
+        user = self.u1
+        n = 2500
+
+        data = [{'location': {'latitude': -3. + k * 1e-3, 'longitude': 6.}}
+                for k in range(n)]
+
+        count = AmbulanceUpdate.objects.filter(ambulance=a).count()
+
+        serializer = AmbulanceUpdateSerializer(data=data, many=True, partial=True)
+        serializer.is_valid(raise_exception=True)
+        serializer.save(ambulance=Ambulance.objects.get(id=a.id),
+                        updated_by=user)
+
+        # every update is recorded
+        queryset = AmbulanceUpdate.objects.filter(ambulance=a)
+        self.assertEqual(queryset.count(), count + n)
+
+        # orientation is calculated for the whole batch
+        previous = dict2point(data[0]['location'])
+        for u in queryset.order_by('id')[count + 1:count + 10]:
+            self.assertEqual(math.fabs(calculate_orientation(previous, u.location) - u.orientation) < 1e-4, True)
+            previous = u.location
+
+        # make sure last update is reflected in ambulance
+        a = Ambulance.objects.get(id=a.id)
+        self.assertEqual(point2str(a.location), point2str(data[-1]['location']))
@@ -19,6 +19,7 @@ from ambulance.serializers import CallSerializer, AmbulanceCallSerializer, Patie
     AmbulanceUpdateSerializer, WaypointSerializer, LocationSerializer
 from emstrack.tests.util import date2iso, point2str
 
+from login.models import UserAmbulancePermission
 from login.tests.setup_data import TestSetup
 
 logger = logging.getLogger(__name__)
@@ -1376,6 +1377,17 @@ class TestCall(TestSetup):
         answer = CallSerializer([c1], many=True).data
         self.assertCountEqual(result, answer)
 
+        # calls with more than one readable ambulance are listed once
+        UserAmbulancePermission.objects.create(user=self.u3, ambulance=self.a2)
+        AmbulanceCall.objects.create(call=c1, ambulance=self.a2, updated_by=self.u1)
+
+        response = client.get('/en/api/call/', follow=True)
+        self.assertEquals(response.status_code, 200)
+
+        result = JSONParser().parse(BytesIO(response.content))
+        answer = CallSerializer([c1, c2], many=True).data
+        self.assertCountEqual(result, answer)
+
         # logout
         client.logout()
 
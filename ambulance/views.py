@@ -11,6 +11,7 @@ from django.views.generic import TemplateView, ListView, \
 from django.views.generic.detail import BaseDetailView
 
 from equipment.mixins import EquipmentHolderCreateMixin, EquipmentHolderUpdateMixin
+from .mixins import CallPermissionMixin
 from .models import Ambulance, AmbulanceCapability, AmbulanceStatus, \
     Call, Location, LocationType, CallStatus, AmbulanceCallStatus, \
     CallPriority, AmbulanceStatusOrder, AmbulanceCapabilityOrder, CallStatusOrder, CallPriorityOrder, LocationTypeOrder
@@ -341,14 +342,6 @@ class LocationAdminUpdateView(SuccessMessageMixin,
 
 # Calls
 
-# Call permissions
-class CallPermissionMixin(BasePermissionMixin):
-
-    filter_field = 'ambulancecall__ambulance_id'
-    profile_field = 'ambulances'
-    queryset = Call.objects.all()
-
-
 # Call ListView
 class CallListView(LoginRequiredMixin,
                    CallPermissionMixin,
@@ -11,6 +11,7 @@ from emstrack.mixins import BasePermissionMixin, \
     CreateModelUpdateByMixin, UpdateModelUpdateByMixin
 from login.viewsets import IsCreateByAdminOrSuper, IsCreateByAdminOrSuperOrDispatcher
 
+from .mixins import CallPermissionMixin
 from .models import Location, Ambulance, LocationType, Call, AmbulanceUpdate, AmbulanceCall, AmbulanceCallHistory, \
     AmbulanceCallStatus, CallStatus
 
@@ -296,7 +297,7 @@ class LocationTypeViewSet(mixins.ListModelMixin,
 class CallViewSet(mixins.ListModelMixin,
                   mixins.RetrieveModelMixin,
                   CreateModelUpdateByMixin,
-                  BasePermissionMixin,
+                  CallPermissionMixin,
                   viewsets.GenericViewSet):
     """
     API endpoint for manipulating Calls.
@@ -314,10 +315,6 @@ class CallViewSet(mixins.ListModelMixin,
     permission_classes = (IsAuthenticated,
                           IsCreateByAdminOrSuperOrDispatcher)
 
-    filter_field = 'ambulancecall__ambulance_id'
-    profile_field = 'ambulances'
-    queryset = Call.objects.all()
-
     serializer_class = CallSerializer
 
     def get_queryset(self):
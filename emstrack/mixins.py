@@ -1,6 +1,7 @@
 import logging
 
 from django.contrib import messages
+from django.db.models import Exists, OuterRef
 from django.http import HttpResponseRedirect
 from rest_framework import mixins
 from rest_framework.exceptions import PermissionDenied
@@ -49,32 +50,37 @@ class BasePermissionMixin:
         if user.is_anonymous:
             raise PermissionDenied()
 
-        # get permissions
-        from login.permissions import get_permissions
-        permissions = get_permissions(user)
-
         # otherwise only return objects that the user can read or write to
         if self.request.method == 'GET':
             # objects that the user can read
-            can_do = permissions.get_can_read(self.profile_field)
+            flag = 'can_read'
 
         elif (self.request.method == 'PUT' or
               self.request.method == 'PATCH' or
               self.request.method == 'DELETE'):
             # objects that the user can write to
-            can_do = permissions.get_can_write(self.profile_field)
+            flag = 'can_write'
 
         else:
             raise PermissionDenied()
 
-        # add filter
-        filter_params = {self.filter_field + '__in': can_do}
-
-        logger.debug('can_do = {}'.format(can_do))
-        logger.debug('filter_params = {}'.format(filter_params))
-
-        # retrieve query
-        return super().get_queryset().filter(**filter_params)
+        # retrieve query, filtered by an indexed lookup on the materialized permissions
+        return super().get_queryset() \
+            .annotate(permitted=self.get_permission_filter(user, flag)) \
+            .filter(permitted=True)
+
+    def get_effective_permissions(self, user, flag):
+        """
+        Returns the EffectivePermission rows of user on profile_field with flag, 'can_read' or 'can_write'.
+        """
+        from login.models import EffectivePermission
+        return EffectivePermission.objects.filter(user=user, object_type=self.profile_field, **{flag: True})
+
+    def get_permission_filter(self, user, flag):
+        """
+        Returns an expression that is true for the objects that user has flag on.
+        """
+        return Exists(self.get_effective_permissions(user, flag).filter(object_id=OuterRef(self.filter_field)))
 
 
 class SuccessMessageWithInlinesMixin:
@@ -41,19 +41,24 @@ class Hospital(Location):
 
         # just created?
         if created:
-            # invalidate permissions cache
-            from mqtt.cache_clear import mqtt_cache_clear
-            mqtt_cache_clear()
+            # invalidate permissions cache of the users that can see all hospitals
+            from login.permissions import get_permission_users
+            from mqtt.cache_clear import mqtt_user_cache_clear
+            mqtt_user_cache_clear(get_permission_users(hospital=self.id))
 
     def delete(self, *args, **kwargs):
 
-        # invalidate permissions cache
-        from mqtt.cache_clear import mqtt_cache_clear
-        mqtt_cache_clear()
+        # users with permissions on this hospital
+        from login.permissions import get_permission_users
+        user_ids = list(get_permission_users(hospital=self.id))
 
         # delete from Hospital
         super().delete(*args, **kwargs)
 
+        # invalidate permissions cache of the affected users
+        from mqtt.cache_clear import mqtt_user_cache_clear
+        mqtt_user_cache_clear(user_ids)
+
     def get_absolute_url(self):
         return reverse('hospital:detail', kwargs={'pk': self.id})
 
@@ -1,4 +1,6 @@
 from django.apps import AppConfig
+from django.core import checks
+from django.db.models.signals import post_migrate
 
 
 class LoginConfig(AppConfig):
@@ -8,3 +10,8 @@ class LoginConfig(AppConfig):
 
         # enable signals
         from . import signals
+        post_migrate.connect(signals.backfill_effective_permissions, sender=self)
+
+        # warn about a process-local permission cache
+        from .permissions import check_permission_cache
+        checks.register(check_permission_cache)
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from login.permissions import refresh_effective_permissions
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the materialized effective permissions of users'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', nargs='*', type=int, default=None,
+                            help='ids of the users to refresh, all users if omitted')
+
+    def handle(self, *args, **options):
+
+        if options['verbosity'] > 0:
+            self.stdout.write(self.style.SUCCESS(">> Refreshing effective permissions..."))
+
+        changed = refresh_effective_permissions(options['user'])
+
+        if options['verbosity'] > 0:
+            self.stdout.write(self.style.SUCCESS("<< Refreshed effective permissions, {} rows changed".format(changed)))
@@ -1,20 +1,19 @@
-from mqtt.cache_clear import mqtt_cache_clear
+from django.contrib.auth.models import User
 
 
 class ClearPermissionCacheMixin:
+    """
+    Models whose changes affect the permissions of some users.
 
-    def save(self, *args, **kwargs):
+    The permissions cache of those users is cleared by the receivers in
+    login.signals, so that queryset deletes and cascades are covered too.
+    """
 
-        # save to UserProfile
-        super().save(*args, **kwargs)
+    def get_permission_users(self):
 
-        # invalidate permissions cache
-        mqtt_cache_clear()
+        # user permissions and profile
+        if hasattr(self, 'user_id'):
+            return [self.user_id]
 
-    def delete(self, *args, **kwargs):
-
-        # delete from UserProfile
-        super().delete(*args, **kwargs)
-
-        # invalidate permissions cache
-        mqtt_cache_clear()
+        # group permissions and profile, every member of the group
+        return list(User.objects.filter(groups=self.group_id).values_list('id', flat=True))
@@ -160,6 +160,38 @@ class GroupHospitalPermission(ClearPermissionCacheMixin,
                                                          self.can_write)
 
 
+# EffectivePermission
+
+class EffectivePermission(models.Model):
+    """
+    The permissions of a user on an object after combining the permissions
+    of the user and of its groups, one row per readable or writable object.
+
+    Rows are kept current by login.permissions.refresh_effective_permissions
+    whenever the permissions of a user change, so that querysets can be
+    filtered in SQL. Superusers and staff have no rows.
+    """
+
+    user = models.ForeignKey(User,
+                             on_delete=models.CASCADE,
+                             verbose_name=_('user'))
+    # profile field, e.g. 'ambulances'
+    object_type = models.CharField(_('object_type'), max_length=16)
+    object_id = models.PositiveIntegerField(_('object_id'))
+    can_read = models.BooleanField(_('can_read'), default=True)
+    can_write = models.BooleanField(_('can_write'), default=False)
+
+    class Meta:
+        unique_together = ('user', 'object_type', 'object_id')
+
+    def __str__(self):
+        return '{}/{}(id={}): read[{}] write[{}]'.format(self.user,
+                                                         self.object_type,
+                                                         self.object_id,
+                                                         self.can_read,
+                                                         self.can_write)
+
+
 # TemporaryPassword
 
 class TemporaryPassword(models.Model):
@@ -410,6 +442,10 @@ class Client(models.Model):
             # logger.debug(entry)
             ClientLog.objects.create(**entry)
 
+        # invalidate identity cache
+        from mqtt.cache_clear import mqtt_client_cache_clear
+        mqtt_client_cache_clear(self.client_id)
+
         # publish to mqtt
         # logger.debug('publish_ambulance = {}'.format(publish_ambulance))
         # logger.debug('publish_hospital = {}'.format(publish_hospital))
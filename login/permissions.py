@@ -1,23 +1,370 @@
 import logging
-
-from functools import lru_cache
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from collections.abc import Mapping
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core import checks
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import transaction
+from django.db.models import Q
 
 from ambulance.models import Ambulance
+from equipment.models import EquipmentHolder
 from hospital.models import Hospital
 
 logger = logging.getLogger(__name__)
 
-PERMISSION_CACHE_SIZE = 10
+PERMISSION_CACHE_SIZE = 1000
+PERMISSION_CACHE_TIMEOUT = 24 * 60 * 60
+PERMISSION_VERSION_TTL = 1
+
+PermissionCacheInfo = namedtuple('PermissionCacheInfo', ['hits', 'misses', 'maxsize', 'currsize', 'shared_hits'])
+
+
+def new_version():
+    # larger than any version handed out before, even if the version key was evicted
+    return int(time.time() * 1e6)
+
+
+# PermissionCache
+
+class PermissionCache:
+    """
+    Two-tier cache of the Permissions of each user.
+
+    Permissions are stored in a Django cache shared by every process, keyed
+    by user id and by a global and a per-user version, and kept in a local
+    LRU in front of it. Bumping a version makes every process rebuild the
+    affected permissions on their next lookup, without a broadcast. Changes
+    made inside a transaction bump the version again on commit, so other
+    processes do not cache permissions built before the commit.
+
+    Local entries are trusted for version_ttl seconds before their versions
+    are checked again, so lookups rarely reach the shared cache; changes
+    made by other processes are seen within version_ttl seconds, evict()
+    and clear() in this process right away.
+    """
+
+    global_key = 'permissions:version'
+
+    def __init__(self, maxsize=PERMISSION_CACHE_SIZE, alias=None, timeout=PERMISSION_CACHE_TIMEOUT,
+                 ttl=None, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.alias = alias
+        self.timeout = timeout
+        self.ttl = ttl
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.shared_hits = 0
+
+    @property
+    def shared(self):
+        return caches[self.alias or getattr(settings, 'PERMISSION_CACHE', 'default')]
+
+    @property
+    def version_ttl(self):
+        if self.ttl is not None:
+            return self.ttl
+        return getattr(settings, 'PERMISSION_VERSION_TTL', PERMISSION_VERSION_TTL)
+
+    @property
+    def local(self):
+        """
+        True if the shared cache is private to this process, so other processes cannot bump its versions.
+        """
+        return isinstance(self.shared, (LocMemCache, DummyCache))
+
+    def user_key(self, user_id):
+        return 'permissions:version:{}'.format(user_id)
+
+    def versions(self, user_id):
+        """
+        Returns the global and the per-user version of user_id.
+        """
+
+        keys = (self.global_key, self.user_key(user_id))
+        versions = self.shared.get_many(keys)
+        for key in keys:
+            if key not in versions:
+                self.shared.add(key, new_version(), timeout=None)
+                versions[key] = self.shared.get(key)
+        return tuple(versions[key] for key in keys)
+
+    def bump(self, key):
+        try:
+            self.shared.incr(key)
+        except ValueError:
+            if not self.shared.add(key, new_version(), timeout=None):
+                self.shared.incr(key)
+
+    def invalidate(self, key, using=None):
+
+        self.bump(key)
+
+        # others must not cache permissions read before the commit
+        if transaction.get_connection(using).in_atomic_block:
+            transaction.on_commit(lambda: self.bump(key), using=using)
+
+    def get(self, user):
+        """
+        Returns the Permissions of user.
+        """
+
+        if user is None or user.pk is None:
+            return Permissions(user)
+
+        now = self.clock()
+
+        # versions checked recently?
+        with self.lock:
+            entry = self.cache.get(user.pk)
+            if entry is not None and now - entry[2] < self.version_ttl:
+                self.cache.move_to_end(user.pk)
+                self.hits += 1
+                return entry[1]
+
+        versions = self.versions(user.pk)
+
+        with self.lock:
+            entry = self.cache.get(user.pk)
+            if entry is not None and entry[0] == versions:
+                self.cache[user.pk] = (versions, entry[1], now)
+                self.cache.move_to_end(user.pk)
+                self.hits += 1
+                return entry[1]
+
+        key = 'permissions:{}:{}:{}'.format(user.pk, *versions)
+        permissions = self.shared.get(key)
+        if permissions is not None:
+            with self.lock:
+                self.hits += 1
+                self.shared_hits += 1
+        else:
+            # hit the database for permissions
+            permissions = Permissions(user)
+            self.shared.set(key, permissions, timeout=self.timeout)
+            with self.lock:
+                self.misses += 1
+
+        with self.lock:
+            self.cache[user.pk] = (versions, permissions, now)
+            self.cache.move_to_end(user.pk)
+            while len(self.cache) > self.maxsize:
+                self.cache.popitem(last=False)
+
+        return permissions
+
+    def evict(self, user_id, shared=True):
+        """
+        Invalidates the permissions of user_id, in every process unless shared is False.
+        """
+        if shared:
+            self.invalidate(self.user_key(user_id))
+        with self.lock:
+            self.cache.pop(user_id, None)
+
+    def clear(self, shared=True):
+        """
+        Invalidates the permissions of every user, in every process unless shared is False.
+        """
+        if shared:
+            self.invalidate(self.global_key)
+        with self.lock:
+            self.cache.clear()
+
+    def info(self):
+        with self.lock:
+            return PermissionCacheInfo(self.hits, self.misses, self.maxsize, len(self.cache), self.shared_hits)
+
+
+permission_cache = PermissionCache()
+
+get_permissions = permission_cache.get
+cache_evict = permission_cache.evict
+cache_clear = permission_cache.clear
+cache_info = permission_cache.info
+
+
+def check_permission_cache(app_configs, **kwargs):
+    """
+    Warns if the shared permission cache is private to each process.
+    """
+
+    if not permission_cache.local:
+        return []
+
+    return [checks.Warning(
+        'The permission cache {} is private to each process.'.format(type(permission_cache.shared).__name__),
+        hint='Permission changes made by other processes are only seen after a broadcast '
+             'or the cache timeout. Set PERMISSION_CACHE to a cache shared by every process.',
+        id='login.W001',
+    )]
+
+
+def get_permission_users(**kwargs):
+    """
+    Returns the ids of the users whose permissions depend on an object, e.g. get_permission_users(ambulance=id).
+    """
+    assert len(kwargs) == 1
+    (object_field, id) = kwargs.popitem()
+    return User.objects.filter(Q(is_superuser=True) |
+                               Q(is_staff=True) |
+                               Q(**{'user{}permission__{}'.format(object_field, object_field): id}) |
+                               Q(**{'groups__group{}permission__{}'.format(object_field, object_field): id})) \
+        .distinct().values_list('id', flat=True)
+
+
+def refresh_effective_permissions(user_ids=None):
+    """
+    Rebuilds the EffectivePermission rows of the users in user_ids, or of every user if None.
+
+    Only rows that changed are written. Returns the number of rows created, updated and deleted.
+    """
+
+    from .models import EffectivePermission
+
+    users = User.objects.all()
+    if user_ids is not None:
+        users = users.filter(id__in=user_ids)
+
+    changed = 0
+    for user in users.iterator():
+
+        # e.g.: rows[('ambulances', ambulance_id)] = (can_read, can_write)
+        rows = {}
+        if not (user.is_superuser or user.is_staff):
+            permissions = Permissions(user)
+            for object_type in permissions.profile_fields + ('equipments',):
+                for (id, flag) in getattr(permissions, object_type).flags.items():
+                    if flag:
+                        rows[(object_type, id)] = (bool(flag & PermissionIndex.READ),
+                                                   bool(flag & PermissionIndex.WRITE))
+
+        existing = {(object_type, object_id): (pk, can_read, can_write)
+                    for (pk, object_type, object_id, can_read, can_write)
+                    in EffectivePermission.objects.filter(user=user).values_list('id', 'object_type', 'object_id',
+                                                                                 'can_read', 'can_write')}
+
+        # delete rows that are gone
+        deleted = [pk for (key, (pk, _, _)) in existing.items() if key not in rows]
+        if deleted:
+            EffectivePermission.objects.filter(id__in=deleted).delete()
+
+        # update rows that changed, one query per combination of flags
+        updated = {}
+        for (key, (pk, can_read, can_write)) in existing.items():
+            if key in rows and rows[key] != (can_read, can_write):
+                updated.setdefault(rows[key], []).append(pk)
+        for ((can_read, can_write), pks) in updated.items():
+            EffectivePermission.objects.filter(id__in=pks).update(can_read=can_read, can_write=can_write)
+
+        # create new rows
+        created = [EffectivePermission(user=user, object_type=object_type, object_id=object_id,
+                                       can_read=can_read, can_write=can_write)
+                   for ((object_type, object_id), (can_read, can_write)) in rows.items()
+                   if (object_type, object_id) not in existing]
+        EffectivePermission.objects.bulk_create(created)
+
+        changed += len(deleted) + sum(len(pks) for pks in updated.values()) + len(created)
+
+    return changed
+
+
+class AllObjects:
+    """
+    Sentinel set of ids that contains every id.
+    """
+
+    def __contains__(self, id):
+        return True
+
+    def __repr__(self):
+        return 'ALL'
+
+    def __reduce__(self):
+        return 'ALL'
+
+
+ALL = AllObjects()
+
+
+class PermissionIndex(Mapping):
+    """
+    Read-only mapping of object id to {object_field: obj, 'can_read': bool, 'can_write': bool}.
+
+    Only ids and flags are stored, with the readable and writable ids kept
+    in frozensets for constant time checks. If flags is ALL every object can
+    be read and written, checks are against ALL and ids are listed only when
+    the index is iterated. Model instances are loaded with a single query
+    the first time an entry is accessed and are not pickled.
+    """
+
+    READ = 1
+    WRITE = 2
+
+    def __init__(self, model, object_field, flags=ALL):
+        self.model = model
+        self.object_field = object_field
+        self.all = flags is ALL
+        self._flags = flags
+        if self.all:
+            self.can_read = self.can_write = ALL
+        else:
+            self.can_read = frozenset(id for (id, flag) in flags.items() if flag & self.READ)
+            self.can_write = frozenset(id for (id, flag) in flags.items() if flag & self.WRITE)
+        self._objects = None
+
+    @classmethod
+    def flag(cls, can_read, can_write):
+        return (cls.READ if can_read else 0) | (cls.WRITE if can_write else 0)
+
+    @property
+    def flags(self):
+        if self._flags is ALL:
+            # every object, listed on first use
+            flag = self.flag(True, True)
+            self._flags = {id: flag for id in sorted(self.objects())}
+        return self._flags
+
+    def objects(self):
+        if self._objects is None:
+            if self.all:
+                self._objects = self.model.objects.in_bulk()
+            else:
+                self._objects = self.model.objects.in_bulk(list(self.flags))
+        return self._objects
+
+    def __getitem__(self, id):
+        flag = self.flags[id]
+        return {
+            self.object_field: self.objects()[id],
+            'can_read': bool(flag & self.READ),
+            'can_write': bool(flag & self.WRITE)
+        }
 
+    def __iter__(self):
+        return iter(self.flags)
 
-@lru_cache(maxsize=PERMISSION_CACHE_SIZE)
-def get_permissions(user):
-    # hit the database for permissions
-    return Permissions(user)
+    def __len__(self):
+        return len(self.flags)
 
+    def __contains__(self, id):
+        return id in self.flags
 
-cache_clear = get_permissions.cache_clear
-cache_info = get_permissions.cache_info
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_objects'] = None
+        if self.all:
+            state['_flags'] = ALL
+        return state
 
 
 class Permissions:
@@ -39,120 +386,64 @@ class Permissions:
         if 'models' in kwargs:
             self.models = kwargs.pop('models')
 
-        # initialize permissions
-        self.can_read = {}
-        self.can_write = {}
-        for profile_field in self.profile_fields:
-            # e.g.: self.ambulances = {}
-            setattr(self, profile_field, {})
-            # e.g.: self.can_read['ambulances'] = {}
-            self.can_read[profile_field] = []
-            self.can_write[profile_field] = []
-
-        # add equipments
-        self.equipments = {}
-        self.can_read['equipments'] = []
-        self.can_write['equipments'] = []
+        # e.g.: flags['ambulances'] = {ambulance_id: PermissionIndex.flag(can_read, can_write)}
+        flags = {profile_field: {} for profile_field in self.profile_fields}
+        equipments = {}
 
         # retrieve permissions if not None
         if user is not None:
 
             if user.is_superuser or user.is_staff:
 
-                # superuser, add all permissions
-                for (model, profile_field, object_field) in zip(self.models, self.profile_fields, self.object_fields):
-                    # e.g.: objs = group.groupprofile.hospitals.all()
-                    objs = model.objects.all()
-
-                    # e.g.: self.hospitals.update({e.hospital_id: {...} for e in Hospitals.objects.all()})
-                    permissions = {}
-                    equipment_permissions = {}
-                    for e in objs:
-                        permissions[e.id] = {
-                            object_field: e,
-                            'can_read': True,
-                            'can_write': True
-                        }
-                        equipment_permissions[e.equipmentholder.id] = {
-                            'equipmentholder': e.equipmentholder,
-                            'can_read': True,
-                            'can_write': True
-                        }
-                    getattr(self, profile_field).update(permissions)
-                    self.equipments.update(equipment_permissions)
-                    # logger.debug('superuser, {} = {}'.format(profile_field, getattr(self, profile_field)))
-                    # logger.debug('superuser, {} = {}'.format('equipments', self.equipments))
+                # superuser, all permissions without a query
+                flags = {profile_field: ALL for profile_field in self.profile_fields}
+                equipments = ALL
 
             else:
 
-                # regular users, loop through groups
-                for group in user.groups.all().order_by('groupprofile__priority', '-name'):
-                    for (profile_field, object_field) in zip(self.profile_fields, self.object_fields):
-
-                        # e.g.: objs = group.groupambulancepermission_set.all()
-                        objs = getattr(group, 'group' + object_field + 'permission_set').all()
-
-                        # e.g.: self.ambulances.update({e.ambulance_id: {...} for e in objs})
-                        permissions = {}
-                        equipment_permissions = {}
-                        for e in objs:
-                            id = getattr(e, object_field + '_id')
-                            obj = getattr(e, object_field)
-                            permissions[id] = {
-                                object_field: obj,
-                                'can_read': e.can_read,
-                                'can_write': e.can_write
-                            }
-                            equipment_permissions[obj.equipmentholder.id] = {
-                                'equipmentholder': obj.equipmentholder,
-                                'can_read': e.can_read,
-                                'can_write': e.can_write
-                            }
-                        getattr(self, profile_field).update(permissions)
-                        self.equipments.update(equipment_permissions)
-
-                # add user permissions
+                # regular users, one query per object field through all groups in order of priority
+                for (profile_field, object_field) in zip(self.profile_fields, self.object_fields):
+                    # e.g.: prefix = 'groups__groupambulancepermission__'
+                    prefix = 'groups__group' + object_field + 'permission__'
+                    objs = User.objects.filter(pk=user.pk) \
+                        .order_by('groups__groupprofile__priority', '-groups__name', prefix + 'id')
+                    self.add(flags[profile_field], equipments, object_field, objs, prefix)
+
+                # add user permissions, one query per object field
                 for (profile_field, object_field) in zip(self.profile_fields, self.object_fields):
                     # e.g.: objs = user.userhospitalpermission_set.all()
-                    objs = getattr(user, 'user' + object_field + 'permission_set').all()
-
-                    # e.g.: self.hospitals.update({e.hospital_id: {...} for e in user.profile.hospitals.all()})
-                    permissions = {}
-                    equipment_permissions = {}
-                    for e in objs:
-                        id = getattr(e, object_field + '_id')
-                        obj = getattr(e, object_field)
-                        permissions[id] = {
-                            object_field: obj,
-                            'can_read': e.can_read,
-                            'can_write': e.can_write
-                        }
-                        equipment_permissions[obj.equipmentholder.id] = {
-                            'equipmentholder': obj.equipmentholder,
-                            'can_read': e.can_read,
-                            'can_write': e.can_write
-                        }
-                    getattr(self, profile_field).update(permissions)
-                    self.equipments.update(equipment_permissions)
-
-            # build permissions
-            for profile_field in self.profile_fields:
-                for (id, obj) in getattr(self, profile_field).items():
-                    if obj['can_read']:
-                        # e.g.: self.can_read['ambulances'].append(obj['id'])
-                        self.can_read[profile_field].append(id)
-                    if obj['can_write']:
-                        # e.g.: self.can_write['ambulances'].append(obj['id'])
-                        self.can_write[profile_field].append(id)
-                # logger.debug('can_read[{}] = {}'.format(profile_field, self.can_read[profile_field]))
-                # logger.debug('can_write[{}] = {}'.format(profile_field, self.can_write[profile_field]))
-
-            # add equipments
-            for (id, obj) in self.equipments.items():
-                if obj['can_read']:
-                    self.can_read['equipments'].append(id)
-                if obj['can_write']:
-                    self.can_write['equipments'].append(id)
+                    objs = getattr(user, 'user' + object_field + 'permission_set').order_by('id')
+                    self.add(flags[profile_field], equipments, object_field, objs)
+
+        # build permissions
+        self.can_read = {}
+        self.can_write = {}
+        for (model, profile_field, object_field) in zip(self.models, self.profile_fields, self.object_fields):
+            # e.g.: self.ambulances = PermissionIndex(Ambulance, 'ambulance', flags['ambulances'])
+            index = PermissionIndex(model, object_field, flags[profile_field])
+            setattr(self, profile_field, index)
+            self.can_read[profile_field] = index.can_read
+            self.can_write[profile_field] = index.can_write
+
+        # add equipments
+        self.equipments = PermissionIndex(EquipmentHolder, 'equipmentholder', equipments)
+        self.can_read['equipments'] = self.equipments.can_read
+        self.can_write['equipments'] = self.equipments.can_write
+
+    @staticmethod
+    def add(flags, equipments, object_field, objs, prefix=''):
+        # later permissions override earlier ones
+        for (id, equipmentholder_id, can_read, can_write) in objs.values_list(prefix + object_field + '_id',
+                                                                               prefix + object_field +
+                                                                               '__equipmentholder_id',
+                                                                               prefix + 'can_read',
+                                                                               prefix + 'can_write'):
+            # groups without permissions
+            if id is None:
+                continue
+            flag = PermissionIndex.flag(can_read, can_write)
+            flags[id] = flag
+            equipments[equipmentholder_id] = flag
 
     def check_can_read(self, **kwargs):
         assert len(kwargs) == 1
@@ -1,19 +1,97 @@
-from django.db.models.signals import post_save, m2m_changed
+from django.db import transaction
+from django.db.models.signals import post_save, pre_save, post_delete, pre_delete, m2m_changed
 from django.dispatch import receiver
 
 from django.contrib.auth.models import User, Group
 
-from mqtt.cache_clear import mqtt_cache_clear
-from .models import UserProfile, GroupProfile
+from mqtt.cache_clear import mqtt_user_cache_clear
+from mqtt.watermark import get_watermark, set_watermark, EFFECTIVE_PERMISSIONS_WATERMARK
+from .models import UserProfile, GroupProfile, UserAmbulancePermission, UserHospitalPermission, \
+    GroupAmbulancePermission, GroupHospitalPermission
+from .permissions import refresh_effective_permissions
+
+# models whose changes affect the permissions of some users
+PERMISSION_MODELS = (UserProfile, GroupProfile,
+                     UserAmbulancePermission, UserHospitalPermission,
+                     GroupAmbulancePermission, GroupHospitalPermission)
 
 
 # Add signal to automatically clear cache when group permissions change
 @receiver(m2m_changed, sender=User.groups.through)
-def user_groups_changed_handler(sender, instance, action, **kwargs):
-    if action == 'post_add' or action == 'post_remove':
+def user_groups_changed_handler(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == 'pre_clear' and reverse:
+
+        # group.user_set, members are gone after the clear
+        instance._permission_users = list(instance.user_set.values_list('id', flat=True))
+
+    elif action == 'post_add' or action == 'post_remove':
+
+        # invalidate permissions cache of the users added or removed
+        if reverse:
+            # group.user_set
+            mqtt_user_cache_clear(pk_set)
+        else:
+            # user.groups
+            mqtt_user_cache_clear([instance.id])
+
+    elif action == 'post_clear':
+
+        # invalidate permissions cache of the users cleared
+        if reverse:
+            # group.user_set
+            mqtt_user_cache_clear(instance.__dict__.pop('_permission_users', []))
+        else:
+            # user.groups
+            mqtt_user_cache_clear([instance.id])
+
+
+# Add signal to automatically clear cache when permissions or profiles change
+def permission_saved_handler(sender, instance, **kwargs):
+
+    # invalidate permissions cache of the affected users
+    mqtt_user_cache_clear(instance.get_permission_users())
+
+
+def permission_pre_delete_handler(sender, instance, **kwargs):
+
+    # affected users, group members are gone after a cascade
+    instance._permission_users = instance.get_permission_users()
+
+
+def permission_deleted_handler(sender, instance, **kwargs):
 
-        # invalidate permissions cache
-        mqtt_cache_clear()
+    # invalidate permissions cache of the affected users
+    mqtt_user_cache_clear(instance.__dict__.pop('_permission_users', []))
+
+
+for model in PERMISSION_MODELS:
+    post_save.connect(permission_saved_handler, sender=model)
+    pre_delete.connect(permission_pre_delete_handler, sender=model)
+    post_delete.connect(permission_deleted_handler, sender=model)
+
+
+# Add signal to automatically clear cache when a user becomes or stops being staff
+@receiver(pre_save, sender=User)
+def user_pre_save_handler(sender, instance, update_fields=None, **kwargs):
+
+    instance._permission_changed = False
+    if instance.pk is None:
+        return
+
+    # only if saving the flags
+    if update_fields is not None and not {'is_staff', 'is_superuser'} & set(update_fields):
+        return
+
+    flags = User.objects.filter(pk=instance.pk).values_list('is_staff', 'is_superuser').first()
+    instance._permission_changed = flags is not None and flags != (instance.is_staff, instance.is_superuser)
+
+
+@receiver(post_save, sender=User)
+def user_post_save_handler(sender, instance, created, **kwargs):
+
+    # invalidate permissions cache of the user
+    if instance.__dict__.pop('_permission_changed', False):
+        mqtt_user_cache_clear([instance.id])
 
 
 # Add signal to automatically extend group profile
@@ -28,3 +106,11 @@ def create_group_profile(sender, instance, created, **kwargs):
 def create_user_profile(sender, instance, created, **kwargs):
     if created:
         UserProfile.objects.create(user=instance)
+
+
+# Materialize permissions once the table is created, recorded like a data migration
+def backfill_effective_permissions(sender, **kwargs):
+    with transaction.atomic():
+        if get_watermark(EFFECTIVE_PERMISSIONS_WATERMARK) is None:
+            refresh_effective_permissions()
+            set_watermark(EFFECTIVE_PERMISSIONS_WATERMARK)
@@ -527,6 +527,64 @@ class TestMQTTACLSubscribe(MyTestCase):
                                     follow=True)
         self.assertEqual(response.status_code, 403)
 
+        # Deltas
+
+        # can subscribe
+        response = self.client.post('/en/auth/mqtt/acl/',
+                                    {'username': 'testuser2',
+                                     'clientid': 'test_client',
+                                     'acc': '1',
+                                     'topic': '/ambulance/{}/delta'.format(self.a3.id)},
+                                    follow=True)
+        self.assertEqual(response.status_code, 200)
+
+        # can't subscribe
+        response = self.client.post('/en/auth/mqtt/acl/',
+                                    {'username': 'testuser2',
+                                     'clientid': 'test_client',
+                                     'acc': '1',
+                                     'topic': '/ambulance/{}/delta'.format(self.a2.id)},
+                                    follow=True)
+        self.assertEqual(response.status_code, 403)
+
+        # can subscribe
+        response = self.client.post('/en/auth/mqtt/acl/',
+                                    {'username': 'testuser1',
+                                     'clientid': 'test_client',
+                                     'acc': '1',
+                                     'topic': '/hospital/{}/delta'.format(self.h1.id)},
+                                    follow=True)
+        self.assertEqual(response.status_code, 200)
+
+        # can't subscribe
+        response = self.client.post('/en/auth/mqtt/acl/',
+                                    {'username': 'testuser1',
+                                     'clientid': 'test_client',
+                                     'acc': '1',
+                                     'topic': '/hospital/{}/delta'.format(self.h2.id)},
+                                    follow=True)
+        self.assertEqual(response.status_code, 403)
+
+        # Telemetry
+
+        # can subscribe
+        response = self.client.post('/en/auth/mqtt/acl/',
+                                    {'username': 'testuser2',
+                                     'clientid': 'test_client',
+                                     'acc': '1',
+                                     'topic': '/ambulance/{}/telemetry'.format(self.a3.id)},
+                                    follow=True)
+        self.assertEqual(response.status_code, 200)
+
+        # can't subscribe
+        response = self.client.post('/en/auth/mqtt/acl/',
+                                    {'username': 'testuser2',
+                                     'clientid': 'test_client',
+                                     'acc': '1',
+                                     'topic': '/ambulance/{}/telemetry'.format(self.a2.id)},
+                                    follow=True)
+        self.assertEqual(response.status_code, 403)
+
 
 class TestMQTTACLPublish(MyTestCase):
 
@@ -588,6 +646,26 @@ class TestMQTTACLPublish(MyTestCase):
                                     follow=True)
         self.assertEqual(response.status_code, 200)
 
+        # Ambulance telemetry
+
+        # can't publish
+        response = self.client.post('/en/auth/mqtt/acl/',
+                                    {'username': 'testuser2',
+                                     'clientid': clientid,
+                                     'acc': '2',
+                                     'topic': '/user/testuser2/client/{}/ambulance/{}/telemetry'.format(clientid, self.a2.id)},
+                                    follow=True)
+        self.assertEqual(response.status_code, 403)
+
+        # can publish
+        response = self.client.post('/en/auth/mqtt/acl/',
+                                    {'username': 'testuser2',
+                                     'clientid': clientid,
+                                     'acc': '2',
+                                     'topic': '/user/testuser2/client/{}/ambulance/{}/telemetry'.format(clientid, self.a3.id)},
+                                    follow=True)
+        self.assertEqual(response.status_code, 200)
+
         # Hospital data
 
         # can't publish
@@ -1,5 +1,16 @@
-from login.permissions import Permissions, get_permissions, cache_info, cache_clear
+import pickle
+
+from django.contrib.auth.models import User, Group
+
+from ambulance.models import Ambulance
+from login.models import UserAmbulancePermission, GroupAmbulancePermission, GroupHospitalPermission, \
+    EffectivePermission
+from login.permissions import Permissions, PermissionCache, get_permissions, get_permission_users, \
+    cache_info, cache_clear, refresh_effective_permissions, check_permission_cache, ALL
+from login.signals import backfill_effective_permissions
 from login.tests.setup_data import TestSetup
+from mqtt.models import Watermark
+from mqtt.watermark import EFFECTIVE_PERMISSIONS_WATERMARK
 
 
 class TestPermissions(TestSetup):
@@ -14,19 +25,20 @@ class TestPermissions(TestSetup):
                           self.h1.equipmentholder.id, self.h2.equipmentholder.id, self.h3.equipmentholder.id}
 
         u = self.u1
-        perms = Permissions(u)
+        with self.assertNumQueries(0):
+            perms = Permissions(u)
         self.assertEqual(3, len(perms.ambulances))
         self.assertEqual(3, len(perms.hospitals))
         self.assertEqual(6, len(perms.equipments))
 
         answer = [self.a1.id, self.a2.id, self.a3.id]
-        self.assertCountEqual(answer, perms.get_can_read('ambulances'))
+        self.assertIs(ALL, perms.get_can_read('ambulances'))
         for id in all_ambulances:
             if id in answer:
                 self.assertTrue(perms.check_can_read(ambulance=id))
             else:
                 self.assertFalse(perms.check_can_read(ambulance=id))
-        self.assertCountEqual(answer, perms.get_can_write('ambulances'))
+        self.assertIs(ALL, perms.get_can_write('ambulances'))
         for id in all_ambulances:
             if id in answer:
                 self.assertTrue(perms.check_can_write(ambulance=id))
@@ -34,13 +46,13 @@ class TestPermissions(TestSetup):
                 self.assertFalse(perms.check_can_write(ambulance=id))
 
         answer = [self.h1.id, self.h2.id, self.h3.id]
-        self.assertCountEqual(answer, perms.get_can_read('hospitals'))
+        self.assertIs(ALL, perms.get_can_read('hospitals'))
         for id in all_hospitals:
             if id in answer:
                 self.assertTrue(perms.check_can_read(hospital=id))
             else:
                 self.assertFalse(perms.check_can_read(hospital=id))
-        self.assertCountEqual(answer, perms.get_can_write('hospitals'))
+        self.assertIs(ALL, perms.get_can_write('hospitals'))
         for id in all_hospitals:
             if id in answer:
                 self.assertTrue(perms.check_can_write(hospital=id))
@@ -49,13 +61,13 @@ class TestPermissions(TestSetup):
 
         answer = [self.a1.equipmentholder.id, self.a2.equipmentholder.id, self.a3.equipmentholder.id,
                   self.h1.equipmentholder.id, self.h2.equipmentholder.id, self.h3.equipmentholder.id]
-        self.assertCountEqual(answer, perms.get_can_read('equipments'))
+        self.assertIs(ALL, perms.get_can_read('equipments'))
         for id in all_equipments:
             if id in answer:
                 self.assertTrue(perms.check_can_read(equipment=id))
             else:
                 self.assertFalse(perms.check_can_read(equipment=id))
-        self.assertCountEqual(answer, perms.get_can_write('equipments'))
+        self.assertIs(ALL, perms.get_can_write('equipments'))
         for id in all_equipments:
             if id in answer:
                 self.assertTrue(perms.check_can_write(equipment=id))
@@ -647,6 +659,7 @@ class TestPermissions(TestSetup):
 
         # clear cache
         cache_clear()
+        start = cache_info()
 
         # retrieve permissions for user u1
         get_permissions(self.u1)
@@ -654,8 +667,8 @@ class TestPermissions(TestSetup):
         get_permissions(self.u1)
         get_permissions(self.u1)
         info = cache_info()
-        self.assertEqual(info.hits, 3)
-        self.assertEqual(info.misses, 1)
+        self.assertEqual(info.hits - start.hits, 3)
+        self.assertEqual(info.misses - start.misses, 1)
         self.assertEqual(info.currsize, 1)
 
         # retrieve permissions for user u2 and u1
@@ -664,14 +677,282 @@ class TestPermissions(TestSetup):
         get_permissions(self.u2)
         get_permissions(self.u1)
         info = cache_info()
-        self.assertEqual(info.hits, 6)
-        self.assertEqual(info.misses, 2)
+        self.assertEqual(info.hits - start.hits, 6)
+        self.assertEqual(info.misses - start.misses, 2)
         self.assertEqual(info.currsize, 2)
 
-        # clear cache
+        # clear cache, statistics are kept
         cache_clear()
 
-        info = cache_info()
-        self.assertEqual(info.hits, 0)
-        self.assertEqual(info.misses, 0)
-        self.assertEqual(info.currsize, 0)
+        self.assertEqual(cache_info(), info._replace(currsize=0))
+
+    def test_shared_cache(self):
+
+        # two processes, checking versions on every lookup
+        cache1 = PermissionCache(ttl=0)
+        cache2 = PermissionCache(ttl=0)
+
+        # built once, shared
+        permissions = cache1.get(self.u2)
+        self.assertIs(cache1.get(self.u2), permissions)
+        cache2.get(self.u2)
+        info = cache2.info()
+        self.assertEqual((info.hits, info.shared_hits, info.misses), (1, 1, 0))
+
+        # per-user invalidation
+        cache1.evict(self.u2.id)
+        cache2.get(self.u2)
+        cache2.get(self.u3)
+        self.assertEqual(cache2.info().misses, 2)
+        cache1.get(self.u3)
+        self.assertEqual(cache1.info().shared_hits, 1)
+
+        # global invalidation
+        cache1.clear()
+        cache2.get(self.u3)
+        self.assertEqual(cache2.info().misses, 3)
+
+        # a version evicted from the shared cache never goes back
+        cache2.shared.delete(cache2.global_key)
+        cache2.get(self.u3)
+        self.assertEqual(cache2.info().misses, 4)
+
+        # changes are seen without a broadcast
+        user = User.objects.create_user(username='permission_cache', password='secret')
+        self.assertFalse(cache2.get(user).check_can_write(ambulance=self.a1.id))
+        UserAmbulancePermission.objects.create(user=user, ambulance=self.a1, can_write=True)
+        self.assertTrue(cache2.get(user).check_can_write(ambulance=self.a1.id))
+
+    def test_local_cache(self):
+
+        # tests run on the default cache, private to this process
+        cache = PermissionCache()
+        self.assertTrue(cache.local)
+        self.assertEqual([warning.id for warning in check_permission_cache(None)], ['login.W001'])
+
+        # a broadcast bumps the versions the sender could not reach
+        cache.get(self.u2)
+        cache.evict(self.u2.id, shared=cache.local)
+        cache.get(self.u2)
+        info = cache.info()
+        self.assertEqual((info.shared_hits, info.misses), (0, 2))
+
+        cache.clear(shared=cache.local)
+        cache.get(self.u2)
+        info = cache.info()
+        self.assertEqual((info.shared_hits, info.misses), (0, 3))
+
+    def test_version_ttl(self):
+
+        class Clock:
+            now = 0.
+
+            def __call__(self):
+                return self.now
+
+        clock = Clock()
+        cache1 = PermissionCache()
+        cache2 = PermissionCache(ttl=5, clock=clock)
+        permissions = cache2.get(self.u2)
+
+        # changes by other processes are seen once the versions are checked again
+        cache1.evict(self.u2.id)
+        clock.now = 4
+        self.assertIs(cache2.get(self.u2), permissions)
+        clock.now = 5
+        self.assertIsNot(cache2.get(self.u2), permissions)
+        self.assertEqual(cache2.info().misses, 2)
+
+        # unchanged versions are trusted for another ttl
+        permissions = cache2.get(self.u2)
+        clock.now = 10
+        self.assertIs(cache2.get(self.u2), permissions)
+        cache1.evict(self.u2.id)
+        clock.now = 14
+        self.assertIs(cache2.get(self.u2), permissions)
+        clock.now = 15
+        self.assertIsNot(cache2.get(self.u2), permissions)
+
+        # local changes are seen right away
+        cache2.evict(self.u2.id)
+        cache2.get(self.u2)
+        self.assertEqual(cache2.info().misses, 4)
+
+    def test_targeted_invalidation(self):
+
+        cache = PermissionCache(ttl=0)
+
+        def misses(*users):
+            before = cache.info().misses
+            for user in users:
+                cache.get(user)
+            return cache.info().misses - before
+
+        misses(self.u1, self.u2, self.u3)
+
+        # user permissions invalidate the user only
+        UserAmbulancePermission.objects.create(user=self.u3, ambulance=self.a2)
+        self.assertEqual(misses(self.u3), 1)
+        self.assertEqual(misses(self.u1, self.u2), 0)
+
+        # group permissions invalidate the members of the group only
+        group = Group.objects.create(name='targeted')
+        group.user_set.add(self.u2)
+        self.assertEqual(misses(self.u2), 1)
+        self.assertEqual(misses(self.u1, self.u3), 0)
+        GroupAmbulancePermission.objects.create(group=group, ambulance=self.a3)
+        self.assertEqual(misses(self.u2), 1)
+        self.assertEqual(misses(self.u1, self.u3), 0)
+
+        # users with permissions on an object
+        self.assertEqual(set(get_permission_users(ambulance=self.a3.id)),
+                         {self.u1.id, self.u8.id, self.u2.id, self.u3.id, self.u5.id})
+
+        # new objects invalidate the users that can see all objects
+        ambulance = Ambulance.objects.create(identifier='targeted', capability='B', updated_by=self.u1)
+        self.assertEqual(misses(self.u1), 1)
+        self.assertEqual(misses(self.u2, self.u3), 0)
+
+        # deleted objects invalidate the users with permissions on them
+        self.a3.delete()
+        self.assertEqual(misses(self.u1, self.u2, self.u3), 3)
+        ambulance.delete()
+        self.assertEqual(misses(self.u1), 1)
+        self.assertEqual(misses(self.u2, self.u3), 0)
+
+    def test_index(self):
+
+        perms = Permissions(self.u3)
+        self.assertIsInstance(perms.get_can_read('ambulances'), frozenset)
+        self.assertIsInstance(perms.get_can_write('equipments'), frozenset)
+
+        # checks do not load objects
+        with self.assertNumQueries(0):
+            self.assertTrue(perms.check_can_write(ambulance=self.a3.id))
+            self.assertFalse(perms.check_can_read(ambulance=self.a1.id))
+            self.assertIn(self.a1.id, perms.ambulances)
+            self.assertEqual(len(perms.ambulances), 2)
+
+        # objects are loaded once, on first access
+        with self.assertNumQueries(1):
+            self.assertEqual(perms.get(ambulance=self.a3.id),
+                             {'ambulance': self.a3, 'can_read': True, 'can_write': True})
+            self.assertEqual(perms.get(ambulance=self.a1.id)['ambulance'], self.a1)
+
+        # and are not pickled
+        restored = pickle.loads(pickle.dumps(perms))
+        self.assertIsNone(restored.ambulances._objects)
+        self.assertEqual(restored.get_can_write('ambulances'), perms.get_can_write('ambulances'))
+        self.assertEqual(restored.get(ambulance=self.a1.id), perms.get(ambulance=self.a1.id))
+
+    def test_queries(self):
+
+        # superusers and staff
+        with self.assertNumQueries(0):
+            perms = Permissions(self.u8)
+        self.assertTrue(perms.check_can_write(ambulance=self.a1.id))
+        self.assertTrue(perms.check_can_write(equipment=self.h1.equipmentholder.id))
+        with self.assertNumQueries(1):
+            self.assertEqual(sorted(perms.ambulances), sorted([self.a1.id, self.a2.id, self.a3.id]))
+
+        # regular users, regardless of the number of groups
+        with self.assertNumQueries(4):
+            perms = Permissions(self.u5)
+        expected = (perms.get_can_read('ambulances'), perms.get_can_write('ambulances'),
+                    perms.get_can_read('hospitals'), perms.get_can_write('equipments'))
+
+        for k in range(10):
+            group = Group.objects.create(name='queries_{}'.format(k))
+            group.groupprofile.priority = 100
+            group.groupprofile.save()
+            GroupAmbulancePermission.objects.create(group=group, ambulance=self.a2, can_read=False)
+            GroupHospitalPermission.objects.create(group=group, hospital=self.h3)
+            self.u5.groups.add(group)
+
+        with self.assertNumQueries(4):
+            perms = Permissions(self.u5)
+
+        # groups with a larger priority override the others
+        self.assertNotIn(self.a2.id, perms.get_can_read('ambulances'))
+        self.assertIn(self.h3.id, perms.get_can_read('hospitals'))
+        self.assertEqual(expected[0] - {self.a2.id}, perms.get_can_read('ambulances'))
+
+    def effective(self, user):
+        return {(object_type, object_id): (can_read, can_write)
+                for (object_type, object_id, can_read, can_write)
+                in EffectivePermission.objects.filter(user=user).values_list('object_type', 'object_id',
+                                                                             'can_read', 'can_write')}
+
+    def expected(self, user):
+        perms = Permissions(user)
+        return {(object_type, id): (perms.check_can_read(**{object_type[:-1]: id}),
+                                    perms.check_can_write(**{object_type[:-1]: id}))
+                for object_type in ('ambulances', 'hospitals', 'equipments')
+                for id in getattr(perms, object_type)
+                if perms.check_can_read(**{object_type[:-1]: id}) or
+                perms.check_can_write(**{object_type[:-1]: id})}
+
+    def test_effective_permissions(self):
+
+        effective = self.effective
+        expected = self.expected
+
+        # kept current as permissions and groups change
+        for user in (self.u2, self.u3, self.u4, self.u5, self.u6, self.u7):
+            self.assertEqual(effective(user), expected(user))
+        self.assertEqual(effective(self.u1), {})
+
+        UserAmbulancePermission.objects.get(user=self.u3, ambulance=self.a3).delete()
+        UserAmbulancePermission.objects.create(user=self.u3, ambulance=self.a2, can_write=True)
+        self.u4.groups.add(self.g3)
+        for user in (self.u3, self.u4):
+            self.assertEqual(effective(user), expected(user))
+        self.assertNotIn(('ambulances', self.a3.id), effective(self.u3))
+        self.assertEqual(effective(self.u3)[('ambulances', self.a2.id)], (True, True))
+
+        # nothing to do when current
+        self.assertEqual(refresh_effective_permissions(), 0)
+        EffectivePermission.objects.filter(user=self.u5).delete()
+        EffectivePermission.objects.filter(user=self.u6).update(can_write=True)
+        self.assertGreater(refresh_effective_permissions([self.u5.id, self.u6.id]), 0)
+        self.assertEqual(effective(self.u5), expected(self.u5))
+        self.assertEqual(effective(self.u6), expected(self.u6))
+
+    def test_effective_permissions_signals(self):
+
+        # queryset deletes, as in the admin
+        self.assertIn(('hospitals', self.h2.id), self.effective(self.u4))
+        GroupHospitalPermission.objects.filter(group=self.g2).delete()
+        self.assertEqual(self.effective(self.u4), {})
+
+        # clearing groups, from either side
+        self.u6.groups.clear()
+        self.assertEqual(self.effective(self.u6), {})
+        self.g3.user_set.clear()
+        self.assertNotIn(('ambulances', self.a3.id), self.effective(self.u5))
+        self.assertEqual(self.effective(self.u5), self.expected(self.u5))
+
+        # deleting a group cascades to its permissions
+        self.assertNotEqual(self.effective(self.u5), {})
+        self.g1.delete()
+        self.assertEqual(self.effective(self.u5), {})
+
+        # staff can see everything, nothing is materialized
+        self.u7.is_staff = True
+        self.u7.save()
+        self.assertEqual(self.effective(self.u7), {})
+        self.u7.is_staff = False
+        self.u7.save()
+        self.assertNotEqual(self.effective(self.u7), {})
+        self.assertEqual(self.effective(self.u7), self.expected(self.u7))
+
+        # backfilled once after migrating
+        Watermark.objects.filter(name=EFFECTIVE_PERMISSIONS_WATERMARK).delete()
+        EffectivePermission.objects.all().delete()
+        backfill_effective_permissions(None)
+        self.assertEqual(self.effective(self.u7), self.expected(self.u7))
+
+        # later migrations do not refresh again, even with no rows
+        EffectivePermission.objects.all().delete()
+        backfill_effective_permissions(None)
+        self.assertEqual(self.effective(self.u7), {})
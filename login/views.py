@@ -485,9 +485,10 @@ class MQTTAclView(CsrfExemptMixin,
                         return HttpResponse('OK')
 
                 #  - hospital/{hospital-id}/data
+                #  - hospital/{hospital-id}/delta
                 elif (len(topic) == 3 and
                       topic[0] == 'hospital' and
-                      topic[2] == 'data'):
+                      (topic[2] == 'data' or topic[2] == 'delta')):
 
                     # get hospital id
                     hospital_id = int(topic[1])
@@ -531,6 +532,8 @@ class MQTTAclView(CsrfExemptMixin,
                         pass
 
                 #  - ambulance/{ambulance-id}/data
+                #  - ambulance/{ambulance-id}/delta
+                #  - ambulance/{ambulance-id}/telemetry
                 #  - ambulance/{ambulance-id}/call/{call-id}/status
                 elif (len(topic) >= 3 and
                       topic[0] == 'ambulance'):
@@ -545,7 +548,7 @@ class MQTTAclView(CsrfExemptMixin,
                         can_read = get_permissions(user).check_can_read(ambulance=ambulance_id)
 
                         if (can_read and
-                                ((len(topic) == 3 and topic[2] == 'data') or
+                                ((len(topic) == 3 and topic[2] in ('data', 'delta', 'telemetry')) or
                                  (len(topic) == 5 and topic[2] == 'call' and topic[4] == 'status'))):
                             return HttpResponse('OK')
 
@@ -602,10 +605,11 @@ class MQTTAclView(CsrfExemptMixin,
                         return HttpResponse('OK')
 
                     #  - user/{username}/client/{client-id}/ambulance/{ambulance-id}/data
+                    #  - user/{username}/client/{client-id}/ambulance/{ambulance-id}/telemetry
                     #  - user/{username}/client/{client-id}/ambulance/{ambulance-id}/call/{call-id}/status
                     #  - user/{username}/client/{client-id}/ambulance/{ambulance-id}/call/{call-id}/waypoint/{waypoint_id}/data
                     elif (topic[4] == 'ambulance' and
-                          ((len(topic) == 7 and topic[6] == 'data') or
+                          ((len(topic) == 7 and topic[6] in ('data', 'telemetry')) or
                            (len(topic) == 9 and topic[6] == 'call' and topic[8] == 'status') or
                            (len(topic) == 11 and
                             topic[6] == 'call' and topic[8] == 'waypoint' and topic[10] == 'data'))):
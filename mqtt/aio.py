@@ -0,0 +1,274 @@
+import asyncio
+import logging
+import signal
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+import paho.mqtt.client as mqtt
+
+from django.db import close_old_connections
+
+logger = logging.getLogger(__name__)
+
+RECONNECT_MIN_DELAY = 1
+RECONNECT_MAX_DELAY = 60
+
+
+# KeyedExecutor
+
+class KeyedExecutor:
+    """
+    Runs blocking calls on a bounded thread pool from an asyncio loop.
+
+    Calls submitted with the same key run one after the other in submission
+    order, calls with different keys (or no key) may run in parallel. Once
+    max_pending calls are in flight pause() is called, and resume() is called
+    when half of them have completed; use them to stop reading new work.
+    """
+
+    def __init__(self, loop, workers=8, max_pending=1000, pause=None, resume=None):
+        self.loop = loop
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='mqtt-aio')
+        self.max_pending = max_pending
+        self.pause = pause
+        self.resume = resume
+        self.paused = False
+        self.tasks = set()
+        self.tails = {}
+
+    def submit(self, key, fn, *args, **kwargs):
+        """
+        Schedules fn(*args, **kwargs). Must be called from the loop thread.
+        """
+
+        previous = self.tails.get(key) if key is not None else None
+        task = self.loop.create_task(self.execute(previous, partial(fn, *args, **kwargs)))
+        task.add_done_callback(partial(self.done, key))
+        self.tasks.add(task)
+        if key is not None:
+            self.tails[key] = task
+
+        # too much in flight?
+        if not self.paused and len(self.tasks) >= self.max_pending:
+            self.paused = True
+            if self.pause is not None:
+                self.pause()
+
+        return task
+
+    async def execute(self, previous, call):
+
+        # wait for the previous call with the same key
+        if previous is not None:
+            await asyncio.wait([previous])
+
+        await self.loop.run_in_executor(self.executor, self.call, call)
+
+    @staticmethod
+    def call(call):
+        close_old_connections()
+        try:
+            call()
+        except Exception as e:
+            logger.exception('KeyedExecutor: unhandled exception: {}'.format(e))
+
+    def done(self, key, task):
+
+        self.tasks.discard(task)
+        if key is not None and self.tails.get(key) is task:
+            del self.tails[key]
+
+        # drained enough?
+        if self.paused and len(self.tasks) <= self.max_pending // 2:
+            self.paused = False
+            if self.resume is not None:
+                self.resume()
+
+    def __len__(self):
+        return len(self.tasks)
+
+    async def shutdown(self, timeout=10):
+        """
+        Waits up to timeout seconds for calls in flight, then cancels the calls
+        that have not started. Calls already running are allowed to finish.
+        """
+
+        if self.tasks:
+            (done, pending) = await asyncio.wait(list(self.tasks), timeout=timeout)
+            if pending:
+                logger.warning('KeyedExecutor: cancelling {} pending calls'.format(len(pending)))
+                for task in pending:
+                    task.cancel()
+                await asyncio.gather(*pending, return_exceptions=True)
+
+        await self.loop.run_in_executor(None, partial(self.executor.shutdown, wait=True))
+
+
+# AsyncioEngine
+
+class AsyncioEngine:
+    """
+    Runs a SubscribeClient on an asyncio loop instead of paho's threaded loop.
+
+    The paho socket is driven by the asyncio loop and handlers run on a
+    KeyedExecutor, with the same per-object ordering as the worker pool.
+    Reading from the broker stops while max_pending messages are in flight.
+    """
+
+    def __init__(self, subscriber, workers=8, max_pending=1000, shutdown_timeout=10):
+        self.subscriber = subscriber
+        self.client = subscriber.client
+        self.workers = workers
+        self.max_pending = max_pending
+        self.shutdown_timeout = shutdown_timeout
+        self.loop = None
+        self.executor = None
+        self.stopping = None
+        self.reading = False
+        self.thread = None
+
+    def run(self):
+        """
+        Runs until stop() is called or the process receives SIGINT or SIGTERM.
+        """
+        loop = asyncio.new_event_loop()
+        try:
+            asyncio.set_event_loop(loop)
+            loop.run_until_complete(self.main(loop))
+        finally:
+            loop.close()
+
+    def stop(self):
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.stopping.set)
+
+    async def main(self, loop):
+
+        self.loop = loop
+        self.thread = threading.current_thread()
+        self.stopping = asyncio.Event()
+        self.executor = KeyedExecutor(loop, workers=self.workers, max_pending=self.max_pending,
+                                      pause=self.pause_reading, resume=self.resume_reading)
+
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(signum, self.stopping.set)
+            except (NotImplementedError, RuntimeError):
+                pass
+
+        # drive the paho socket from the loop
+        self.client.on_socket_open = self.on_socket_open
+        self.client.on_socket_close = self.on_socket_close
+        self.client.on_socket_register_write = self.on_socket_register_write
+        self.client.on_socket_unregister_write = self.on_socket_unregister_write
+
+        # socket opened by BaseClient before the loop existed
+        sock = self.client.socket()
+        if sock is not None:
+            self.on_socket_open(self.client, None, sock)
+            if self.client.want_write():
+                self.on_socket_register_write(self.client, None, sock)
+
+        # handlers go to the executor
+        self.subscriber.engine = self
+
+        misc = loop.create_task(self.misc())
+        try:
+            await self.stopping.wait()
+        finally:
+            await self.shutdown()
+            misc.cancel()
+            await asyncio.gather(misc, return_exceptions=True)
+
+    async def shutdown(self):
+
+        # stop taking new messages
+        self.pause_reading()
+
+        # flush pending position updates
+        if self.subscriber.coalescer is not None:
+            await self.loop.run_in_executor(None, self.subscriber.coalescer.stop)
+
+        # finish work in flight
+        await self.executor.shutdown(timeout=self.shutdown_timeout)
+
+        # disconnect and wait for the socket to close
+        await self.loop.run_in_executor(None, self.subscriber.disconnect)
+        for _ in range(50):
+            if self.client.socket() is None:
+                break
+            await asyncio.sleep(0.1)
+
+    async def misc(self):
+
+        delay = RECONNECT_MIN_DELAY
+        while True:
+
+            # keepalive and retries; reconnect if connection was lost
+            if self.client.loop_misc() == mqtt.MQTT_ERR_NO_CONN and not self.stopping.is_set():
+                try:
+                    await self.loop.run_in_executor(None, self.client.reconnect)
+                    delay = RECONNECT_MIN_DELAY
+
+                except (OSError, ValueError) as e:
+                    logger.warning('AsyncioEngine: could not reconnect: {}'.format(e))
+                    await asyncio.sleep(delay)
+                    delay = min(2 * delay, RECONNECT_MAX_DELAY)
+                    continue
+
+            await asyncio.sleep(1)
+
+    def submit(self, key, fn, *args, **kwargs):
+
+        # may be called from handler or coalescer threads
+        if threading.current_thread() is self.thread:
+            self.executor.submit(key, fn, *args, **kwargs)
+        else:
+            self.loop.call_soon_threadsafe(partial(self.executor.submit, key, fn, *args, **kwargs))
+
+    def call_in_loop(self, fn, *args):
+        if threading.current_thread() is self.thread:
+            fn(*args)
+        else:
+            self.loop.call_soon_threadsafe(fn, *args)
+
+    # backpressure
+
+    def pause_reading(self):
+        sock = self.client.socket()
+        if self.reading and sock is not None:
+            self.loop.remove_reader(sock)
+        self.reading = False
+
+    def resume_reading(self):
+        sock = self.client.socket()
+        if not self.reading and sock is not None and not self.stopping.is_set():
+            self.loop.add_reader(sock, self.client.loop_read)
+            self.reading = True
+
+    # paho socket callbacks
+
+    def on_socket_open(self, client, userdata, sock):
+        def add():
+            if self.executor is None or not self.executor.paused:
+                self.loop.add_reader(sock, client.loop_read)
+                self.reading = True
+        self.call_in_loop(add)
+
+    def on_socket_close(self, client, userdata, sock):
+        def remove():
+            try:
+                self.loop.remove_reader(sock)
+                self.loop.remove_writer(sock)
+            except (ValueError, OSError):
+                # already closed
+                pass
+            self.reading = False
+        self.call_in_loop(remove)
+
+    def on_socket_register_write(self, client, userdata, sock):
+        self.call_in_loop(self.loop.add_writer, sock, client.loop_write)
+
+    def on_socket_unregister_write(self, client, userdata, sock):
+        self.call_in_loop(self.loop.remove_writer, sock)
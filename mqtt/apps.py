@@ -0,0 +1,11 @@
+from django.apps import AppConfig
+
+
+class MqttConfig(AppConfig):
+    name = 'mqtt'
+
+    def ready(self):
+
+        # record tombstones of deleted objects
+        from .watermark import connect
+        connect()
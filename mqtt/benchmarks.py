@@ -0,0 +1,832 @@
+import json
+import os
+import pickle
+import random
+import tempfile
+import threading
+import time
+import tracemalloc
+from datetime import timedelta
+from functools import partial
+from io import BytesIO
+
+from django.contrib.auth.models import User, Group
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from paho.mqtt.client import MQTTMessage, topic_matches_sub
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+
+from ambulance.models import Ambulance, AmbulanceCapability, AmbulanceStatus, AmbulanceUpdate
+from ambulance.serializers import AmbulanceSerializer, AmbulanceUpdateSerializer
+from equipment.models import EquipmentHolder
+from hospital.models import Hospital
+from login.models import GroupAmbulancePermission, GroupHospitalPermission
+from login.permissions import Permissions
+from .broker import LocalBroker, LocalClient
+from .coalesce import Coalescer
+from .collector import PublishCollector
+from .delta import DeltaEncoder, DELTA_SNAPSHOT_INTERVAL
+from .models import Outbox
+from .outbox import OutboxRelay
+from .payloads import PayloadCache
+from .publish import PublishClient
+from .router import TopicRouter
+from .spool import MemorySpool, SQLiteSpool, DROP_OLDEST, COALESCE, SPOOL_SIZE
+from .telemetry import AmbulanceTelemetry, parse_json, encode_telemetry
+from .subscribe import SubscribeClient
+from .workers import WorkerPool
+
+
+# Synthetic traffic
+
+def make_message(topic, payload):
+    msg = MQTTMessage(topic=topic.encode())
+    msg.payload = payload
+    return msg
+
+
+def make_ambulance_messages(messages, ambulances):
+    """
+    Returns a list of location updates round-robin over a fleet of ambulances.
+    """
+    return [make_message('user/bench/client/bench_{0}/ambulance/{0}/data'.format(k % ambulances),
+                         '{{"location":{{"latitude":32.5149,"longitude":-117.0382}},"seq":{}}}'
+                         .format(k).encode())
+            for k in range(messages)]
+
+
+def make_router(handler):
+    """
+    Returns a router for the SubscribeClient routes with all topics going to handler.
+    """
+    return TopicRouter((pattern, handler, key) for (pattern, _, key) in SubscribeClient.routes)
+
+
+def shard_key(router, topic):
+    (route, params) = router.match(topic)
+    return route.key.format(**params)
+
+
+def make_local_subscriber(broker, handler, **kwargs):
+    """
+    Returns a SubscribeClient connected to a LocalBroker with all topics going to handler.
+    """
+    client = SubscribeClient({'USERNAME': '', 'PASSWORD': '', 'HOST': 'localhost', 'PORT': 1883,
+                              'KEEPALIVE': 60, 'CLIENT_ID': '', 'CLEAN_SESSION': True},
+                             client_class=partial(LocalClient, broker=broker),
+                             verbosity=0,
+                             **kwargs)
+    client.router = make_router(handler)
+    return client
+
+
+def rate(messages, seconds):
+    return round(messages / seconds, 1) if seconds > 0 else float('inf')
+
+
+# Benchmarks
+
+def benchmark_workers(messages=10000, ambulances=100, workers=8, latency=1.0, **kwargs):
+    """
+    Compare serial dispatch against the worker pool, using a handler
+    that sleeps for latency milliseconds in place of a database write.
+    """
+
+    traffic = make_ambulance_messages(messages, ambulances)
+    router = make_router(None)
+    delay = latency / 1000
+
+    lock = threading.Lock()
+    last = {}
+    out_of_order = [0]
+
+    def handler(clnt, userdata, msg):
+        time.sleep(delay)
+
+        # check per-ambulance ordering
+        key = shard_key(router, msg.topic)
+        seq = json.loads(msg.payload)['seq']
+        with lock:
+            if last.get(key, -1) > seq:
+                out_of_order[0] += 1
+            last[key] = seq
+
+    results = []
+
+    # serial
+    start = time.perf_counter()
+    for msg in traffic:
+        handler(None, None, msg)
+    elapsed = time.perf_counter() - start
+    results.append(('serial', {'messages': messages,
+                               'seconds': round(elapsed, 3),
+                               'messages/s': rate(messages, elapsed)}))
+
+    # worker pool
+    last.clear()
+    pool = WorkerPool(workers)
+    start = time.perf_counter()
+    for msg in traffic:
+        pool.submit(shard_key(router, msg.topic), handler, None, None, msg)
+    pool.join()
+    elapsed = time.perf_counter() - start
+    pool.shutdown()
+    results.append(('workers={}'.format(workers), {'messages': messages,
+                                                   'seconds': round(elapsed, 3),
+                                                   'messages/s': rate(messages, elapsed),
+                                                   'out of order': out_of_order[0]}))
+
+    return results
+
+
+def benchmark_router(messages=10000, ambulances=100, **kwargs):
+    """
+    Compare the topic router against wildcard matching followed by splitting the topic.
+    """
+
+    router = make_router(None)
+    filters = router.subscriptions()
+
+    # mix of topics, mostly location updates
+    topics = []
+    for k in range(messages):
+        if k % 10 == 0:
+            topics.append('user/bench/client/bench_{0}/ambulance/{0}/call/{1}/status'.format(k % ambulances, k))
+        elif k % 10 == 1:
+            topics.append('user/bench/client/bench_{0}/hospital/{0}/data'.format(k % ambulances))
+        else:
+            topics.append('user/bench/client/bench_{0}/ambulance/{0}/data'.format(k % ambulances))
+
+    def split_and_branch(topic):
+
+        # paho callback lookup
+        for sub in filters:
+            if topic_matches_sub(sub, topic):
+                break
+
+        # parse_topic
+        values = topic.split('/')
+        if len(values) == 5:
+            return values[1], values[3]
+        elif len(values) == 7:
+            return values[1], values[3], values[5]
+        elif len(values) == 9:
+            return values[1], values[3], values[5], values[7]
+        elif len(values) == 11:
+            return values[1], values[3], values[5], values[7], values[9]
+
+    results = []
+    for (name, fn) in (('split', split_and_branch), ('router', router.match)):
+        start = time.perf_counter()
+        for topic in topics:
+            fn(topic)
+        elapsed = time.perf_counter() - start
+        results.append((name, {'messages': messages,
+                               'seconds': round(elapsed, 3),
+                               'us/message': round(1e6 * elapsed / messages, 2)}))
+
+    return results
+
+
+def benchmark_coalesce(messages=10000, ambulances=100, latency=1.0, window=0.05, pings=5, **kwargs):
+    """
+    Count the writes issued with and without coalescing for ambulances sending
+    pings position updates per coalescing window. Writes are simulated by
+    sleeping for latency milliseconds.
+    """
+
+    traffic = make_ambulance_messages(messages, ambulances)
+    router = make_router(None)
+    delay = latency / 1000
+    interval = window / pings
+
+    writes = [0]
+
+    def write(msg):
+        time.sleep(delay)
+        writes[0] += 1
+
+    def replay(handle):
+        # one ping per ambulance every interval
+        for k in range(0, messages, ambulances):
+            start = time.perf_counter()
+            for msg in traffic[k:k + ambulances]:
+                handle(msg)
+            time.sleep(max(0, interval - (time.perf_counter() - start)))
+
+    results = []
+
+    # every message is written
+    start = time.perf_counter()
+    replay(write)
+    elapsed = time.perf_counter() - start
+    results.append(('direct', {'messages': messages,
+                               'writes': writes[0],
+                               'seconds': round(elapsed, 3)}))
+
+    # latest message per ambulance per window is written
+    writes[0] = 0
+    coalescer = None
+
+    def expire(key):
+        (msg, _) = coalescer.pop(key)
+        write(msg)
+
+    coalescer = Coalescer(window, expire)
+    start = time.perf_counter()
+    replay(lambda msg: coalescer.add(shard_key(router, msg.topic), msg))
+    coalescer.stop()
+    elapsed = time.perf_counter() - start
+    info = coalescer.info()
+    results.append(('coalesce={}s'.format(window), {'messages': messages,
+                                                    'writes': writes[0],
+                                                    'coalesced': info.coalesced,
+                                                    'seconds': round(elapsed, 3),
+                                                    'write reduction': round(messages / max(writes[0], 1), 1)}))
+
+    return results
+
+
+def benchmark_bulk(messages=10000, **kwargs):
+    """
+    Compare saving a batch of messages ambulance updates one row at a time
+    against the bulk path used by list payloads. Nothing is committed.
+    """
+
+    start = timezone.now() - timedelta(seconds=messages)
+    data = [{'location': {'latitude': 32.5149 + 1e-5 * k, 'longitude': -117.0382},
+             'timestamp': (start + timedelta(seconds=k)).isoformat()}
+            for k in range(messages)]
+
+    results = []
+    with transaction.atomic():
+
+        user = User.objects.create_user(username='benchmark_bulk')
+        ambulance = Ambulance.objects.create(identifier='benchmark_bulk',
+                                             capability=AmbulanceCapability.B.name,
+                                             updated_by=user)
+
+        serializer = AmbulanceUpdateSerializer(data=data, many=True, partial=True)
+        serializer.is_valid(raise_exception=True)
+
+        # one row at a time
+        begin = time.perf_counter()
+        for update in serializer.validated_data:
+            AmbulanceUpdate(ambulance=ambulance,
+                            capability=ambulance.capability,
+                            status=ambulance.status,
+                            updated_by=user,
+                            **update).save()
+        elapsed = time.perf_counter() - begin
+        results.append(('save', {'messages': messages,
+                                 'seconds': round(elapsed, 3),
+                                 'messages/s': rate(messages, elapsed)}))
+
+        # bulk
+        begin = time.perf_counter()
+        serializer.save(ambulance=ambulance, updated_by=user)
+        elapsed = time.perf_counter() - begin
+        results.append(('bulk_create', {'messages': messages,
+                                        'seconds': round(elapsed, 3),
+                                        'messages/s': rate(messages, elapsed)}))
+
+        transaction.set_rollback(True)
+
+    return results
+
+
+def benchmark_telemetry(messages=10000, **kwargs):
+    """
+    Compare the CPU time per message of parsing and validating ambulance
+    updates with AmbulanceSerializer against the telemetry fast path.
+    """
+
+    payloads = []
+    for k in range(messages):
+        data = {'location': {'latitude': 32.5149 + 1e-5 * k, 'longitude': -117.0382},
+                'orientation': float(k % 360),
+                'timestamp': timezone.now().isoformat()}
+        if k % 10 == 0:
+            data['status'] = AmbulanceStatus.PB.name
+            data['comment'] = 'en route'
+        payloads.append(json.dumps(data).encode())
+
+    ambulance = Ambulance(identifier='benchmark_telemetry')
+    telemetry = AmbulanceTelemetry()
+
+    def serializer(payload):
+        data = JSONParser().parse(BytesIO(payload))
+        serializer = AmbulanceSerializer(ambulance, data=data, partial=True)
+        serializer.is_valid(raise_exception=True)
+
+    def fast_path(payload):
+        data = parse_json(payload)
+        if telemetry.validate(data) is None:
+            serializer = AmbulanceSerializer(ambulance, data=data, partial=True)
+            serializer.is_valid(raise_exception=True)
+
+    results = []
+    for (name, fn) in (('serializer', serializer), ('telemetry', fast_path)):
+        start = time.process_time()
+        for payload in payloads:
+            fn(payload)
+        elapsed = time.process_time() - start
+        results.append((name, {'messages': messages,
+                               'cpu seconds': round(elapsed, 3),
+                               'us/message': round(1e6 * elapsed / messages, 2)}))
+
+    return results
+
+
+def benchmark_binary(messages=10000, **kwargs):
+    """
+    Compare the size and the CPU time per message of encoding and of decoding
+    ambulance telemetry as JSON, through the telemetry fast path, against the
+    binary encoding.
+    """
+
+    from django.contrib.gis.geos import Point
+
+    telemetry = AmbulanceTelemetry()
+    renderer = JSONRenderer()
+
+    updates = []
+    for k in range(messages):
+        data = {'location': Point(-117.0382, 32.5149 + 1e-5 * k, srid=telemetry.location_srid),
+                'orientation': float(k % 360),
+                'timestamp': timezone.now()}
+        if k % 10 == 0:
+            data['status'] = AmbulanceStatus.PB.name
+        updates.append(data)
+
+    def encode_json(data):
+        location = data['location']
+        message = {'location': {'latitude': location.y, 'longitude': location.x},
+                   'orientation': data['orientation'],
+                   'timestamp': data['timestamp']}
+        if 'status' in data:
+            message['status'] = data['status']
+        return renderer.render(message)
+
+    def decode_json(payload):
+        return telemetry.validate(parse_json(payload))
+
+    results = []
+    for (name, encode, decode) in (('json', encode_json, decode_json),
+                                   ('binary', lambda data: encode_telemetry(**data), telemetry.decode)):
+
+        start = time.process_time()
+        payloads = [encode(data) for data in updates]
+        encoding = time.process_time() - start
+
+        start = time.process_time()
+        for payload in payloads:
+            if decode(payload) is None:
+                raise ValueError('Could not decode {}'.format(payload))
+        decoding = time.process_time() - start
+
+        results.append((name, {'messages': messages,
+                               'bytes/message': round(sum(len(payload) for payload in payloads) / messages, 1),
+                               'encode us/message': round(1e6 * encoding / messages, 2),
+                               'decode us/message': round(1e6 * decoding / messages, 2)}))
+
+    return results
+
+
+def benchmark_partitions(messages=10000, ambulances=100, latency=1.0, **kwargs):
+    """
+    Split traffic across 1, 2, 4 and 8 partitioned subscribers on a local broker,
+    using a handler that sleeps for latency milliseconds in place of a database write.
+    """
+
+    traffic = make_ambulance_messages(messages, ambulances)
+    router = make_router(None)
+    delay = latency / 1000
+
+    results = []
+    for partitions in (1, 2, 4, 8):
+
+        lock = threading.Lock()
+        handled = {}
+        last = {}
+        out_of_order = [0]
+
+        def handler(clnt, userdata, msg, **params):
+            time.sleep(delay)
+
+            # check per-ambulance ordering
+            key = shard_key(router, msg.topic)
+            seq = json.loads(msg.payload)['seq']
+            with lock:
+                if last.get(key, -1) > seq:
+                    out_of_order[0] += 1
+                last[key] = seq
+                handled[clnt] = handled.get(clnt, 0) + 1
+
+        broker = LocalBroker()
+        clients = [make_local_subscriber(broker, handler, partitions=partitions, partition=k)
+                   for k in range(partitions)]
+        for client in clients:
+            client.loop_start()
+            client.client.join()
+
+        start = time.perf_counter()
+        for msg in traffic:
+            broker.publish(msg.topic, msg.payload, 2)
+        for client in clients:
+            client.client.join()
+        elapsed = time.perf_counter() - start
+
+        for client in clients:
+            client.disconnect()
+            client.loop_stop()
+
+        results.append(('partitions={}'.format(partitions),
+                        {'messages': messages,
+                         'seconds': round(elapsed, 3),
+                         'messages/s': rate(messages, elapsed),
+                         'largest partition': max(handled.values()),
+                         'out of order': out_of_order[0]}))
+
+    return results
+
+
+def benchmark_spool(ambulances=100, interval=5, outage=1800, spool_size=SPOOL_SIZE, **kwargs):
+    """
+    Simulate a broker outage of outage seconds while a fleet of ambulances
+    publishes every interval seconds, then drain the spool on reconnect.
+    """
+
+    messages = ambulances * int(outage / interval)
+    payload = b'{"location":{"latitude":32.5149,"longitude":-117.0382},"status":"AV"}'
+
+    class Clock:
+        now = 0.
+
+        def __call__(self):
+            return self.now
+
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+
+        for (name, policy) in (('memory', DROP_OLDEST), ('memory', COALESCE),
+                               ('sqlite', DROP_OLDEST), ('sqlite', COALESCE)):
+
+            clock = Clock()
+            if name == 'memory':
+                spool = MemorySpool(maxsize=spool_size, overflow=policy, clock=clock)
+            else:
+                spool = SQLiteSpool(os.path.join(directory, '{}.sqlite'.format(policy)),
+                                    maxsize=spool_size, overflow=policy, clock=clock)
+
+            # outage
+            start = time.perf_counter()
+            for k in range(messages):
+                clock.now = k * interval / ambulances
+                spool.append('ambulance/{}/data'.format(k % ambulances), payload, 2, False)
+            append = time.perf_counter() - start
+            info = spool.info()
+
+            # reconnect
+            start = time.perf_counter()
+            while len(spool) > 0:
+                spool.drain(lambda message: None)
+            drain = time.perf_counter() - start
+            spool.close()
+
+            results.append(('{} {}'.format(name, policy), {'messages': messages,
+                                                            'depth': info.depth,
+                                                            'age s': round(info.age, 1),
+                                                            'dropped': info.dropped,
+                                                            'coalesced': info.coalesced,
+                                                            'us/append': round(1e6 * append / messages, 2),
+                                                            'drain seconds': round(drain, 3)}))
+
+    return results
+
+
+def benchmark_collector(transactions=1000, updates=10, **kwargs):
+    """
+    Compare publishing every save of an ambulance made inside a transaction
+    against collecting the publishes until commit. Objects are deleted at the end.
+    """
+
+    class ImmediateCollector(PublishCollector):
+
+        def add(self, key, fn, *args):
+            fn(*args)
+
+    broker = LocalBroker()
+    subscriber = LocalClient(broker=broker)
+    subscriber.connect()
+    subscriber.subscribe('ambulance/#')
+    received = [0]
+    subscriber.on_message = lambda client, userdata, msg: received.__setitem__(0, received[0] + 1)
+
+    user = User.objects.create_user(username='benchmark_collector')
+    ambulance = Ambulance.objects.create(identifier='benchmark_collector',
+                                         capability=AmbulanceCapability.B.name,
+                                         updated_by=user)
+
+    results = []
+    try:
+        for (name, collector) in (('immediate', ImmediateCollector()), ('on commit', PublishCollector())):
+
+            client = PublishClient({'USERNAME': '', 'PASSWORD': '', 'HOST': 'localhost', 'PORT': 1883,
+                                    'KEEPALIVE': 60, 'CLIENT_ID': '', 'CLEAN_SESSION': True},
+                                   client_class=partial(LocalClient, broker=broker),
+                                   collector=collector,
+                                   verbosity=0)
+            client.loop()
+
+            received[0] = 0
+            start = time.perf_counter()
+            for _ in range(transactions):
+                with transaction.atomic():
+                    for _ in range(updates):
+                        client.publish_ambulance(ambulance)
+            elapsed = time.perf_counter() - start
+
+            client.disconnect()
+            while subscriber.pending():
+                subscriber.loop(timeout=0)
+
+            results.append((name, {'transactions': transactions,
+                                   'published': received[0],
+                                   'seconds': round(elapsed, 3),
+                                   'transactions/s': rate(transactions, elapsed)}))
+
+    finally:
+        ambulance.delete()
+        user.delete()
+
+    return results
+
+
+def benchmark_outbox(requests=200, latency=0.05, **kwargs):
+    """
+    Compare the latency of a request that saves an ambulance when publishing
+    to the broker against writing to the outbox, with the broker up, slow
+    (latency seconds per publish) and down, then relay the outbox.
+    Objects are deleted at the end.
+    """
+
+    class SlowClient(LocalClient):
+
+        def publish(self, *args, **kwargs):
+            time.sleep(latency)
+            return super().publish(*args, **kwargs)
+
+    broker = LocalBroker()
+    queryset = Outbox.objects.filter(id__gt=Outbox.objects.order_by('-id').values_list('id', flat=True).first() or 0)
+    user = User.objects.create_user(username='benchmark_outbox')
+    ambulance = Ambulance.objects.create(identifier='benchmark_outbox',
+                                         capability=AmbulanceCapability.B.name,
+                                         updated_by=user)
+
+    results = []
+    try:
+        for state in ('up', 'slow', 'down'):
+            for outbox in (False, True):
+
+                client = PublishClient({'USERNAME': '', 'PASSWORD': '', 'HOST': 'localhost', 'PORT': 1883,
+                                        'KEEPALIVE': 60, 'CLIENT_ID': '', 'CLEAN_SESSION': True},
+                                       client_class=partial(SlowClient if state == 'slow' else LocalClient,
+                                                            broker=broker),
+                                       outbox=outbox,
+                                       verbosity=0)
+                client.loop()
+                if state == 'down':
+                    client.client.disconnect()
+                    client.loop()
+
+                elapsed = []
+                for k in range(requests):
+                    start = time.perf_counter()
+                    with transaction.atomic():
+                        ambulance.comment = 'request {}'.format(k)
+                        ambulance.save(publish=False)
+                        client.publish_ambulance(ambulance)
+                    elapsed.append(time.perf_counter() - start)
+
+                client.disconnect()
+                elapsed.sort()
+                results.append(('{} {}'.format('outbox' if outbox else 'publish', state),
+                                {'requests': requests,
+                                 'p50 ms': round(1e3 * elapsed[len(elapsed) // 2], 2),
+                                 'p99 ms': round(1e3 * elapsed[int(.99 * (len(elapsed) - 1))], 2),
+                                 'outbox depth': queryset.count()}))
+
+        # relay
+        client = PublishClient({'USERNAME': '', 'PASSWORD': '', 'HOST': 'localhost', 'PORT': 1883,
+                                'KEEPALIVE': 60, 'CLIENT_ID': '', 'CLEAN_SESSION': True},
+                               client_class=partial(LocalClient, broker=broker),
+                               verbosity=0)
+        client.loop()
+        relay = OutboxRelay(client, queryset=queryset)
+        start = time.perf_counter()
+        relay.drain()
+        elapsed = time.perf_counter() - start
+        client.disconnect()
+        results.append(('relay', {'entries': relay.relayed,
+                                  'published': relay.published,
+                                  'seconds': round(elapsed, 3),
+                                  'entries/s': rate(relay.relayed, elapsed)}))
+
+    finally:
+        queryset.delete()
+        ambulance.delete()
+        user.delete()
+
+    return results
+
+
+def benchmark_payloads(ambulances=100, rounds=10, **kwargs):
+    """
+    Compare rendering the payloads of unchanged ambulances, as when seeding
+    repeatedly, with and without the payload cache. Nothing is committed.
+    """
+
+    results = []
+    with transaction.atomic():
+
+        user = User.objects.create_user(username='benchmark_payloads')
+        objects = [Ambulance.objects.create(identifier='benchmark_payloads_{}'.format(k),
+                                            capability=AmbulanceCapability.B.name,
+                                            updated_by=user)
+                   for k in range(ambulances)]
+
+        for cache in (None, PayloadCache(maxsize=ambulances)):
+
+            start = time.perf_counter()
+            for _ in range(rounds):
+                for ambulance in objects:
+                    serializer = AmbulanceSerializer(ambulance)
+                    if cache is None:
+                        JSONRenderer().render(serializer.data)
+                    else:
+                        cache.render(serializer)
+            elapsed = time.perf_counter() - start
+
+            info = cache.info() if cache is not None else None
+            results.append(('cache' if cache is not None else 'no cache',
+                            {'renders': ambulances * rounds,
+                             'hit rate': round(info.hits / (info.hits + info.misses), 3) if info else 0,
+                             'seconds': round(elapsed, 3),
+                             'renders/s': rate(ambulances * rounds, elapsed)}))
+
+        transaction.set_rollback(True)
+
+    return results
+
+
+def benchmark_delta(ambulances=500, interval=5, duration=600, snapshot_interval=DELTA_SNAPSHOT_INTERVAL,
+                    **kwargs):
+    """
+    Compare the bytes per second of full ambulance documents against snapshots
+    and deltas for a fleet publishing its position every interval seconds.
+    Nothing is committed.
+    """
+
+    from django.contrib.gis.geos import Point
+
+    class Clock:
+        now = 0.
+
+        def __call__(self):
+            return self.now
+
+    clock = Clock()
+    encoder = DeltaEncoder(interval=snapshot_interval, clock=clock)
+    renderer = JSONRenderer()
+
+    full = delta = snapshots = messages = 0
+    with transaction.atomic():
+
+        user = User.objects.create_user(username='benchmark_delta')
+        objects = [Ambulance.objects.create(identifier='benchmark_delta_{}'.format(k),
+                                            capability=AmbulanceCapability.B.name,
+                                            comment='benchmark',
+                                            updated_by=user)
+                   for k in range(ambulances)]
+
+        start = timezone.now()
+        for tick in range(int(duration / interval)):
+            for (k, ambulance) in enumerate(objects):
+
+                # stagger pings over the interval
+                clock.now = tick * interval + k * interval / ambulances
+                ambulance.location = Point(-117.0382 + 1e-4 * tick, 32.5149 + 1e-5 * k)
+                ambulance.orientation = float((tick + k) % 360)
+                ambulance.timestamp = ambulance.updated_on = start + timedelta(seconds=clock.now)
+
+                data = AmbulanceSerializer(ambulance).data
+                full += len(renderer.render(data))
+                (message, snapshot) = encoder.encode('ambulance/{}/delta'.format(ambulance.id), data)
+                if message is not None:
+                    delta += len(renderer.render(message))
+                    snapshots += snapshot
+                messages += 1
+
+        transaction.set_rollback(True)
+
+    return [('data', {'messages': messages,
+                      'bytes/message': round(full / messages, 1),
+                      'bytes/s': round(full / duration, 1)}),
+            ('delta', {'messages': messages,
+                       'snapshots': snapshots,
+                       'bytes/message': round(delta / messages, 1),
+                       'bytes/s': round(delta / duration, 1),
+                       'saved': '{:.1%}'.format(1 - delta / full)})]
+
+
+def benchmark_permissions(ambulances=5000, hospitals=500, groups=50, checks=100000, **kwargs):
+    """
+    Measure building the permissions of a superuser and of a user in every
+    group, their size and the latency of checks against the permission
+    index and against a list of ids. Each group can read a slice of the
+    fleet. Nothing is committed.
+    """
+
+    results = []
+    with transaction.atomic():
+
+        user = User.objects.create_user(username='benchmark_permissions')
+        superuser = User.objects.create_user(username='benchmark_permissions_superuser', is_superuser=True)
+
+        holders = EquipmentHolder.objects.bulk_create([EquipmentHolder() for _ in range(ambulances)])
+        fleet = Ambulance.objects.bulk_create([Ambulance(identifier='benchmark_permissions_{}'.format(k),
+                                                         capability=AmbulanceCapability.B.name,
+                                                         equipmentholder=holders[k],
+                                                         updated_by=user)
+                                               for k in range(ambulances)])
+
+        # hospitals are locations, which cannot be bulk created
+        facilities = [Hospital.objects.create(name='benchmark_permissions_{}'.format(k), updated_by=user)
+                      for k in range(hospitals)]
+
+        objects = Group.objects.bulk_create([Group(name='benchmark_permissions_{}'.format(k))
+                                             for k in range(groups)])
+        GroupAmbulancePermission.objects.bulk_create([
+            GroupAmbulancePermission(group=group, ambulance=ambulance, can_write=(k % 2 == 0))
+            for (k, group) in enumerate(objects) for ambulance in fleet[k::groups]])
+        GroupHospitalPermission.objects.bulk_create([
+            GroupHospitalPermission(group=group, hospital=hospital)
+            for (k, group) in enumerate(objects) for hospital in facilities[k::groups]])
+        user.groups.add(*objects)
+
+        ids = [ambulance.id for ambulance in fleet]
+        lookups = [random.choice(ids) for _ in range(checks)]
+
+        for (name, member) in (('superuser', superuser), ('group member', user)):
+
+            tracemalloc.start()
+            with CaptureQueriesContext(connection) as context:
+                start = time.perf_counter()
+                permissions = Permissions(member)
+                elapsed = time.perf_counter() - start
+            (size, _) = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+            start = time.perf_counter()
+            for id in lookups:
+                permissions.check_can_read(ambulance=id)
+            index = time.perf_counter() - start
+
+            can_read = [id for id in permissions.ambulances if permissions.check_can_read(ambulance=id)]
+            start = time.perf_counter()
+            for id in lookups:
+                id in can_read
+            scan = time.perf_counter() - start
+
+            results.append((name, {'ambulances': len(permissions.ambulances),
+                                   'hospitals': len(permissions.hospitals),
+                                   'queries': len(context.captured_queries),
+                                   'build seconds': round(elapsed, 3),
+                                   'memory bytes': size,
+                                   'pickled bytes': len(pickle.dumps(permissions)),
+                                   'index checks/s': rate(checks, index),
+                                   'list checks/s': rate(checks, scan)}))
+
+        transaction.set_rollback(True)
+
+    return results
+
+
+BENCHMARKS = {
+    'workers': benchmark_workers,
+    'router': benchmark_router,
+    'coalesce': benchmark_coalesce,
+    'bulk': benchmark_bulk,
+    'telemetry': benchmark_telemetry,
+    'binary': benchmark_binary,
+    'partitions': benchmark_partitions,
+    'spool': benchmark_spool,
+    'collector': benchmark_collector,
+    'outbox': benchmark_outbox,
+    'payloads': benchmark_payloads,
+    'delta': benchmark_delta,
+    'permissions': benchmark_permissions,
+}
@@ -0,0 +1,241 @@
+import itertools
+import logging
+import queue
+import threading
+
+from paho.mqtt.client import MQTTMessage, MQTTMessageInfo, topic_matches_sub, MQTT_ERR_SUCCESS, MQTT_ERR_NO_CONN
+
+logger = logging.getLogger(__name__)
+
+
+# LocalBroker
+
+class LocalBroker:
+    """
+    Minimal in-process MQTT broker for LocalClient.
+
+    Supports subscriptions with wildcards and retained messages. Messages
+    are delivered to each subscribed client's inbox and processed by the
+    client's loop, just like a paho client processes its socket.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.clients = []
+        self.retained = {}
+
+    def attach(self, client):
+        with self.lock:
+            if client not in self.clients:
+                self.clients.append(client)
+
+    def detach(self, client):
+        with self.lock:
+            if client in self.clients:
+                self.clients.remove(client)
+
+    def subscribe(self, client, sub, qos):
+
+        with self.lock:
+            client.subscriptions[sub] = qos
+            retained = [(topic, payload) for (topic, payload) in self.retained.items()
+                        if topic_matches_sub(sub, topic)]
+
+        # deliver retained messages
+        for (topic, payload) in retained:
+            client.deliver(topic, payload, qos, True)
+
+    def publish(self, topic, payload=None, qos=0, retain=False):
+
+        if payload is None:
+            payload = b''
+        elif isinstance(payload, str):
+            payload = payload.encode('utf-8')
+        elif isinstance(payload, (int, float)):
+            payload = str(payload).encode('ascii')
+
+        with self.lock:
+
+            # retain?
+            if retain:
+                if payload:
+                    self.retained[topic] = payload
+                else:
+                    self.retained.pop(topic, None)
+
+            # find subscribers
+            targets = []
+            for client in self.clients:
+                for (sub, sub_qos) in client.subscriptions.items():
+                    if topic_matches_sub(sub, topic):
+                        targets.append((client, min(qos, sub_qos)))
+                        break
+
+        for (client, qos) in targets:
+            client.deliver(topic, payload, qos, False)
+
+
+default_broker = LocalBroker()
+
+
+# LocalClient
+
+class LocalClient:
+    """
+    Stand-in for paho.mqtt.client.Client that talks to a LocalBroker.
+
+    Can be passed as client_class to BaseClient and its subclasses to run them
+    in-process without a broker, e.g. when replaying recorded traffic.
+    """
+
+    def __init__(self, client_id='', clean_session=True, userdata=None, transport='tcp', broker=None):
+        self._client_id = client_id
+        self._userdata = userdata
+        self.broker = broker if broker is not None else default_broker
+        self.subscriptions = {}
+        self.inbox = queue.Queue()
+        self.connected = False
+        self.mids = itertools.count(1)
+        self.thread = None
+
+        self.on_connect = None
+        self.on_disconnect = None
+        self.on_message = None
+        self.on_publish = None
+        self.on_subscribe = None
+        self.on_unsubscribe = None
+        self.on_log = None
+
+    # configuration is accepted and ignored
+
+    def tls_set(self, *args, **kwargs):
+        pass
+
+    def tls_insecure_set(self, value):
+        pass
+
+    def will_set(self, topic, payload=None, qos=0, retain=False):
+        pass
+
+    def username_pw_set(self, username, password=None):
+        pass
+
+    # connection
+
+    def connect(self, host='localhost', port=1883, keepalive=60, *args, **kwargs):
+        self.broker.attach(self)
+        self.connected = True
+
+        # connack is processed by the loop
+        self.inbox.put(('connect', None))
+        return MQTT_ERR_SUCCESS
+
+    def reconnect(self):
+        return self.connect()
+
+    def disconnect(self, *args, **kwargs):
+        if self.connected:
+            self.connected = False
+            self.broker.detach(self)
+            self.inbox.put(('disconnect', None))
+        return MQTT_ERR_SUCCESS
+
+    def is_connected(self):
+        return self.connected
+
+    # messages
+
+    def deliver(self, topic, payload, qos, retain):
+        msg = MQTTMessage(topic=topic.encode('utf-8'))
+        msg.payload = payload
+        msg.qos = qos
+        msg.retain = retain
+        self.inbox.put(('message', msg))
+
+    def publish(self, topic, payload=None, qos=0, retain=False, properties=None):
+
+        info = MQTTMessageInfo(next(self.mids))
+        if not self.connected:
+            info.rc = MQTT_ERR_NO_CONN
+            return info
+
+        self.broker.publish(topic, payload, qos, retain)
+        info.rc = MQTT_ERR_SUCCESS
+        info._set_as_published()
+        if self.on_publish is not None:
+            self.on_publish(self, self._userdata, info.mid)
+        return info
+
+    def subscribe(self, topic, qos=0, *args, **kwargs):
+        mid = next(self.mids)
+        self.broker.subscribe(self, topic, qos)
+        if self.on_subscribe is not None:
+            self.on_subscribe(self, self._userdata, mid, (qos,))
+        return MQTT_ERR_SUCCESS, mid
+
+    def unsubscribe(self, topic, *args, **kwargs):
+        mid = next(self.mids)
+        with self.broker.lock:
+            self.subscriptions.pop(topic, None)
+        if self.on_unsubscribe is not None:
+            self.on_unsubscribe(self, self._userdata, mid)
+        return MQTT_ERR_SUCCESS, mid
+
+    def pending(self):
+        """
+        Returns the number of events waiting to be processed by the loop.
+        """
+        return self.inbox.qsize()
+
+    # loop
+
+    def loop(self, timeout=1.0, *args, **kwargs):
+
+        try:
+            (event, msg) = self.inbox.get(timeout=timeout)
+        except queue.Empty:
+            return MQTT_ERR_SUCCESS
+
+        try:
+            if event == 'connect':
+                if self.on_connect is not None:
+                    self.on_connect(self, self._userdata, {'session present': 0}, 0)
+            elif event == 'message':
+                if self.on_message is not None:
+                    self.on_message(self, self._userdata, msg)
+            elif event == 'disconnect':
+                if self.on_disconnect is not None:
+                    self.on_disconnect(self, self._userdata, 0)
+                return MQTT_ERR_NO_CONN
+        finally:
+            self.inbox.task_done()
+
+        return MQTT_ERR_SUCCESS
+
+    def loop_forever(self, *args, **kwargs):
+        while self.loop() == MQTT_ERR_SUCCESS:
+            pass
+        return MQTT_ERR_SUCCESS
+
+    def loop_start(self):
+        if self.thread is not None:
+            return MQTT_ERR_SUCCESS
+        self.thread = threading.Thread(target=self.loop_forever, name='mqtt-local-loop', daemon=True)
+        self.thread.start()
+        return MQTT_ERR_SUCCESS
+
+    def loop_stop(self, force=False):
+        if self.thread is None:
+            return MQTT_ERR_SUCCESS
+        if self.connected:
+            self.disconnect()
+        if threading.current_thread() is not self.thread:
+            self.thread.join()
+        self.thread = None
+        return MQTT_ERR_SUCCESS
+
+    def join(self):
+        """
+        Waits until every event delivered so far has been processed.
+        """
+        self.inbox.join()
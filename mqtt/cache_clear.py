@@ -1,4 +1,4 @@
-from login.permissions import cache_clear
+from login.permissions import cache_clear, refresh_effective_permissions
 
 
 def mqtt_cache_clear():
@@ -6,6 +6,53 @@ def mqtt_cache_clear():
     # call cache_clear locally
     cache_clear()
 
+    # rebuild materialized permissions
+    refresh_effective_permissions()
+
+    # profiles must be seeded again
+    from mqtt.watermark import set_watermark, PERMISSIONS_WATERMARK
+    set_watermark(PERMISSIONS_WATERMARK)
+
     # and signal through mqtt
     from mqtt.publish import SingletonPublishClient
     SingletonPublishClient().publish_message('cache_clear')
+
+
+def mqtt_client_cache_clear(client_id):
+
+    # evict client locally
+    from mqtt.identity import cache_evict
+    cache_evict(client_id)
+
+    # and signal through mqtt
+    from mqtt.publish import SingletonPublishClient
+    SingletonPublishClient().publish_message({'cache_clear': {'client': client_id}})
+
+
+def mqtt_user_cache_clear(user_ids):
+
+    user_ids = sorted(set(user_ids))
+    if not user_ids:
+        return
+
+    # evict users locally
+    from login.permissions import cache_evict
+    for user_id in user_ids:
+        cache_evict(user_id)
+
+    # rebuild their materialized permissions
+    refresh_effective_permissions(user_ids)
+
+    # their profiles must be seeded again
+    from mqtt.watermark import set_user_watermarks
+    set_user_watermarks(user_ids)
+
+    # signal through mqtt
+    from mqtt.publish import SingletonPublishClient
+    client = SingletonPublishClient()
+    client.publish_message({'cache_clear': {'users': user_ids}})
+
+    # and republish their profiles
+    from django.contrib.auth.models import User
+    for user in User.objects.filter(id__in=user_ids):
+        client.publish_profile(user)
@@ -1,4 +1,5 @@
 import logging
+import random
 import sys
 import threading
 import time
@@ -11,6 +12,8 @@ from django.core.management.color import color_style
 from rest_framework import serializers
 from rest_framework.renderers import JSONRenderer
 
+from .spool import MemorySpool, SPOOL_BATCH_SIZE
+
 logger = logging.getLogger(__name__)
 
 
@@ -22,6 +25,7 @@ class MQTTException(Exception):
 
 
 RETRY_TIMER_SECONDS = 3
+RETRY_MAX_SECONDS = 60
 RETRY_MAX_ATTEMPTS = 10
 
 
@@ -39,14 +43,16 @@ class BaseClient:
         self.style = kwargs.pop('style', color_style())
         self.verbosity = kwargs.pop('verbosity', 1)
         self.debug = kwargs.pop('debug', False)
+        self.client_class = kwargs.pop('client_class', mqtt.Client)
+        spool = kwargs.pop('spool', None)
         # self.forgive_mid = False
 
         if self.broker['CLIENT_ID']:
-            self.client = mqtt.Client(client_id=self.broker['CLIENT_ID'],
-                                      clean_session=self.broker['CLEAN_SESSION'],
-                                      transport=self.transport)
+            self.client = self.client_class(client_id=self.broker['CLIENT_ID'],
+                                            clean_session=self.broker['CLEAN_SESSION'],
+                                            transport=self.transport)
         else:
-            self.client = mqtt.Client()
+            self.client = self.client_class()
 
         # tls_set?
         if self.tls_set:
@@ -87,11 +93,18 @@ class BaseClient:
                             self.broker['KEEPALIVE'])
 
         # add buffer
-        self.buffer = []
+        self.buffer = spool if spool is not None else MemorySpool()
         self.number_of_unsuccessful_attempts = 0
         self.buffer_lock = threading.Lock()
         self.publish_lock = threading.Lock()
 
+        # retry worker, started on the first failed publish
+        self.retry_lock = threading.Lock()
+        self.retry_pending = threading.Event()
+        self.retry_wakeup = threading.Event()
+        self.retry_thread = None
+        self.retry_stop = None
+
     def done(self):
         return True
 
@@ -109,6 +122,10 @@ class BaseClient:
                 ">> Connected to the MQTT brocker '{}:{}'".format(self.broker['HOST'], 
                                                                   self.broker['PORT'])))
 
+        # send messages spooled while disconnected
+        if len(getattr(self, 'buffer', ())) > 0:
+            self.schedule_retry(now=True)
+
         return True
 
     def on_message(self, client, userdata, msg):
@@ -120,7 +137,7 @@ class BaseClient:
         self.buffer_lock.acquire()
 
         # add to buffer
-        self.buffer.append({'topic': topic, 'payload': payload, 'qos': qos, 'retain': retain})
+        self.buffer.append(topic, payload, qos, retain)
 
         # release lock
         self.buffer_lock.release()
@@ -135,34 +152,26 @@ class BaseClient:
 
             logger.debug('> send_buffer len = {}'.format(len(self.buffer)))
 
-            # attempt to send buffered messages
-            message = self.buffer.pop(0)
-
             try:
 
-                # try to publish
-                self._publish(**message)
+                # attempt to send buffered messages in batches
+                # messages that could not be sent stay on the buffer
+                if self.buffer.drain(lambda message: self._publish(**message), SPOOL_BATCH_SIZE):
 
-                # reset counter
-                self.number_of_unsuccessful_attempts = 0
+                    # reset counter
+                    self.number_of_unsuccessful_attempts = 0
 
             except MQTTException:
 
                 logger.debug('could not send message')
 
-                # put message back
-                self.buffer.insert(0, message)
-
                 # increment counter
                 self.number_of_unsuccessful_attempts += 1
 
-                # set up timer for retrying
-                threading.Timer(RETRY_TIMER_SECONDS, self.send_buffer).start()
-
-                # break from loop
+                # break from loop, retry worker will try again
                 break
 
-        logger.debug('< send_buffer len = {}'.format(len(self.buffer)))
+        logger.debug('< send_buffer {}'.format(self.buffer.info()))
 
         # release lock
         self.buffer_lock.release()
@@ -173,6 +182,17 @@ class BaseClient:
 
     def publish(self, topic, payload=None, qos=0, retain=False):
 
+        # older messages are still spooled? queue behind them to keep order
+        with self.buffer_lock:
+            spooled = self.retry_pending.is_set() or len(self.buffer) > 0
+            if spooled:
+                self.buffer.append(topic, payload, qos, retain)
+
+        if spooled:
+            # send right away if connected
+            self.schedule_retry(now=self.connected)
+            return
+
         try:
 
             # try to publish
@@ -183,8 +203,59 @@ class BaseClient:
             # add to buffer
             self.add_to_buffer(topic, payload, qos, retain)
 
-            # set up timer for retrying
-            threading.Timer(RETRY_TIMER_SECONDS, self.send_buffer).start()
+            # retry later
+            self.schedule_retry()
+
+    def schedule_retry(self, now=False):
+        """
+        Makes sure the retry worker sends the buffer, right away if now,
+        e.g. on reconnect, otherwise after backing off.
+        """
+
+        with self.retry_lock:
+
+            self.retry_pending.set()
+            if now:
+                self.retry_wakeup.set()
+
+            # start worker?
+            if self.retry_thread is None or not self.retry_thread.is_alive():
+                self.retry_stop = threading.Event()
+                self.retry_thread = threading.Thread(target=self.retry_worker,
+                                                     args=(self.retry_stop,),
+                                                     name='mqtt-retry',
+                                                     daemon=True)
+                self.retry_thread.start()
+
+    def retry_worker(self, stop):
+
+        delay = RETRY_TIMER_SECONDS
+        while True:
+
+            # wait for messages on the buffer
+            self.retry_pending.wait()
+
+            # back off with jitter, unless woken up by a reconnect
+            self.retry_wakeup.wait(random.uniform(delay / 2, delay))
+            self.retry_wakeup.clear()
+
+            if stop.is_set():
+                return
+
+            try:
+                self.send_buffer()
+
+            except MQTTException as e:
+                logger.warning('mqtt.BaseClient: {}'.format(e))
+
+            with self.retry_lock:
+                if len(self.buffer) > 0:
+                    # still failing
+                    delay = min(2 * delay, RETRY_MAX_SECONDS)
+                else:
+                    # done, go idle
+                    delay = RETRY_TIMER_SECONDS
+                    self.retry_pending.clear()
 
     def _publish(self, topic, payload=None, qos=0, retain=False):
 
@@ -217,6 +288,16 @@ class BaseClient:
 
     # disconnect
     def disconnect(self):
+
+        # stop retry worker
+        with self.retry_lock:
+            if self.retry_stop is not None:
+                self.retry_stop.set()
+                self.retry_pending.set()
+                self.retry_wakeup.set()
+            self.retry_thread = None
+            self.retry_stop = None
+
         self.client.disconnect()
 
     def is_connected(self):
@@ -249,17 +330,22 @@ class BaseClient:
         if self.connected:
             raise MQTTException('Could not disconnect')
 
-    def publish_topic(self, topic, payload, qos=0, retain=False):
+    def render(self, payload):
 
         # serializer?
         if isinstance(payload, serializers.BaseSerializer):
-            payload = JSONRenderer().render(payload.data)
+            return JSONRenderer().render(payload.data)
+        elif isinstance(payload, bytes):
+            # already encoded
+            return payload
         else:
-            payload = JSONRenderer().render(payload)
+            return JSONRenderer().render(payload)
+
+    def publish_topic(self, topic, payload, qos=0, retain=False):
 
         # Publish to topic
         self.publish(topic,
-                     payload,
+                     self.render(payload),
                      qos=qos,
                      retain=retain)
 
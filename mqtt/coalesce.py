@@ -0,0 +1,101 @@
+import logging
+import threading
+import time
+from collections import namedtuple
+
+logger = logging.getLogger(__name__)
+
+CoalescerInfo = namedtuple('CoalescerInfo', ['received', 'coalesced', 'flushed', 'pending'])
+
+
+# Coalescer
+
+class Coalescer:
+    """
+    Keeps only the latest value per key within a time window.
+
+    add() stores a value as pending, replacing any value still pending for the same key.
+    Once the window of a key expires expire(key) is called from a background thread,
+    and the owner is expected to pop() the pending value and process it.
+    """
+
+    def __init__(self, window, expire):
+        self.window = window
+        self.expire = expire
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.scheduled = set()
+        self.received = 0
+        self.coalesced = 0
+        self.flushed = 0
+        self.coalesced_by_key = {}
+
+        # start background thread
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, name='mqtt-coalescer', daemon=True)
+        self.thread.start()
+
+    def add(self, key, value):
+
+        with self.lock:
+            self.received += 1
+            entry = self.pending.get(key)
+            if entry is None:
+                # [deadline, value, number of values replaced]
+                self.pending[key] = [time.monotonic() + self.window, value, 0]
+            else:
+                entry[1] = value
+                entry[2] += 1
+                self.coalesced += 1
+
+    def pop(self, key):
+        """
+        Returns (value, number of values it replaced) pending for key or None.
+        """
+
+        with self.lock:
+            self.scheduled.discard(key)
+            entry = self.pending.pop(key, None)
+            if entry is None:
+                return None
+
+            self.flushed += 1
+            if entry[2]:
+                self.coalesced_by_key[key] = self.coalesced_by_key.get(key, 0) + entry[2]
+
+            return entry[1], entry[2]
+
+    def run(self):
+
+        while not self.stopped.wait(self.window / 2):
+
+            # collect expired keys
+            now = time.monotonic()
+            with self.lock:
+                expired = [key for (key, entry) in self.pending.items()
+                           if entry[0] <= now and key not in self.scheduled]
+                self.scheduled.update(expired)
+
+            for key in expired:
+                try:
+                    self.expire(key)
+                except Exception as e:
+                    logger.exception('Coalescer: unhandled exception: {}'.format(e))
+
+    def stop(self):
+
+        # stop background thread
+        self.stopped.set()
+        self.thread.join()
+
+        # expire everything that is still pending
+        with self.lock:
+            keys = [key for key in self.pending if key not in self.scheduled]
+            self.scheduled.update(keys)
+
+        for key in keys:
+            self.expire(key)
+
+    def info(self):
+        with self.lock:
+            return CoalescerInfo(self.received, self.coalesced, self.flushed, len(self.pending))
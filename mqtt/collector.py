@@ -0,0 +1,177 @@
+import logging
+import threading
+import weakref
+from collections import OrderedDict, namedtuple
+from functools import partial
+
+from django.db import transaction
+
+logger = logging.getLogger(__name__)
+
+CollectorInfo = namedtuple('CollectorInfo', ['collected', 'coalesced', 'published'])
+
+
+class _Savepoint:
+    __slots__ = ('sids', 'pending', 'hook')
+
+    def __init__(self, sids):
+        self.sids = sids
+        # key -> _Call, latest call goes last
+        self.pending = OrderedDict()
+        self.hook = None
+
+    def alive(self):
+        # Django drops the commit hook when the savepoint or the transaction is rolled back
+        return self.hook() is not None
+
+
+class _Call:
+    __slots__ = ('call', 'savepoint', 'previous', 'next', 'ran')
+
+    def __init__(self, call, savepoint, previous=None):
+        self.call = call
+        self.savepoint = savepoint
+        self.previous = previous
+        self.next = None
+        self.ran = False
+
+    def replaced(self):
+
+        # replaced by a later call that ran or still can run?
+        call = self.next
+        while call is not None:
+            if call.ran or call.savepoint.alive():
+                return True
+            call = call.next
+
+        return False
+
+
+# PublishCollector
+
+class PublishCollector:
+    """
+    Defers publishes made inside a transaction until it commits.
+
+    add(key, fn, *args) calls fn(*args) right away in autocommit mode. Inside
+    an atomic block the call is kept in a pending dict for the current
+    savepoint, registered with transaction.on_commit, until the transaction
+    commits. A later call for the same key, in the same savepoint or in a
+    nested one, replaces it, so only the last one runs; calls with key None
+    are never replaced. Calls made inside a savepoint or a transaction that is
+    rolled back do not run, and a call they replaced runs instead.
+
+    Payloads should be rendered by fn, so that they reflect the state at
+    commit. With defer=False every call runs right away, for clients that
+    only read the database.
+    """
+
+    def __init__(self, using=None, defer=True):
+        self.using = using
+        self.defer = defer
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.collected = 0
+        self.coalesced = 0
+        self.published = 0
+
+    def add(self, key, fn, *args):
+
+        connection = transaction.get_connection(self.using)
+
+        # autocommit?
+        if not self.defer or not connection.in_atomic_block:
+            fn(*args)
+            with self.lock:
+                self.published += 1
+            return
+
+        savepoint = self.savepoint(connection)
+
+        with self.lock:
+            self.collected += 1
+
+        # never replaced
+        if key is None:
+            savepoint.pending[object()] = _Call(partial(fn, *args), savepoint)
+            return
+
+        # latest call for key that can still run, in this or an enclosing savepoint
+        latest = self.local.latest
+        previous = latest.get(key)
+        while previous is not None and not previous.savepoint.alive():
+            previous = previous.previous
+
+        call = _Call(partial(fn, *args), savepoint, previous)
+        if previous is not None:
+            previous.next = call
+
+            # same savepoint, dropped right away
+            if previous.savepoint is savepoint:
+                del savepoint.pending[key]
+                call.previous = previous.previous
+                if call.previous is not None:
+                    call.previous.next = call
+                with self.lock:
+                    self.coalesced += 1
+
+        savepoint.pending[key] = call
+        latest[key] = call
+
+    def savepoint(self, connection):
+        """
+        Returns the pending calls of the current savepoint of this thread.
+        """
+
+        # savepoint_ids has None for atomic blocks without a savepoint
+        sids = tuple(sid for sid in connection.savepoint_ids if sid is not None)
+
+        # forget savepoints that were rolled back, or the transaction that was
+        savepoints = getattr(self.local, 'savepoints', None)
+        if savepoints is None or not any(savepoint.alive() for savepoint in savepoints.values()):
+            savepoints = self.local.savepoints = {}
+            self.local.latest = {}
+        else:
+            for dead in [sids for (sids, savepoint) in savepoints.items() if not savepoint.alive()]:
+                del savepoints[dead]
+
+        savepoint = savepoints.get(sids)
+        if savepoint is None:
+            savepoint = savepoints[sids] = _Savepoint(sids)
+
+            # Django only holds the hook, so it is gone once dropped
+            hook = partial(self.run, savepoint)
+            savepoint.hook = weakref.ref(hook)
+            transaction.on_commit(hook, using=self.using)
+
+        return savepoint
+
+    def run(self, savepoint):
+
+        # commit hooks run once the outermost atomic block exits
+        self.local.savepoints = None
+        self.local.latest = {}
+
+        for call in savepoint.pending.values():
+
+            # replaced by a call in a nested savepoint?
+            if call.replaced():
+                with self.lock:
+                    self.coalesced += 1
+                continue
+
+            call.ran = True
+            try:
+                call.call()
+
+            except Exception as e:
+                # the transaction is already committed, do not break the caller
+                logger.exception('PublishCollector: unhandled exception: {}'.format(e))
+
+            else:
+                with self.lock:
+                    self.published += 1
+
+    def info(self):
+        with self.lock:
+            return CollectorInfo(self.collected, self.coalesced, self.published)
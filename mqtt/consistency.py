@@ -0,0 +1,143 @@
+import hashlib
+import logging
+from collections import namedtuple
+
+from django.contrib.auth.models import User
+from paho.mqtt.client import topic_matches_sub
+from rest_framework import serializers
+from rest_framework.renderers import JSONRenderer
+
+from ambulance.models import Ambulance, Call, CallStatus
+from ambulance.serializers import AmbulanceSerializer, CallSerializer
+from equipment.models import Equipment, EquipmentHolder, EquipmentItem
+from equipment.serializers import EquipmentItemSerializer, EquipmentSerializer
+from hospital.models import Hospital
+from hospital.serializers import HospitalSerializer
+from login.serializers import UserProfileSerializer
+from .payloads import render_payload
+from .seed import chunked, SEED_CHUNK_SIZE
+
+logger = logging.getLogger(__name__)
+
+# retained topics that are checked
+CHECK_SUBSCRIPTIONS = (
+    'ambulance/+/data',
+    'hospital/+/data',
+    'equipment/+/metadata',
+    'equipment/+/item/+/data',
+    'call/+/data',
+    'user/+/profile',
+)
+
+ConsistencyReport = namedtuple('ConsistencyReport', ['checked', 'missing', 'stale', 'orphaned'])
+
+
+def digest(payload):
+    return hashlib.blake2b(payload, digest_size=16).digest()
+
+
+def render(payload):
+    # same as PublishClient.render
+    if isinstance(payload, serializers.Serializer):
+        return render_payload(payload)
+    return JSONRenderer().render(payload.data)
+
+
+# ConsistencyChecker
+
+class ConsistencyChecker:
+    """
+    Compares the retained topics on the broker with the database.
+
+    Retained payloads are added with add_retained() as they arrive and only
+    their digests are kept. check() renders every object in the database
+    with the serializers used to publish it and reports the topics that are
+    missing from the broker, whose payload is stale, and that are retained
+    but no longer correspond to an object. repair() publishes or removes
+    those topics only, retained as the client retains every object topic.
+    """
+
+    subscriptions = CHECK_SUBSCRIPTIONS
+
+    def __init__(self, chunk_size=SEED_CHUNK_SIZE):
+        self.chunk_size = chunk_size
+        self.retained = {}
+
+    def is_checked(self, topic):
+        return any(topic_matches_sub(sub, topic) for sub in self.subscriptions)
+
+    def add_retained(self, topic, payload):
+        if not self.is_checked(topic):
+            return
+        if payload:
+            self.retained[topic] = digest(payload)
+        else:
+            self.retained.pop(topic, None)
+
+    def expected(self):
+        """
+        Yields (topic, payload) for every object in the database.
+        """
+
+        for hospital in chunked(Hospital.objects.all(), self.chunk_size):
+            yield 'hospital/{}/data'.format(hospital.id), HospitalSerializer(hospital)
+
+        for item in chunked(EquipmentItem.objects.select_related('equipmentholder', 'equipment'),
+                            self.chunk_size):
+            yield ('equipment/{}/item/{}/data'.format(item.equipmentholder.id, item.equipment.id),
+                   EquipmentItemSerializer(item))
+
+        for equipmentholder in chunked(EquipmentHolder.objects.all(), self.chunk_size):
+            equipments = Equipment.objects.filter(id__in=equipmentholder.equipmentitem_set.values('equipment'))
+            yield ('equipment/{}/metadata'.format(equipmentholder.id),
+                   EquipmentSerializer(equipments, many=True))
+
+        for ambulance in chunked(Ambulance.objects.select_related('client'), self.chunk_size):
+            yield 'ambulance/{}/data'.format(ambulance.id), AmbulanceSerializer(ambulance)
+
+        for user in chunked(User.objects.all(), self.chunk_size):
+            yield 'user/{}/profile'.format(user.username), UserProfileSerializer(user)
+
+        calls = Call.objects.exclude(status=CallStatus.E.name) \
+            .prefetch_related('patient_set',
+                              'ambulancecall_set__waypoint_set__location')
+        for call in chunked(calls, self.chunk_size):
+            yield 'call/{}/data'.format(call.id), CallSerializer(call)
+
+    def check(self):
+        """
+        Returns a ConsistencyReport with the sorted topics that are missing, stale or orphaned.
+        """
+
+        missing, stale = [], []
+        seen = set()
+        for (topic, payload) in self.expected():
+            seen.add(topic)
+            retained = self.retained.get(topic)
+            if retained is None:
+                missing.append(topic)
+            elif retained != digest(render(payload)):
+                stale.append(topic)
+
+        orphaned = [topic for topic in self.retained if topic not in seen]
+
+        return ConsistencyReport(len(seen), sorted(missing), sorted(stale), sorted(orphaned))
+
+    def repair(self, client, report, qos=2):
+        """
+        Publishes the missing and stale topics in report with client and removes the orphaned ones.
+        """
+
+        topics = set(report.missing) | set(report.stale)
+        repaired = 0
+        if topics:
+            for (topic, payload) in self.expected():
+                if topic in topics:
+                    client.publish_topic(topic, render(payload), qos=qos)
+                    repaired += 1
+
+        for topic in report.orphaned:
+            client.remove_topic(topic)
+            repaired += 1
+
+        return repaired
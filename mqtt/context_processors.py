@@ -8,7 +8,8 @@ def jstags(request):
     return {
         'mqtt_broker': {
             'host': settings.MQTT['BROKER_WEBSOCKETS_HOST'],
-            'port': int(settings.MQTT['BROKER_WEBSOCKETS_PORT'])
+            'port': int(settings.MQTT['BROKER_WEBSOCKETS_PORT']),
+            'delta': 1 if settings.MQTT.get('DELTA') and settings.MQTT.get('OUTBOX') else 0
         },
         'client_id': 'javascript_client_' + uuid.uuid4().hex,
         'admin_urls': [reverse('login:list-user'),
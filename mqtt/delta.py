@@ -0,0 +1,158 @@
+import json
+import logging
+import threading
+import time
+import uuid
+from collections import OrderedDict, namedtuple
+
+from rest_framework.renderers import JSONRenderer
+
+from .models import DeltaState
+
+logger = logging.getLogger(__name__)
+
+DELTA_VERSION = 2
+DELTA_SNAPSHOT_INTERVAL = 30
+DELTA_CACHE_SIZE = 10000
+
+SNAPSHOT = 'snapshot'
+DELTA = 'delta'
+
+DeltaInfo = namedtuple('DeltaInfo', ['snapshots', 'deltas', 'unchanged'])
+
+
+# DeltaEncoder
+
+class DeltaEncoder:
+    """
+    Turns the documents published on a topic into a stream of snapshots and deltas.
+
+    Every message carries the format version 'v', the 'stream' of the topic
+    and a 'seq' number that increases by one with each message on the topic.
+    A snapshot carries the whole document in 'data'; a delta carries the
+    fields that changed or were added since the previous message in 'data'
+    and the names of the fields that were removed in 'removed', if any.
+    Snapshots are sent first and then at most every interval seconds, and
+    are meant to be retained.
+
+    A client applies a delta only if it has the same stream and the next seq
+    as the last message it applied; otherwise it missed messages and must
+    resync, from the next snapshot or from the API, and continue from there.
+
+    Each topic must be encoded by a single encoder, since deltas are computed
+    against the last message that encoder sent. This encoder keeps its state
+    in memory; DatabaseDeltaEncoder shares it between the processes of mqttrelay.
+    """
+
+    def __init__(self, interval=DELTA_SNAPSHOT_INTERVAL, maxsize=DELTA_CACHE_SIZE, clock=time.monotonic):
+        self.interval = interval
+        self.maxsize = maxsize
+        self.clock = clock
+        self.lock = threading.Lock()
+        # topic -> [stream, seq, last document, time of last snapshot]
+        self.state = OrderedDict()
+        self.snapshots = 0
+        self.deltas = 0
+        self.unchanged = 0
+
+    def encode(self, topic, data):
+        """
+        Returns (message, is snapshot) for the document data, or (None, False)
+        if nothing changed since the previous message on topic.
+        """
+
+        data = dict(data)
+        now = self.clock()
+
+        with self.lock:
+
+            state = self.load(topic)
+            if state is None or now - state[3] >= self.interval:
+
+                # snapshot, a new stream starts with the topic
+                if state is None:
+                    state = [uuid.uuid4().hex[:12], 1, data, now]
+                else:
+                    state = [state[0], state[1] + 1, data, now]
+                self.store(topic, state)
+                self.snapshots += 1
+                return {'v': DELTA_VERSION, 'stream': state[0], 'seq': state[1],
+                        'type': SNAPSHOT, 'data': data}, True
+
+            (stream, seq, last, snapshot) = state
+            changes = {key: value for (key, value) in data.items()
+                       if key not in last or last[key] != value}
+            removed = [key for key in last if key not in data]
+            if not changes and not removed:
+                self.unchanged += 1
+                return None, False
+
+            seq += 1
+            self.store(topic, [stream, seq, data, snapshot])
+            self.deltas += 1
+            message = {'v': DELTA_VERSION, 'stream': stream, 'seq': seq,
+                       'type': DELTA, 'data': changes}
+            if removed:
+                message['removed'] = removed
+            return message, False
+
+    def load(self, topic):
+        """
+        Returns the state [stream, seq, last document, time of last snapshot] of topic, or None.
+        """
+
+        state = self.state.get(topic)
+        if state is not None:
+            self.state.move_to_end(topic)
+        return state
+
+    def store(self, topic, state):
+        self.state[topic] = state
+        self.state.move_to_end(topic)
+        while len(self.state) > self.maxsize:
+            self.state.popitem(last=False)
+
+    def reset(self, topic):
+        with self.lock:
+            self.state.pop(topic, None)
+
+    def info(self):
+        with self.lock:
+            return DeltaInfo(self.snapshots, self.deltas, self.unchanged)
+
+
+# DatabaseDeltaEncoder
+
+class DatabaseDeltaEncoder(DeltaEncoder):
+    """
+    A DeltaEncoder that keeps its state in the database, so that several
+    mqttrelay processes continue the same streams.
+
+    encode must be called in a transaction: the state of the topic is locked
+    until it commits, and rolled back with it if the message is not published.
+    """
+
+    def __init__(self, interval=DELTA_SNAPSHOT_INTERVAL, clock=time.time):
+        super().__init__(interval=interval, clock=clock)
+
+    def encode(self, topic, data):
+        # compare documents as they are stored
+        data = json.loads(JSONRenderer().render(data).decode())
+        return super().encode(topic, data)
+
+    def load(self, topic):
+        state = DeltaState.objects.select_for_update().filter(topic=topic).first()
+        if state is None:
+            return None
+        return [state.stream, state.seq, json.loads(state.data), state.snapshot_on]
+
+    def store(self, topic, state):
+        (stream, seq, data, snapshot_on) = state
+        DeltaState.objects.update_or_create(topic=topic,
+                                            defaults={'stream': stream,
+                                                      'seq': seq,
+                                                      'data': json.dumps(data),
+                                                      'snapshot_on': snapshot_on})
+
+    def reset(self, topic):
+        DeltaState.objects.filter(topic=topic).delete()
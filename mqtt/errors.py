@@ -0,0 +1,161 @@
+import logging
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+logger = logging.getLogger(__name__)
+
+ERROR_WINDOW = 10
+ERROR_RATE = 5
+ERROR_CLIENTS = 1000
+ERROR_KEYS = 100
+
+ErrorLimiterInfo = namedtuple('ErrorLimiterInfo', ['sent', 'duplicates', 'rate_limited', 'clients'])
+
+
+class _ClientErrors:
+    __slots__ = ('errors', 'second', 'count', 'context')
+
+    def __init__(self):
+        # (topic, error) -> [time last sent, number suppressed since]
+        self.errors = OrderedDict()
+        self.second = None
+        self.count = 0
+        self.context = None
+
+
+# ErrorLimiter
+
+class ErrorLimiter:
+    """
+    Limits the error messages sent back to each client.
+
+    An error identical to one sent to the same client less than window seconds
+    ago is suppressed and counted; the count is reported with the next identical
+    error that is sent. At most rate errors are sent to a client per second.
+    Only the most recently active maxclients clients are tracked.
+
+    If report is given, errors whose window closed with suppressed repeats are
+    passed to report(client_id, context, topic, error, suppressed) from a
+    background thread, so that the count is not lost if the client stops.
+    """
+
+    def __init__(self, window=ERROR_WINDOW, rate=ERROR_RATE, maxclients=ERROR_CLIENTS, clock=time.monotonic,
+                 report=None):
+        self.window = window
+        self.rate = rate
+        self.maxclients = maxclients
+        self.clock = clock
+        self.report = report
+        self.lock = threading.Lock()
+        self.clients = OrderedDict()
+        self.sent = 0
+        self.duplicates = 0
+        self.rate_limited = 0
+
+        # start background thread
+        self.stopped = threading.Event()
+        self.thread = None
+        if report is not None:
+            self.thread = threading.Thread(target=self.run, name='mqtt-error-limiter', daemon=True)
+            self.thread.start()
+
+    def check(self, client_id, topic, error, context=None):
+        """
+        Returns None if the error must be suppressed, otherwise the number
+        of identical errors suppressed since it was last sent.
+
+        context, e.g. the username, is passed back to report.
+        """
+
+        now = self.clock()
+        key = (topic, error)
+
+        with self.lock:
+
+            # retrieve client
+            state = self.clients.get(client_id)
+            if state is None:
+                state = self.clients[client_id] = _ClientErrors()
+                while len(self.clients) > self.maxclients:
+                    self.clients.popitem(last=False)
+            else:
+                self.clients.move_to_end(client_id)
+            if context is not None:
+                state.context = context
+
+            # identical error within window?
+            last = state.errors.get(key)
+            if last is not None and now - last[0] < self.window:
+                last[1] += 1
+                self.duplicates += 1
+                return None
+
+            # too many errors this second?
+            if state.second is None or now - state.second >= 1:
+                state.second = now
+                state.count = 0
+            if state.count >= self.rate:
+                if last is not None:
+                    last[1] += 1
+                self.rate_limited += 1
+                return None
+            state.count += 1
+
+            # send
+            repeated = last[1] if last is not None else 0
+            state.errors[key] = [now, 0]
+            state.errors.move_to_end(key)
+            while len(state.errors) > ERROR_KEYS:
+                state.errors.popitem(last=False)
+            self.sent += 1
+
+            return repeated
+
+    def sweep(self, force=False):
+        """
+        Returns (client_id, context, topic, error, suppressed) for every error whose
+        window closed with suppressed repeats, or for all of them if force.
+        Those errors are forgotten, so the next identical error is sent.
+        """
+
+        now = self.clock()
+        closed = []
+
+        with self.lock:
+            for (client_id, state) in self.clients.items():
+                for (key, last) in list(state.errors.items()):
+                    if last[1] and (force or now - last[0] >= self.window):
+                        closed.append((client_id, state.context) + key + (last[1],))
+                        del state.errors[key]
+
+        return closed
+
+    def run(self):
+
+        while not self.stopped.wait(self.window / 2):
+            self.flush(self.sweep())
+
+    def flush(self, closed):
+
+        for (client_id, context, topic, error, suppressed) in closed:
+            try:
+                self.report(client_id, context, topic, error, suppressed)
+            except Exception as e:
+                logger.exception('ErrorLimiter: unhandled exception: {}'.format(e))
+
+    def stop(self):
+
+        # stop background thread
+        if self.thread is None:
+            return
+        self.stopped.set()
+        self.thread.join()
+        self.thread = None
+
+        # report everything that is still suppressed
+        self.flush(self.sweep(force=True))
+
+    def info(self):
+        with self.lock:
+            return ErrorLimiterInfo(self.sent, self.duplicates, self.rate_limited, len(self.clients))
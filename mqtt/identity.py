@@ -0,0 +1,85 @@
+import logging
+import threading
+from collections import OrderedDict, namedtuple
+
+from django.contrib.auth.models import User
+
+from login.models import Client
+
+logger = logging.getLogger(__name__)
+
+IDENTITY_CACHE_SIZE = 1000
+
+Identity = namedtuple('Identity', ['user', 'client'])
+CacheInfo = namedtuple('CacheInfo', ['hits', 'misses', 'maxsize', 'currsize'])
+
+
+# IdentityCache
+
+class IdentityCache:
+    """
+    Bounded LRU cache of the user and client behind a client_id.
+
+    Cached clients carry the ids of the ambulance and hospital the client was logged
+    into when it was fetched; entries are evicted whenever the client is saved.
+    Cached instances are shared between threads and must be treated as read-only.
+    """
+
+    def __init__(self, maxsize=IDENTITY_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.lock = threading.Lock()
+        self.cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, username, client_id, refresh=False):
+        """
+        Returns the Identity for username and client_id. Raises User.DoesNotExist
+        or Client.DoesNotExist just like the corresponding queries would.
+        """
+
+        with self.lock:
+            identity = None if refresh else self.cache.get(client_id)
+            if identity is not None and identity.user.username == username:
+                self.cache.move_to_end(client_id)
+                self.hits += 1
+                return identity
+            self.misses += 1
+
+        # hit the database
+        client = Client.objects.select_related('user').get(client_id=client_id)
+        if client.user.username == username:
+            user = client.user
+        else:
+            user = User.objects.get(username=username)
+        identity = Identity(user, client)
+
+        with self.lock:
+            self.cache[client_id] = identity
+            self.cache.move_to_end(client_id)
+            while len(self.cache) > self.maxsize:
+                self.cache.popitem(last=False)
+
+        return identity
+
+    def evict(self, client_id):
+        with self.lock:
+            self.cache.pop(client_id, None)
+
+    def clear(self):
+        with self.lock:
+            self.cache.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def info(self):
+        with self.lock:
+            return CacheInfo(self.hits, self.misses, self.maxsize, len(self.cache))
+
+
+identity_cache = IdentityCache()
+
+get_identity = identity_cache.get
+cache_evict = identity_cache.evict
+cache_clear = identity_cache.clear
+cache_info = identity_cache.info
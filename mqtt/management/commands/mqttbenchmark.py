@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand
+
+from mqtt.benchmarks import BENCHMARKS
+
+
+class Command(BaseCommand):
+    help = 'Benchmark the mqtt ingestion and publishing paths'
+
+    def add_arguments(self, parser):
+        parser.add_argument('benchmark', choices=sorted(BENCHMARKS))
+        parser.add_argument('--messages', nargs='?', type=int, default=10000)
+        parser.add_argument('--ambulances', nargs='?', type=int, default=None,
+                            help='number of ambulances, defaults to the benchmark default')
+        parser.add_argument('--hospitals', nargs='?', type=int, default=None)
+        parser.add_argument('--groups', nargs='?', type=int, default=None)
+        parser.add_argument('--workers', nargs='?', type=int, default=8)
+        parser.add_argument('--latency', nargs='?', type=float, default=1.0,
+                            help='simulated handler latency in milliseconds')
+
+    def handle(self, *args, **options):
+
+        benchmark = options['benchmark']
+
+        if options['verbosity'] > 0:
+            self.stdout.write(self.style.SUCCESS(">> Running benchmark '{}'".format(benchmark)))
+
+        # unset options take the benchmark defaults
+        results = BENCHMARKS[benchmark](**{key: value for (key, value) in options.items() if value is not None})
+
+        for (name, metrics) in results:
+            self.stdout.write(self.style.SUCCESS(" > {}".format(name)))
+            for (label, value) in metrics.items():
+                self.stdout.write("   {}: {}".format(label, value))
+
+        if options['verbosity'] > 0:
+            self.stdout.write(self.style.SUCCESS("<< Done running benchmark '{}'".format(benchmark)))
@@ -0,0 +1,121 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.conf import settings
+
+from mqtt.collector import PublishCollector
+from mqtt.consistency import ConsistencyChecker
+from mqtt.publish import PublishClient
+from mqtt.seed import SEED_CHUNK_SIZE
+
+
+class Client(PublishClient):
+
+    def __init__(self, broker, **kwargs):
+
+        self.checker = kwargs.pop('checker')
+        self.last_activity = time.monotonic()
+
+        # repairs do not change the database, publish right away
+        kwargs.setdefault('collector', PublishCollector(defer=False))
+
+        # call super
+        super().__init__(broker, **kwargs)
+
+    def on_connect(self, client, userdata, flags, rc):
+
+        # is connected?
+        if not super().on_connect(client, userdata, flags, rc):
+            return False
+
+        # subscribe to the checked topics, retained messages are sent right away
+        for topic in self.checker.subscriptions:
+            self.subscribe(topic)
+
+        # last activity
+        self.last_activity = time.monotonic()
+
+    def on_message(self, client, userdata, msg):
+
+        # retained?
+        if msg.retain:
+            self.checker.add_retained(msg.topic, msg.payload)
+
+            # last activity
+            self.last_activity = time.monotonic()
+
+    def collect(self, timeout):
+
+        # wait until no retained messages arrive for timeout seconds
+        while not self.connected or time.monotonic() - self.last_activity < timeout:
+            time.sleep(0.1)
+
+
+class Command(BaseCommand):
+    help = 'Compare the retained topics on the mqtt broker with the database'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--timeout', nargs='?', type=float, default=5,
+                            help='seconds without retained messages before checking')
+        parser.add_argument('--chunk-size', nargs='?', type=int, default=SEED_CHUNK_SIZE,
+                            help='number of objects loaded per query')
+        parser.add_argument('--repair', action='store_true', default=False,
+                            help='publish missing and stale topics and remove orphaned ones')
+
+    def handle(self, *args, **options):
+
+        import os
+
+        broker = {
+            'HOST': '127.0.0.1',
+            'PORT': 1883,
+            'KEEPALIVE': 60,
+            'CLEAN_SESSION': True
+        }
+        broker.update(settings.MQTT)
+        broker['CLIENT_ID'] = 'mqttcheck_' + str(os.getpid())
+
+        checker = ConsistencyChecker(chunk_size=options['chunk_size'])
+        client = Client(broker,
+                        checker=checker,
+                        stdout=self.stdout,
+                        style=self.style,
+                        verbosity=options['verbosity'])
+
+        # nothing to compare with unless object topics are retained
+        if not client.retain:
+            self.stdout.write(self.style.WARNING("* MQTT RETAIN is not set, object topics are not retained"))
+
+        try:
+
+            client.loop_start()
+
+            if options['verbosity'] > 0:
+                self.stdout.write(self.style.SUCCESS(">> Collecting retained topics..."))
+            client.collect(options['timeout'])
+
+            report = checker.check()
+
+            for (label, topics) in (('Missing', report.missing),
+                                    ('Stale', report.stale),
+                                    ('Orphaned', report.orphaned)):
+                for topic in topics:
+                    self.stdout.write(self.style.WARNING(" > {}: {}".format(label, topic)))
+
+            if options['verbosity'] > 0:
+                self.stdout.write(self.style.SUCCESS(
+                    "<< Checked {} topics: {} missing, {} stale, {} orphaned".format(report.checked,
+                                                                                     len(report.missing),
+                                                                                     len(report.stale),
+                                                                                     len(report.orphaned))))
+
+            if options['repair']:
+                repaired = checker.repair(client, report)
+                if options['verbosity'] > 0:
+                    self.stdout.write(self.style.SUCCESS("<< Repaired {} topics".format(repaired)))
+
+        except KeyboardInterrupt:
+            pass
+
+        finally:
+            client.wait()
@@ -1,16 +1,47 @@
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
 from django.conf import settings
 
+from mqtt.aio import AsyncioEngine
+from mqtt.spool import MemorySpool, SQLiteSpool, SPOOL_SIZE, OVERFLOW_POLICIES, DROP_OLDEST
 from mqtt.subscribe import SubscribeClient
 
 
 class Command(BaseCommand):
     help = 'Connect to the mqtt broker'
 
+    def add_arguments(self, parser):
+        parser.add_argument('--engine', choices=['thread', 'asyncio'], default='thread',
+                            help="run on paho's network thread or on an asyncio loop")
+        parser.add_argument('--max-pending', nargs='?', type=int, default=1000,
+                            help='maximum number of messages in flight with the asyncio engine')
+        parser.add_argument('--workers', nargs='?', type=int, default=0,
+                            help='number of worker threads; 0 runs handlers on the network thread')
+        parser.add_argument('--queue-size', nargs='?', type=int, default=100,
+                            help='maximum number of pending messages per worker')
+        parser.add_argument('--coalesce', nargs='?', type=float, default=0,
+                            help='seconds to hold ambulance position updates, saving only the latest; 0 disables')
+        parser.add_argument('--error-window', nargs='?', type=float, default=10,
+                            help='seconds during which identical errors to a client are collapsed')
+        parser.add_argument('--error-rate', nargs='?', type=int, default=5,
+                            help='maximum number of errors sent to a client per second')
+        parser.add_argument('--partitions', nargs='?', type=int, default=1,
+                            help='number of mqttclient processes sharing the load')
+        parser.add_argument('--partition', nargs='?', type=int, default=0,
+                            help='partition handled by this process, from 0 to partitions - 1')
+        parser.add_argument('--spool', nargs='?', default=None,
+                            help='SQLite file holding messages that could not be published; kept in memory if not given')
+        parser.add_argument('--spool-size', nargs='?', type=int, default=SPOOL_SIZE,
+                            help='maximum number of messages held while disconnected')
+        parser.add_argument('--spool-overflow', choices=OVERFLOW_POLICIES, default=DROP_OLDEST,
+                            help='what to do when the spool is full')
+
     def handle(self, *args, **options):
 
         import os
 
+        if not 0 <= options['partition'] < options['partitions']:
+            raise CommandError('--partition must be between 0 and {}'.format(options['partitions'] - 1))
+
         broker = {
             'USERNAME': '',
             'PASSWORD': '',
@@ -23,16 +54,44 @@ class Command(BaseCommand):
         broker.update(settings.MQTT)
         broker['CLIENT_ID'] = broker['CLIENT_ID'] + '_' + str(os.getpid())
 
+        # messages that could not be published
+        if options['spool']:
+            spool = SQLiteSpool(options['spool'],
+                                maxsize=options['spool_size'],
+                                overflow=options['spool_overflow'])
+        else:
+            spool = MemorySpool(maxsize=options['spool_size'],
+                                overflow=options['spool_overflow'])
+
+        # the asyncio engine runs handlers on its own executor
+        asyncio = options['engine'] == 'asyncio'
+
         client = SubscribeClient(broker,
                                  stdout=self.stdout,
                                  style=self.style,
-                                 verbosity=options['verbosity'])
+                                 verbosity=options['verbosity'],
+                                 workers=0 if asyncio else options['workers'],
+                                 queue_size=options['queue_size'],
+                                 coalesce=options['coalesce'],
+                                 error_window=options['error_window'],
+                                 error_rate=options['error_rate'],
+                                 partitions=options['partitions'],
+                                 partition=options['partition'],
+                                 spool=spool)
 
         self.stdout.write(
             self.style.SUCCESS("""* * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * *
 * * *                    M Q T T   C L I E N T                    * * *
 * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * *"""))
 
+        if asyncio:
+
+            # disconnects on shutdown
+            AsyncioEngine(client,
+                          workers=options['workers'] or 8,
+                          max_pending=options['max_pending']).run()
+            return
+
         try:
             client.loop_forever()
 
@@ -0,0 +1,114 @@
+import os
+import time
+
+from django.core.management.base import BaseCommand
+from django.conf import settings
+
+from mqtt.client import BaseClient
+from mqtt.recording import RecordWriter
+from mqtt.router import TopicRouter
+from mqtt.subscribe import SubscribeClient
+
+
+class Client(BaseClient):
+
+    def __init__(self, broker, **kwargs):
+
+        self.writer = kwargs.pop('writer')
+        self.count = kwargs.pop('count', 0)
+        self.start = None
+
+        # record only the topics handled by SubscribeClient
+        self.filters = [topic for topic in TopicRouter((pattern, None, key)
+                                                       for (pattern, _, key) in SubscribeClient.routes)
+                        .subscriptions()
+                        if topic.startswith('user/')]
+
+        # call super
+        super().__init__(broker, **kwargs)
+
+    def done(self):
+        return self.count and self.writer.count >= self.count
+
+    def on_connect(self, client, userdata, flags, rc):
+
+        # is connected?
+        if not super().on_connect(client, userdata, flags, rc):
+            return False
+
+        for topic in self.filters:
+            self.subscribe(topic, 2)
+
+        if self.verbosity > 0:
+            self.stdout.write(self.style.SUCCESS(">> Recording MQTT messages..."))
+
+        return True
+
+    def on_message(self, client, userdata, msg):
+
+        # retained messages are not traffic
+        if msg.retain or self.done():
+            return
+
+        # time offset from first message
+        now = time.monotonic()
+        if self.start is None:
+            self.start = now
+
+        self.writer.write(now - self.start, msg.topic, msg.payload, msg.qos)
+
+        if self.verbosity > 1:
+            self.stdout.write(" > {}".format(msg.topic))
+
+
+class Command(BaseCommand):
+    help = 'Record inbound mqtt client traffic to a file for mqttreplay'
+
+    def add_arguments(self, parser):
+        parser.add_argument('file')
+        parser.add_argument('--duration', nargs='?', type=float, default=0,
+                            help='seconds to record; 0 records until interrupted')
+        parser.add_argument('--count', nargs='?', type=int, default=0,
+                            help='number of messages to record; 0 records until interrupted')
+
+    def handle(self, *args, **options):
+
+        broker = {
+            'USERNAME': '',
+            'PASSWORD': '',
+            'HOST': 'localhost',
+            'PORT': 1883,
+            'KEEPALIVE': 60,
+            'CLIENT_ID': 'django',
+            'CLEAN_SESSION': True
+        }
+        broker.update(settings.MQTT)
+        broker['CLIENT_ID'] = 'mqttrecord_' + str(os.getpid())
+
+        with RecordWriter(options['file']) as writer:
+
+            client = Client(broker,
+                            writer=writer,
+                            count=options['count'],
+                            stdout=self.stdout,
+                            style=self.style,
+                            verbosity=options['verbosity'])
+
+            duration = options['duration']
+            deadline = time.monotonic() + duration if duration > 0 else None
+
+            try:
+                client.loop_start()
+                while not client.done() and (deadline is None or time.monotonic() < deadline):
+                    time.sleep(0.1)
+
+            except KeyboardInterrupt:
+                pass
+
+            finally:
+                client.loop_stop()
+                client.disconnect()
+
+            if options['verbosity'] > 0:
+                self.stdout.write(self.style.SUCCESS("<< Recorded {} messages to '{}'".format(writer.count,
+                                                                                          options['file'])))
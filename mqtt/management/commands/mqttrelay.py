@@ -0,0 +1,93 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.conf import settings
+
+from mqtt.client import BaseClient, MQTTException
+from mqtt.delta import DatabaseDeltaEncoder, DELTA_SNAPSHOT_INTERVAL
+from mqtt.outbox import OutboxRelay, OUTBOX_BATCH_SIZE, OUTBOX_TIMEOUT
+from mqtt.payloads import cache_info as payload_cache_info
+
+
+class Command(BaseCommand):
+    help = 'Publish the messages in the outbox to the mqtt broker'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', nargs='?', type=int, default=OUTBOX_BATCH_SIZE,
+                            help='maximum number of messages published per transaction')
+        parser.add_argument('--interval', nargs='?', type=float, default=0.5,
+                            help='seconds to wait when the outbox is empty')
+        parser.add_argument('--timeout', nargs='?', type=float, default=OUTBOX_TIMEOUT,
+                            help='seconds to wait for the broker to acknowledge a batch')
+        parser.add_argument('--once', action='store_true', default=False,
+                            help='exit once the outbox is empty')
+
+    def handle(self, *args, **options):
+
+        import os
+
+        broker = {
+            'USERNAME': '',
+            'PASSWORD': '',
+            'HOST': 'localhost',
+            'PORT': 1883,
+            'KEEPALIVE': 60,
+            'CLEAN_SESSION': True
+        }
+        broker.update(settings.MQTT)
+        broker['CLIENT_ID'] = 'mqttrelay_' + str(os.getpid())
+
+        client = BaseClient(broker,
+                            stdout=self.stdout,
+                            style=self.style,
+                            verbosity=options['verbosity'])
+        client.loop_start()
+
+        # publish deltas?
+        delta = None
+        if broker.get('DELTA'):
+            delta = DatabaseDeltaEncoder(interval=broker.get('DELTA_SNAPSHOT_INTERVAL', DELTA_SNAPSHOT_INTERVAL))
+
+        relay = OutboxRelay(client,
+                            batch_size=options['batch_size'],
+                            timeout=options['timeout'],
+                            delta=delta)
+
+        try:
+            while True:
+
+                # wait for connection
+                if not client.connected:
+                    time.sleep(options['interval'])
+                    continue
+
+                try:
+                    relayed = relay.relay()
+
+                except MQTTException as e:
+                    # batch stays in the outbox
+                    self.stdout.write(self.style.ERROR('* Could not relay batch: {}'.format(e)))
+                    time.sleep(options['interval'])
+                    continue
+
+                if relayed:
+                    if options['verbosity'] > 1:
+                        self.stdout.write('   relayed {} messages'.format(relayed))
+
+                elif options['once']:
+                    break
+
+                else:
+                    time.sleep(options['interval'])
+
+        except KeyboardInterrupt:
+            pass
+
+        finally:
+            client.disconnect()
+            if options['verbosity'] > 0:
+                info = payload_cache_info()
+                self.stdout.write(self.style.SUCCESS(
+                    '<< Relayed {} outbox entries, published {} messages'.format(relay.relayed, relay.published)))
+                self.stdout.write(self.style.SUCCESS(
+                    '<< Payload cache: {} hits, {} misses'.format(info.hits, info.misses)))
@@ -0,0 +1,140 @@
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.conf import settings
+
+from mqtt.broker import LocalClient, default_broker
+from mqtt.metrics import HandlerMetrics
+from mqtt.publish import PublishClient, SingletonPublishClient
+from mqtt.recording import read_records
+from mqtt.subscribe import SubscribeClient
+
+
+class Command(BaseCommand):
+    help = ('Replay traffic recorded with mqttrecord against SubscribeClient and report '
+            'throughput, handler latency and database queries per message. '
+            'Replayed messages are saved to the database; do not run against production.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('file')
+        parser.add_argument('--speed', nargs='?', type=float, default=1,
+                            help='replay speed relative to the recording; 0 replays as fast as possible')
+        parser.add_argument('--mode', choices=['local', 'broker'], default='local',
+                            help='replay in-process with a local client or through the mqtt broker; '
+                                 'in broker mode mqttclient must not be running')
+        parser.add_argument('--limit', nargs='?', type=int, default=0,
+                            help='maximum number of messages to replay; 0 replays all')
+        parser.add_argument('--timeout', nargs='?', type=float, default=10,
+                            help='seconds to wait for the last messages in broker mode')
+        parser.add_argument('--workers', nargs='?', type=int, default=0)
+        parser.add_argument('--queue-size', nargs='?', type=int, default=100)
+        parser.add_argument('--coalesce', nargs='?', type=float, default=0)
+
+    def handle(self, *args, **options):
+
+        broker = {
+            'USERNAME': '',
+            'PASSWORD': '',
+            'HOST': 'localhost',
+            'PORT': 1883,
+            'KEEPALIVE': 60,
+            'CLIENT_ID': 'django',
+            'CLEAN_SESSION': True
+        }
+        broker.update(settings.MQTT)
+        broker['CLIENT_ID'] = 'mqttreplay_' + str(os.getpid())
+
+        try:
+            records = list(read_records(options['file']))
+        except (OSError, ValueError) as e:
+            raise CommandError(str(e))
+
+        if options['limit'] > 0:
+            records = records[:options['limit']]
+
+        local = options['mode'] == 'local'
+        speed = options['speed']
+        kwargs = {'client_class': LocalClient} if local else {}
+
+        # model updates are published in-process too
+        if local:
+            SingletonPublishClient(client_class=LocalClient)
+
+        metrics = HandlerMetrics()
+        subscriber = SubscribeClient(broker,
+                                     stdout=self.stdout,
+                                     style=self.style,
+                                     verbosity=0,
+                                     metrics=metrics,
+                                     workers=options['workers'],
+                                     queue_size=options['queue_size'],
+                                     coalesce=options['coalesce'],
+                                     **kwargs)
+        subscriber.loop_start()
+
+        # wait for subscriptions
+        while not subscriber.connected:
+            time.sleep(0.01)
+        if local:
+            subscriber.client.join()
+            publish = default_broker.publish
+        else:
+            time.sleep(1)
+            broker['CLIENT_ID'] = 'mqttreplay_publish_' + str(os.getpid())
+            publisher = PublishClient(broker, verbosity=0)
+            publisher.loop_start()
+            publish = publisher.client.publish
+
+        if options['verbosity'] > 0:
+            self.stdout.write(self.style.SUCCESS(">> Replaying {} messages at {}...".format(
+                len(records), '{}x'.format(speed) if speed > 0 else 'maximum speed')))
+
+        try:
+
+            start = time.perf_counter()
+            for record in records:
+
+                # keep recorded pace
+                if speed > 0:
+                    delay = record.timestamp / speed - (time.perf_counter() - start)
+                    if delay > 0:
+                        time.sleep(delay)
+
+                publish(record.topic, record.payload, record.qos)
+
+            # wait for handlers
+            if local:
+                subscriber.client.join()
+            else:
+                count, idle = metrics.count(), time.perf_counter()
+                while count < len(records) and time.perf_counter() - idle < options['timeout']:
+                    time.sleep(0.1)
+                    if metrics.count() != count:
+                        count, idle = metrics.count(), time.perf_counter()
+                publisher.loop_stop()
+                publisher.disconnect()
+
+            # drain worker pool and flush pending updates
+            subscriber.disconnect()
+            subscriber.loop_stop()
+            elapsed = time.perf_counter() - start
+
+        except KeyboardInterrupt:
+            subscriber.disconnect()
+            return
+
+        messages = len(records)
+        self.stdout.write(self.style.SUCCESS(" > replay"))
+        self.stdout.write("   messages: {}".format(messages))
+        self.stdout.write("   seconds: {}".format(round(elapsed, 3)))
+        self.stdout.write("   messages/s: {}".format(round(messages / elapsed, 1) if elapsed > 0 else None))
+
+        for (name, values) in metrics.summary():
+            self.stdout.write(self.style.SUCCESS(" > {}".format(name)))
+            for (label, value) in values.items():
+                self.stdout.write("   {}: {}".format(label, value))
+
+        if messages:
+            queries = dict(metrics.summary())['total']['queries']
+            self.stdout.write(self.style.SUCCESS(" > queries/message: {}".format(round(queries / messages, 2))))
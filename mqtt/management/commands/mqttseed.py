@@ -1,38 +1,69 @@
-from django.core.management.base import BaseCommand
+import threading
+import time
+
+from django.core.management.base import BaseCommand, CommandError
 from django.conf import settings
 from django.contrib.auth.models import User
-
-from login.permissions import cache_clear
+from django.db.models import Prefetch, Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from login.models import ClientLog, ClientActivity
+from login.permissions import cache_clear, cache_info as permission_cache_info
+from mqtt.client import MQTTException
+from mqtt.collector import PublishCollector
+from mqtt.payloads import cache_info as payload_cache_info
 from mqtt.publish import PublishClient
+from mqtt.seed import chunked, SEED_CHUNK_SIZE, SEED_WINDOW
+from mqtt.watermark import get_watermark, set_watermark, get_user_watermarks, get_tombstones, \
+    get_tombstone_holders, purge_tombstones, SEED_WATERMARK, PERMISSIONS_WATERMARK, WATERMARK_OVERLAP
 
-from ambulance.models import Ambulance, Call, CallStatus, AmbulanceCallStatus
+from ambulance.models import Ambulance, AmbulanceCall, Call, CallStatus, AmbulanceCallStatus, Waypoint
 
 from hospital.models import Hospital
 from equipment.models import EquipmentItem, EquipmentHolder
 
 
+def logouts(activity, since):
+    """
+    Returns the details, identifier or name, of the objects logged out of after since.
+    """
+    return ClientLog.objects.filter(activity=activity.name, updated_on__gt=since).values('details')
+
+
 class Client(PublishClient):
 
     def __init__(self, *args, **kwargs):
 
+        # seeding options
+        self.chunk_size = kwargs.pop('chunk_size', SEED_CHUNK_SIZE)
+        self.window = kwargs.pop('window', SEED_WINDOW)
+
+        # only seed changes after since?
+        self.since = kwargs.pop('since', None)
+
+        # seeding does not change the database, publish right away
+        kwargs.setdefault('collector', PublishCollector(defer=False))
+
         # call super
         super().__init__(*args, **kwargs)
 
-        # initialize
+        # in-flight publishes
+        self.inflight = threading.Condition()
         self.pubset = set()
-        self.can_disconnect = False
+        self.acked = set()
+        self.published = 0
 
-    # The callback for when the client receives a CONNACK
-    # response from the server.
-    def on_connect(self, client, userdata, flags, rc):
+        # objects/s and elapsed time per phase
+        self.phases = []
 
-        # is connected?
-        if not super().on_connect(client, userdata, flags, rc):
-            return False
+    def seed(self):
 
-        # initialize pubset
-        self.pubset = set()
-        self.can_disconnect = False
+        # changes after start are seeded next time
+        start = timezone.now()
+
+        # Remove deleted objects first, their topics may have been reused
+        self.seed_tombstones()
 
         # Seed settings
         self.seed_settings()
@@ -51,134 +82,207 @@ class Client(PublishClient):
         # Seed calls
         self.seed_call_data()
 
-        # Good to disconnect
-        self.can_disconnect = True
+        # wait for everything to be published
+        self.flush()
+
+        # record watermark
+        set_watermark(SEED_WATERMARK, start)
+        purge_tombstones(start - WATERMARK_OVERLAP)
+
+    def changed(self, queryset, conditions=None):
+
+        # objects updated after since, or matching conditions(since); all of them if since is None
+        if self.since is None:
+            return queryset
+        q = Q(updated_on__gt=self.since)
+        for condition in (conditions(self.since) if conditions is not None else ()):
+            q |= condition
+        return queryset.filter(q)
 
     def publish(self, topic, message, *vargs, **kwargs):
 
-        # increment pubcount then publish
+        # wait for room in the window
+        with self.inflight:
+            while len(self.pubset) >= self.window:
+                if not self.inflight.wait(timeout=60):
+                    raise MQTTException('Timed out waiting for the broker')
+
+        # publish outside the lock, on_publish may run before it returns
         result = self.client.publish(topic, message, *vargs, **kwargs)
-        self.pubset.add(result.mid)
 
-        # echo if verbosity > 0
-        if self.verbosity > 0:
+        with self.inflight:
+            if result.mid in self.acked:
+                self.acked.remove(result.mid)
+            else:
+                self.pubset.add(result.mid)
+
+        # echo if verbosity > 1
+        if self.verbosity > 1:
             if message is None:
                 op = '-'
             else:
                 op = '+'
-            if self.verbosity > 1:
+            if self.verbosity > 2:
                 self.stdout.write("   {}{}: {}".format(op, topic, message))
-            elif self.verbosity > 0:
+            else:
                 self.stdout.write("   {}{}".format(op, topic))
 
-    def seed_settings(self):
-        if self.verbosity > 0:
-            self.stdout.write(self.style.SUCCESS(">> Seeding settings"))
+    # Message publish callback
+    def on_publish(self, client, userdata, mid):
 
-        # seeding settings
-        self.publish_settings()
+        with self.inflight:
+            if mid in self.pubset:
+                self.pubset.remove(mid)
+            else:
+                # acknowledged before publish returned
+                self.acked.add(mid)
+            self.published += 1
+            self.inflight.notify_all()
 
-        if self.verbosity > 0:
-            self.stdout.write(self.style.SUCCESS("<< Done seeding settings"))
+    def flush(self, timeout=60):
 
-    def seed_profile_data(self):
+        # make sure all is published before disconnecting
+        with self.inflight:
+            while self.pubset:
+                if not self.inflight.wait(timeout=timeout):
+                    raise MQTTException('Timed out waiting for the broker')
+
+    def run_phase(self, name, objects, fn):
 
         if self.verbosity > 0:
-            self.stdout.write(self.style.SUCCESS(">> Seeding profile data"))
+            self.stdout.write(self.style.SUCCESS(">> Seeding {}".format(name)))
 
-        # clear profile cache
-        cache_clear()
+        start = time.perf_counter()
+        count = 0
+        for obj in objects:
+            fn(obj)
+            count += 1
+        elapsed = time.perf_counter() - start
 
-        # seeding profiles
-        for obj in User.objects.all():
-            self.publish_profile(obj)
+        self.phases.append((name, count, elapsed))
 
         if self.verbosity > 0:
-            self.stdout.write(self.style.SUCCESS("<< Done seeding profile data"))
+            rate = count / elapsed if elapsed > 0 else 0
+            self.stdout.write(self.style.SUCCESS("<< Done seeding {}: {} objects in {:.2f}s ({:.1f} objects/s)"
+                                                 .format(name, count, elapsed, rate)))
 
-    def seed_ambulance_data(self):
+    def seed_tombstones(self):
 
-        if self.verbosity > 0:
-            self.stdout.write(self.style.SUCCESS(">> Seeding ambulance data"))
+        # removing topics of deleted objects
+        self.run_phase('deleted objects',
+                       get_tombstones(self.since).iterator(),
+                       self.remove_topic)
 
-        # seeding ambulances
-        for obj in Ambulance.objects.all():
-            self.publish_ambulance(obj)
+    def seed_settings(self):
 
-        if self.verbosity > 0:
-            self.stdout.write(self.style.SUCCESS("<< Done seeding ambulance data"))
+        # seeding settings
+        self.run_phase('settings', [None], lambda obj: self.publish_settings())
 
-    def seed_hospital_data(self):
+    def seed_profile_data(self):
 
-        if self.verbosity > 0:
-            self.stdout.write(self.style.SUCCESS(">> Seeding hospital data"))
+        # clear local profile cache, shared permissions are versioned
+        cache_clear(shared=False)
 
-        # seeding hospital 
-        for obj in Hospital.objects.all():
-            self.publish_hospital(obj)
+        # seeding profiles, new users and users whose permissions changed, unless all of them changed
+        users = User.objects.all()
+        if self.since is not None:
+            changed = get_watermark(PERMISSIONS_WATERMARK)
+            if changed is None or changed <= self.since:
+                users = users.filter(Q(date_joined__gt=self.since) |
+                                     Q(id__in=get_user_watermarks(self.since)))
 
-        if self.verbosity > 0:
-            self.stdout.write(self.style.SUCCESS("<< Done seeding hospital data"))
+        self.run_phase('profile data',
+                       chunked(users, self.chunk_size),
+                       self.publish_profile)
 
-    def seed_equipment_data(self):
+    def seed_ambulance_data(self):
 
-        if self.verbosity > 0:
-            self.stdout.write(self.style.SUCCESS(">> Seeding equipment data"))
+        # seeding ambulances, including clients that logged in or out
+        ambulances = self.changed(Ambulance.objects.select_related('client'),
+                                  lambda since: (Q(client__updated_on__gt=since),
+                                                 Q(identifier__in=logouts(ClientActivity.AO, since))))
 
-        # seeding hospital 
-        for obj in EquipmentItem.objects.all():
-            self.publish_equipment_item(obj)
+        self.run_phase('ambulance data',
+                       chunked(ambulances, self.chunk_size),
+                       self.publish_ambulance)
 
-        if self.verbosity > 0:
-            self.stdout.write(self.style.SUCCESS("<< Done seeding equipment data"))
+    def seed_hospital_data(self):
 
-    def seed_equipment_metadata(self):
-        if self.verbosity > 0:
-            self.stdout.write(self.style.SUCCESS(">> Seeding equipment metadata"))
+        # seeding hospitals, including clients that logged in or out
+        hospitals = self.changed(Hospital.objects.all(),
+                                 lambda since: (Q(client__updated_on__gt=since),
+                                                Q(name__in=logouts(ClientActivity.HO, since))))
 
-        # seeding hospital metadata
-        for equipmentholder in EquipmentHolder.objects.all():
-            self.publish_equipment_metadata(equipmentholder)
+        self.run_phase('hospital data',
+                       chunked(hospitals, self.chunk_size),
+                       self.publish_hospital)
 
-        if self.verbosity > 0:
-            self.stdout.write(self.style.SUCCESS("<< Done seeding equipment metadata"))
+    def seed_equipment_data(self):
 
-    def seed_call_data(self):
+        # seeding equipment items
+        items = self.changed(EquipmentItem.objects.select_related('equipmentholder', 'equipment'))
+        self.run_phase('equipment data',
+                       chunked(items, self.chunk_size),
+                       self.publish_equipment_item)
 
-        if self.verbosity > 0:
-            self.stdout.write(self.style.SUCCESS(">> Seeding call data"))
+    def seed_equipment_metadata(self):
 
-        # seeding ambulances
-        for obj in Call.objects.all():
+        # seeding equipment metadata of holders with new, updated or deleted items
+        holders = EquipmentHolder.objects.all()
+        if self.since is not None:
+            holders = holders.filter(Q(id__in=EquipmentItem.objects.filter(updated_on__gt=self.since)
+                                       .values('equipmentholder')) |
+                                     Q(id__in=get_tombstone_holders(self.since)))
 
-            # if call is not ended
-            if obj.status != CallStatus.E.name:
-                self.publish_call(obj)
+        self.run_phase('equipment metadata',
+                       chunked(holders, self.chunk_size),
+                       self.publish_equipment_metadata)
 
-                for ambulancecall in obj.ambulancecall_set.all():
-                    if ambulancecall.status != AmbulanceCallStatus.C.name:
-                        self.publish_call_status(ambulancecall)
-                    else:
-                        self.remove_call_status(ambulancecall)
+    def seed_call_data(self):
 
-            else:
-                self.remove_call(obj)
+        # calls with updated ambulance calls or waypoints also changed
+        def changed(since):
+            return (Q(id__in=AmbulanceCall.objects.filter(updated_on__gt=since).values('call')),
+                    Q(id__in=Waypoint.objects.filter(Q(updated_on__gt=since) |
+                                                     Q(location__updated_on__gt=since))
+                      .values('ambulance_call__call')))
 
-        if self.verbosity > 0:
-            self.stdout.write(self.style.SUCCESS("<< Done seeding call data"))
+        # seeding calls that are not ended
+        calls = self.changed(Call.objects.exclude(status=CallStatus.E.name), changed) \
+            .prefetch_related('patient_set',
+                              'ambulancecall_set__waypoint_set__location')
 
-    # Message publish callback
-    def on_publish(self, client, userdata, mid):
+        def publish_call(call):
+            self.publish_call(call)
+            for ambulancecall in call.ambulancecall_set.all():
+                if ambulancecall.status != AmbulanceCallStatus.C.name:
+                    self.publish_call_status(ambulancecall)
+                else:
+                    self.remove_call_status(ambulancecall)
 
-        # make sure all is published before disconnecting
-        self.pubset.remove(mid)
-        if len(self.pubset) == 0 and self.can_disconnect:
-            self.disconnect()
+        self.run_phase('call data', chunked(calls, self.chunk_size), publish_call)
+
+        # removing ended calls, only their ids are loaded
+        ended = self.changed(Call.objects.filter(status=CallStatus.E.name), changed).only('id') \
+            .prefetch_related(Prefetch('ambulancecall_set',
+                                       queryset=AmbulanceCall.objects.only('id', 'call', 'ambulance')))
+
+        self.run_phase('ended calls', chunked(ended, self.chunk_size), self.remove_call)
 
 
 class Command(BaseCommand):
     help = 'Seed the mqtt broker'
 
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', nargs='?', type=int, default=SEED_CHUNK_SIZE,
+                            help='number of objects loaded per query')
+        parser.add_argument('--window', nargs='?', type=int, default=SEED_WINDOW,
+                            help='maximum number of messages waiting for the broker')
+        parser.add_argument('--since', nargs='?', type=str, default=None,
+                            help='only seed changes after this ISO 8601 date and time')
+        parser.add_argument('--incremental', action='store_true', default=False,
+                            help='only seed changes since the last successful seed')
+
     def handle(self, *args, **options):
 
         import os
@@ -195,16 +299,57 @@ class Command(BaseCommand):
         broker.update(settings.MQTT)
         broker['CLIENT_ID'] = 'mqttseed_' + str(os.getpid())
 
+        # changes since when?
+        since = None
+        if options['since']:
+            since = parse_datetime(options['since'])
+            if since is None:
+                raise CommandError("Invalid date and time '{}'".format(options['since']))
+            if timezone.is_naive(since):
+                since = timezone.make_aware(since)
+        elif options['incremental']:
+            since = get_watermark(SEED_WATERMARK)
+            if since is not None:
+                since -= WATERMARK_OVERLAP
+
+        if options['verbosity'] > 0:
+            if since is not None:
+                self.stdout.write(self.style.SUCCESS(">> Seeding changes since {}".format(since)))
+            else:
+                self.stdout.write(self.style.SUCCESS(">> Seeding everything"))
+
         client = Client(broker,
+                        since=since,
+                        chunk_size=options['chunk_size'],
+                        window=options['window'],
                         stdout=self.stdout,
                         style=self.style,
                         verbosity=options['verbosity'])
 
+        start = time.perf_counter()
         try:
-            client.loop_forever()
+
+            # wait for connection
+            client.loop_start()
+            while not client.connected:
+                time.sleep(0.1)
+
+            client.seed()
 
         except KeyboardInterrupt:
             pass
 
         finally:
             client.disconnect()
+            client.loop_stop()
+
+            if options['verbosity'] > 0:
+                elapsed = time.perf_counter() - start
+                self.stdout.write(self.style.SUCCESS(">> Published {} messages in {:.2f}s".format(client.published,
+                                                                                                  elapsed)))
+                info = payload_cache_info()
+                self.stdout.write(self.style.SUCCESS(">> Payload cache: {} hits, {} misses".format(info.hits,
+                                                                                               info.misses)))
+                info = permission_cache_info()
+                self.stdout.write(self.style.SUCCESS(">> Permission cache: {} hits ({} shared), {} misses".format(
+                    info.hits, info.shared_hits, info.misses)))
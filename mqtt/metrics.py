@@ -0,0 +1,80 @@
+import math
+import threading
+import time
+from collections import defaultdict
+
+from django.db import connection
+
+
+def percentile(values, p):
+    """
+    Returns the p-th percentile of sorted values using nearest rank.
+    """
+    if not values:
+        return None
+    return values[max(0, math.ceil(p / 100 * len(values)) - 1)]
+
+
+# HandlerMetrics
+
+class HandlerMetrics:
+    """
+    Collects the latency and number of database queries of each handler call.
+
+    Queries are counted on the connection of the thread that runs the handler.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.queries = defaultdict(int)
+
+    def measure(self, name, fn, *args, **kwargs):
+
+        queries = [0]
+
+        def counter(execute, sql, params, many, context):
+            queries[0] += 1
+            return execute(sql, params, many, context)
+
+        start = time.perf_counter()
+        try:
+            with connection.execute_wrapper(counter):
+                return fn(*args, **kwargs)
+        finally:
+            self.record(name, time.perf_counter() - start, queries[0])
+
+    def record(self, name, seconds, queries):
+        with self.lock:
+            self.latencies[name].append(seconds)
+            self.queries[name] += queries
+
+    def count(self):
+        with self.lock:
+            return sum(len(latencies) for latencies in self.latencies.values())
+
+    def summary(self):
+        """
+        Returns a list of (name, metrics) for each handler and for all handlers.
+        """
+
+        with self.lock:
+            latencies = {name: sorted(values) for (name, values) in self.latencies.items()}
+            queries = dict(self.queries)
+
+        latencies['total'] = sorted(value for values in latencies.values() for value in values)
+        queries['total'] = sum(queries.values())
+
+        results = []
+        for name in sorted(latencies, key=lambda name: (name == 'total', name)):
+            values = latencies[name]
+            results.append((name, {
+                'calls': len(values),
+                'p50 ms': round(1000 * percentile(values, 50), 3) if values else None,
+                'p95 ms': round(1000 * percentile(values, 95), 3) if values else None,
+                'p99 ms': round(1000 * percentile(values, 99), 3) if values else None,
+                'queries': queries[name],
+                'queries/call': round(queries[name] / len(values), 2) if values else None,
+            }))
+
+        return results
@@ -0,0 +1,73 @@
+from django.db import models
+from django.utils import timezone
+from django.utils.translation import ugettext_lazy as _
+
+
+class Outbox(models.Model):
+    """
+    A message waiting to be published by mqttrelay.
+
+    Messages are written in the same transaction as the changes they publish.
+    Serialized objects are stored as a reference to the serializer and the
+    object, and rendered by the relay. Delta entries are published as
+    snapshots and deltas of the object, encoded by the relay.
+    """
+
+    topic = models.CharField(_('topic'), max_length=254)
+    payload = models.BinaryField(_('payload'), null=True, blank=True)
+    serializer = models.CharField(_('serializer'), max_length=254, blank=True)
+    model = models.CharField(_('model'), max_length=254, blank=True)
+    object_id = models.CharField(_('object_id'), max_length=254, blank=True)
+    qos = models.PositiveSmallIntegerField(_('qos'), default=0)
+    retain = models.BooleanField(_('retain'), default=False)
+    delta = models.BooleanField(_('delta'), default=False)
+    created_on = models.DateTimeField(_('created_on'), default=timezone.now)
+
+    class Meta:
+        ordering = ['id']
+
+    def __str__(self):
+        return '{}: {}'.format(self.id, self.topic)
+
+
+class DeltaState(models.Model):
+    """
+    The stream, seq and last document published on a delta topic by mqttrelay.
+    """
+
+    topic = models.CharField(_('topic'), max_length=254, unique=True)
+    stream = models.CharField(_('stream'), max_length=32)
+    seq = models.PositiveIntegerField(_('seq'))
+    data = models.TextField(_('data'))
+    snapshot_on = models.FloatField(_('snapshot_on'))
+
+    def __str__(self):
+        return '{}: {}/{}'.format(self.topic, self.stream, self.seq)
+
+
+class Watermark(models.Model):
+    """
+    The time of the last occurrence of a named event, such as a successful
+    mqttseed or a change of permissions.
+    """
+
+    name = models.CharField(_('name'), max_length=254, unique=True)
+    timestamp = models.DateTimeField(_('timestamp'))
+
+    def __str__(self):
+        return '{}: {}'.format(self.name, self.timestamp)
+
+
+class Tombstone(models.Model):
+    """
+    A retained topic of a deleted object, removed by the next incremental mqttseed.
+    """
+
+    topic = models.CharField(_('topic'), max_length=254)
+    deleted_on = models.DateTimeField(_('deleted_on'), default=timezone.now, db_index=True)
+
+    class Meta:
+        ordering = ['id']
+
+    def __str__(self):
+        return '{}: {}'.format(self.deleted_on, self.topic)
@@ -0,0 +1,170 @@
+import logging
+from collections import namedtuple
+
+from django.apps import apps
+from django.db import models, transaction
+from django.utils.module_loading import import_string
+from rest_framework import serializers
+from rest_framework.renderers import JSONRenderer
+
+from .client import MQTTException
+from .models import Outbox
+from .payloads import payload_cache
+
+logger = logging.getLogger(__name__)
+
+OUTBOX_BATCH_SIZE = 100
+OUTBOX_TIMEOUT = 10
+
+OutboxMessage = namedtuple('OutboxMessage', ['topic', 'payload', 'qos', 'retain'])
+
+
+def write_outbox(topic, payload=None, qos=0, retain=False, delta=False):
+    """
+    Adds a message to the outbox; payload None publishes null.
+
+    Serializers of a single model instance are not rendered, the relay renders
+    them when it publishes. Anything else is rendered right away.
+
+    If delta, the serializer is published as a snapshot or delta of its
+    instance by the relay, and payload None ends the stream of the topic.
+    """
+
+    entry = Outbox(topic=topic, qos=qos, retain=retain, delta=delta)
+
+    if isinstance(payload, serializers.Serializer) and isinstance(payload.instance, models.Model):
+        entry.serializer = '{}.{}'.format(type(payload).__module__, type(payload).__qualname__)
+        entry.model = payload.instance._meta.label
+        entry.object_id = str(payload.instance.pk)
+
+    elif isinstance(payload, serializers.BaseSerializer):
+        entry.payload = JSONRenderer().render(payload.data)
+
+    elif isinstance(payload, bytes):
+        entry.payload = payload
+
+    elif payload is not None:
+        entry.payload = JSONRenderer().render(payload)
+
+    entry.save()
+    return entry
+
+
+# OutboxRelay
+
+class OutboxRelay:
+    """
+    Publishes outbox messages in order with a connected BaseClient.
+
+    Each batch is locked, published, acknowledged by the broker and deleted
+    in one transaction; if anything fails the batch stays in the outbox and
+    is published again, so delivery is at least once. Several references to
+    the same topic in a batch are rendered and published once, at the
+    position of the last one, since they would render the same data.
+
+    Delta entries are encoded with delta, a DatabaseDeltaEncoder, in the
+    transaction of the batch, so that relays continue each other's streams;
+    they are skipped if delta is None.
+    """
+
+    def __init__(self, client, batch_size=OUTBOX_BATCH_SIZE, timeout=OUTBOX_TIMEOUT, queryset=None, delta=None):
+        self.client = client
+        self.delta = delta
+        self.queryset = queryset if queryset is not None else Outbox.objects.all()
+        self.batch_size = batch_size
+        self.timeout = timeout
+        self.serializers = {}
+        self.relayed = 0
+        self.published = 0
+
+    def render(self, entries):
+
+        # last reference per topic
+        last = {}
+        for (index, entry) in enumerate(entries):
+            if entry.serializer:
+                last[entry.topic] = index
+
+        messages = []
+        for (index, entry) in enumerate(entries):
+
+            if entry.delta and self.delta is None:
+                continue
+
+            if not entry.serializer:
+                if entry.delta:
+                    # stream ended
+                    self.delta.reset(entry.topic)
+                payload = bytes(entry.payload) if entry.payload is not None else None
+                messages.append(OutboxMessage(entry.topic, payload, entry.qos, entry.retain))
+                continue
+
+            if last[entry.topic] != index:
+                continue
+
+            serializer = self.serializers.get(entry.serializer)
+            if serializer is None:
+                serializer = self.serializers[entry.serializer] = import_string(entry.serializer)
+
+            model = apps.get_model(entry.model)
+            try:
+                instance = model.objects.get(pk=entry.object_id)
+            except model.DoesNotExist:
+                # deleted since, its removal follows
+                logger.debug("OutboxRelay: '{}' no longer exists, skipping".format(entry.topic))
+                continue
+
+            if entry.delta:
+                (message, snapshot) = self.delta.encode(entry.topic, serializer(instance).data)
+                if message is not None:
+                    messages.append(OutboxMessage(entry.topic, JSONRenderer().render(message),
+                                                  entry.qos, snapshot))
+                continue
+
+            messages.append(OutboxMessage(entry.topic, payload_cache.render(serializer(instance)),
+                                          entry.qos, entry.retain))
+
+        return messages
+
+    def relay(self):
+        """
+        Publishes the next batch. Returns the number of outbox entries relayed.
+        """
+
+        with transaction.atomic():
+
+            entries = list(self.queryset.select_for_update().order_by('id')[:self.batch_size])
+            if not entries:
+                return 0
+
+            # publish
+            infos = []
+            for message in self.render(entries):
+                info = self.client.client.publish(message.topic, message.payload, message.qos, message.retain)
+                if info.rc:
+                    raise MQTTException('Could not publish to topic (rc = {})'.format(info.rc), info.rc)
+                infos.append(info)
+
+            # wait for the broker
+            for info in infos:
+                info.wait_for_publish(self.timeout)
+                if not info.is_published():
+                    raise MQTTException('Timed out waiting for the broker')
+
+            Outbox.objects.filter(id__in=[entry.id for entry in entries]).delete()
+
+        self.relayed += len(entries)
+        self.published += len(infos)
+        return len(entries)
+
+    def drain(self):
+        """
+        Relays batches until the outbox is empty. Returns the number of entries relayed.
+        """
+
+        total = 0
+        while True:
+            relayed = self.relay()
+            if not relayed:
+                return total
+            total += relayed
@@ -0,0 +1,142 @@
+import logging
+import threading
+from collections import OrderedDict, namedtuple
+
+from django.core.exceptions import ObjectDoesNotExist
+from django.db import models
+from django.db.models.signals import post_save, post_delete
+from rest_framework.renderers import JSONRenderer
+
+from ambulance.serializers import AmbulanceSerializer, CallSerializer
+from equipment.serializers import EquipmentItemSerializer
+from login.serializers import UserProfileSerializer
+
+logger = logging.getLogger(__name__)
+
+PAYLOAD_CACHE_SIZE = 1000
+
+PayloadCacheInfo = namedtuple('PayloadCacheInfo', ['hits', 'misses', 'invalidations', 'maxsize', 'currsize'])
+
+
+def client_id(ambulance):
+    try:
+        return ambulance.client.client_id
+    except ObjectDoesNotExist:
+        return None
+
+
+# version of the payload rendered by a serializer, updated_on of the instance if not listed;
+# it must cover every related row the serializer reads, None if it cannot be cached
+VERSIONS = {
+    # client_id comes from the client logged into the ambulance
+    AmbulanceSerializer: lambda serializer: (serializer.instance.updated_on, client_id(serializer.instance)),
+    # equipment name and type come from the equipment
+    EquipmentItemSerializer: lambda serializer: (serializer.instance.updated_on,
+                                                 serializer.instance.equipment.name,
+                                                 serializer.instance.equipment.type),
+    # patients, ambulance calls and waypoints have no version of their own
+    CallSerializer: lambda serializer: None,
+    # a new Permissions object is returned whenever the permissions change
+    UserProfileSerializer: lambda serializer: serializer._permissions,
+}
+
+
+def get_version(serializer):
+    version = VERSIONS.get(type(serializer))
+    if version is not None:
+        return version(serializer)
+    return getattr(serializer.instance, 'updated_on', None)
+
+
+# PayloadCache
+
+class PayloadCache:
+    """
+    Bounded LRU cache of the payloads rendered by serializers of a single instance.
+
+    Entries are keyed by model and pk and hold the serializer class and the
+    version of the instance and of the related rows they were rendered from,
+    so objects updated by other processes are rendered again. Saving or
+    deleting an object in this process evicts its entry.
+    """
+
+    def __init__(self, maxsize=PAYLOAD_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.lock = threading.Lock()
+        self.cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def render(self, serializer):
+        """
+        Returns JSONRenderer().render(serializer.data), from the cache if possible.
+        """
+
+        instance = serializer.instance
+        version = get_version(serializer) if isinstance(instance, models.Model) else None
+        if version is None or instance.pk is None:
+            return JSONRenderer().render(serializer.data)
+
+        key = (instance._meta.label, instance.pk)
+        with self.lock:
+            entry = self.cache.get(key)
+            if entry is not None and entry[0] is type(serializer) and entry[1] == version:
+                self.cache.move_to_end(key)
+                self.hits += 1
+                return entry[2]
+            self.misses += 1
+
+        payload = JSONRenderer().render(serializer.data)
+
+        with self.lock:
+            self.cache[key] = (type(serializer), version, payload)
+            self.cache.move_to_end(key)
+            while len(self.cache) > self.maxsize:
+                self.cache.popitem(last=False)
+
+        return payload
+
+    def evict(self, label, pk=None):
+        """
+        Evicts the payload of the object with pk, or of every object if pk is None.
+        """
+
+        with self.lock:
+            if pk is not None:
+                keys = [(label, pk)] if (label, pk) in self.cache else []
+            else:
+                keys = [key for key in self.cache if key[0] == label]
+            for key in keys:
+                del self.cache[key]
+            self.invalidations += len(keys)
+
+    def invalidate(self, sender, instance, **kwargs):
+        self.evict(sender._meta.label, instance.pk)
+
+    def connect(self):
+        post_save.connect(self.invalidate, weak=False, dispatch_uid=('mqtt_payload_cache', id(self)))
+        post_delete.connect(self.invalidate, weak=False, dispatch_uid=('mqtt_payload_cache', id(self)))
+
+    def disconnect(self):
+        post_save.disconnect(dispatch_uid=('mqtt_payload_cache', id(self)))
+        post_delete.disconnect(dispatch_uid=('mqtt_payload_cache', id(self)))
+
+    def clear(self):
+        with self.lock:
+            self.cache.clear()
+            self.hits = 0
+            self.misses = 0
+            self.invalidations = 0
+
+    def info(self):
+        with self.lock:
+            return PayloadCacheInfo(self.hits, self.misses, self.invalidations, self.maxsize, len(self.cache))
+
+
+payload_cache = PayloadCache()
+payload_cache.connect()
+
+render_payload = payload_cache.render
+cache_clear = payload_cache.clear
+cache_info = payload_cache.info
@@ -2,6 +2,8 @@ import atexit
 import logging
 import os
 
+from rest_framework import serializers
+
 from ambulance.serializers import AmbulanceSerializer
 from ambulance.serializers import CallSerializer
 from equipment.models import Equipment
@@ -10,6 +12,11 @@ from hospital.serializers import HospitalSerializer
 from login.serializers import UserProfileSerializer
 from login.views import SettingsView
 from .client import BaseClient, MQTTException
+from .collector import PublishCollector
+from .outbox import write_outbox
+from .payloads import payload_cache
+from .spool import SQLiteSpool, SPOOL_SIZE, DROP_OLDEST
+from .telemetry import encode_telemetry
 
 logger = logging.getLogger(__name__)
 
@@ -70,6 +77,25 @@ class PublishClient(BaseClient):
 
     def __init__(self, broker, **kwargs):
 
+        # publishes made inside a transaction wait for the commit
+        self.collector = kwargs.pop('collector', PublishCollector())
+
+        # write to the outbox instead, mqttrelay publishes
+        self.outbox = kwargs.pop('outbox', False)
+
+        # reuse payloads of unchanged objects
+        self.payload_cache = kwargs.pop('payload_cache', payload_cache)
+
+        # retain object topics? shared by the signals, mqttseed and mqttcheck
+        self.retain = kwargs.pop('retain', bool(broker.get('RETAIN')))
+
+        # also publish deltas of ambulances and hospitals? a DeltaEncoder, which
+        # must be the only one publishing them, or True to have mqttrelay encode them
+        self.delta = kwargs.pop('delta', None)
+
+        # also publish binary telemetry of ambulances?
+        self.telemetry = kwargs.pop('telemetry', False)
+
         # call super
         super().__init__(broker, **kwargs)
 
@@ -84,27 +110,40 @@ class PublishClient(BaseClient):
         # call super
         super().on_disconnect(client, userdata, rc)
 
-    def publish_topic(self, topic, payload, qos=0, retain=False):
-        if self.active:
-            super().publish_topic(topic, payload, qos, retain)
+    def render(self, payload):
+        if isinstance(payload, serializers.Serializer) and self.payload_cache is not None:
+            return self.payload_cache.render(payload)
+        return super().render(payload)
+
+    def publish_topic(self, topic, payload, qos=0, retain=None):
+        if retain is None:
+            retain = self.retain
+        if self.outbox:
+            write_outbox(topic, payload, qos, retain)
+        elif self.active:
+            # only the last payload per topic is rendered and published after commit
+            self.collector.add(topic, super().publish_topic, topic, payload, qos, retain)
 
     def remove_topic(self, topic, qos=0):
-        if self.active:
-            super().remove_topic(topic, qos)
+        if self.outbox:
+            write_outbox(topic, None, qos, True)
+        elif self.active:
+            self.collector.add(topic, super().remove_topic, topic, qos)
 
     def publish_message(self, message, qos=2):
-        self.publish_topic('message',
-                           message,
-                           qos=qos,
-                           retain=False)
+        if self.outbox:
+            write_outbox('message', message, qos, False)
+        elif self.active:
+            # messages are not state, every one of them is published
+            self.collector.add(None, super().publish_topic, 'message', message, qos, False)
 
-    def publish_settings(self, qos=2, retain=False):
+    def publish_settings(self, qos=2, retain=None):
         self.publish_topic('settings',
                            SettingsView.get_settings(),
                            qos=qos,
                            retain=retain)
 
-    def publish_profile(self, user, qos=2, retain=False):
+    def publish_profile(self, user, qos=2, retain=None):
         self.publish_topic('user/{}/profile'.format(user.username),
                            UserProfileSerializer(user),
                            qos=qos,
@@ -113,26 +152,74 @@ class PublishClient(BaseClient):
     def remove_profile(self, user):
         self.remove_topic('user/{}/profile'.format(user.username))
 
-    def publish_ambulance(self, ambulance, qos=2, retain=False):
+    def publish_delta(self, topic, serializer, qos=2):
+        if self.delta is None or not self.active:
+            return
+        if self.outbox:
+            # encoded by mqttrelay
+            write_outbox(topic, serializer, qos, False, delta=True)
+        else:
+            self.collector.add(topic, self._publish_delta, topic, serializer, qos)
+
+    def _publish_delta(self, topic, serializer, qos):
+        # serializer.data is shared with the data topic
+        (message, snapshot) = self.delta.encode(topic, serializer.data)
+        if message is not None:
+            BaseClient.publish_topic(self, topic, message, qos=qos, retain=snapshot)
+
+    def remove_delta(self, topic):
+        if self.delta is None:
+            return
+        if self.outbox:
+            # also ends the stream in mqttrelay
+            write_outbox(topic, None, 0, True, delta=True)
+        else:
+            self.delta.reset(topic)
+            self.remove_topic(topic)
+
+    def publish_ambulance(self, ambulance, qos=2, retain=None):
+        serializer = AmbulanceSerializer(ambulance)
         self.publish_topic('ambulance/{}/data'.format(ambulance.id),
-                           AmbulanceSerializer(ambulance),
+                           serializer,
                            qos=qos,
                            retain=retain)
+        self.publish_delta('ambulance/{}/delta'.format(ambulance.id),
+                           serializer,
+                           qos=qos)
+        if self.telemetry:
+            self.publish_telemetry(ambulance, qos=qos, retain=retain)
 
     def remove_ambulance(self, ambulance):
         self.remove_topic('ambulance/{}/data'.format(ambulance.id))
+        self.remove_delta('ambulance/{}/delta'.format(ambulance.id))
+        if self.telemetry:
+            self.remove_topic('ambulance/{}/telemetry'.format(ambulance.id))
+
+    def publish_telemetry(self, ambulance, qos=2, retain=None):
+        self.publish_topic('ambulance/{}/telemetry'.format(ambulance.id),
+                           encode_telemetry(location=ambulance.location,
+                                            orientation=ambulance.orientation,
+                                            status=ambulance.status,
+                                            timestamp=ambulance.timestamp),
+                           qos=qos,
+                           retain=retain)
 
-    def publish_hospital(self, hospital, qos=2, retain=False):
+    def publish_hospital(self, hospital, qos=2, retain=None):
+        serializer = HospitalSerializer(hospital)
         self.publish_topic('hospital/{}/data'.format(hospital.id),
-                           HospitalSerializer(hospital),
+                           serializer,
                            qos=qos,
                            retain=retain)
+        self.publish_delta('hospital/{}/delta'.format(hospital.id),
+                           serializer,
+                           qos=qos)
 
     def remove_hospital(self, hospital):
         self.remove_topic('hospital/{}/data'.format(hospital.id))
+        self.remove_delta('hospital/{}/delta'.format(hospital.id))
         self.remove_topic('equipment/{}/metadata'.format(hospital.equipmentholder.id))
 
-    def publish_equipment_metadata(self, equipmentholder, qos=2, retain=False):
+    def publish_equipment_metadata(self, equipmentholder, qos=2, retain=None):
         equipment_items = equipmentholder.equipmentitem_set.values('equipment')
         equipments = Equipment.objects.filter(id__in=equipment_items)
         self.publish_topic('equipment/{}/metadata'.format(equipmentholder.id),
@@ -140,7 +227,7 @@ class PublishClient(BaseClient):
                            qos=qos,
                            retain=retain)
 
-    def publish_equipment_item(self, equipment_item, qos=2, retain=False):
+    def publish_equipment_item(self, equipment_item, qos=2, retain=None):
         self.publish_topic('equipment/{}/item/{}/data'.format(equipment_item.equipmentholder.id,
                                                               equipment_item.equipment.id),
                            EquipmentItemSerializer(equipment_item),
@@ -151,7 +238,7 @@ class PublishClient(BaseClient):
         self.remove_topic('equipment/{}/item/{}/data'.format(equipment_item.equipmentholder.id,
                                                              equipment_item.equipment.id))
 
-    def publish_call(self, call, qos=2, retain=False):
+    def publish_call(self, call, qos=2, retain=None):
         # otherwise, publish call data
         self.publish_topic('call/{}/data'.format(call.id),
                            CallSerializer(call),
@@ -165,7 +252,7 @@ class PublishClient(BaseClient):
 
         self.remove_topic('call/{}/data'.format(call.id))
 
-    def publish_call_status(self, ambulancecall, qos=2, retain=False):
+    def publish_call_status(self, ambulancecall, qos=2, retain=None):
         self.publish_topic('ambulance/{}/call/{}/status'.format(ambulancecall.ambulance_id,
                                                                 ambulancecall.call_id),
                            ambulancecall.status,
@@ -206,6 +293,31 @@ class SingletonPublishClient(PublishClient):
         # override client_id
         broker['CLIENT_ID'] = 'mqtt_publish_' + str(os.getpid())
 
+        # write to the outbox, do not connect
+        if broker.get('OUTBOX'):
+            logger.info('>> Writing MQTT updates to the outbox...')
+            self.outbox = True
+            self.active = True
+            self.retain = bool(broker.get('RETAIN'))
+            self.delta = True if broker.get('DELTA') else None
+            self.telemetry = bool(broker.get('TELEMETRY'))
+            return
+
+        # deltas are sequenced by mqttrelay alone, several processes
+        # publishing directly would interleave their streams
+        if broker.get('DELTA'):
+            logger.warning('MQTT DELTA requires OUTBOX, not publishing deltas')
+
+        # publish binary telemetry?
+        if broker.get('TELEMETRY') and 'telemetry' not in kwargs:
+            kwargs['telemetry'] = True
+
+        # spool to disk while disconnected?
+        if broker.get('SPOOL') and 'spool' not in kwargs:
+            kwargs['spool'] = SQLiteSpool(broker['SPOOL'],
+                                          maxsize=broker.get('SPOOL_SIZE', SPOOL_SIZE),
+                                          overflow=broker.get('SPOOL_OVERFLOW', DROP_OLDEST))
+
         try:
 
             # try to connect
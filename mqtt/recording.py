@@ -0,0 +1,63 @@
+import gzip
+import struct
+from collections import namedtuple
+
+MAGIC = b'EMSTRACK-MQTT-1\n'
+
+# time offset in seconds, qos, topic length, payload length
+HEADER = struct.Struct('<dBHI')
+
+Record = namedtuple('Record', ['timestamp', 'topic', 'payload', 'qos'])
+
+
+# RecordWriter
+
+class RecordWriter:
+    """
+    Writes MQTT messages with their time offsets to a gzip compressed file.
+    """
+
+    def __init__(self, path):
+        self.file = gzip.open(path, 'wb')
+        self.file.write(MAGIC)
+        self.count = 0
+
+    def write(self, timestamp, topic, payload, qos=0):
+        topic = topic.encode('utf-8')
+        payload = payload or b''
+        self.file.write(HEADER.pack(timestamp, qos, len(topic), len(payload)))
+        self.file.write(topic)
+        self.file.write(payload)
+        self.count += 1
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def read_records(path):
+    """
+    Yields the records in a file written by RecordWriter.
+    """
+
+    with gzip.open(path, 'rb') as file:
+
+        if file.read(len(MAGIC)) != MAGIC:
+            raise ValueError("'{}' is not an MQTT recording".format(path))
+
+        while True:
+            header = file.read(HEADER.size)
+            if not header:
+                break
+            if len(header) < HEADER.size:
+                raise ValueError("'{}' is truncated".format(path))
+
+            (timestamp, qos, topic_length, payload_length) = HEADER.unpack(header)
+            topic = file.read(topic_length).decode('utf-8')
+            payload = file.read(payload_length)
+            yield Record(timestamp, topic, payload, qos)
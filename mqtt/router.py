@@ -0,0 +1,122 @@
+import logging
+import re
+from collections import namedtuple
+
+logger = logging.getLogger(__name__)
+
+
+Route = namedtuple('Route', ['pattern', 'handler', 'key'])
+
+
+class _Node:
+    __slots__ = ('children', 'param', 'route')
+
+    def __init__(self):
+        self.children = {}
+        self.param = None
+        self.route = None
+
+
+# TopicRouter
+
+class TopicRouter:
+    """
+    Routes MQTT topics to handlers in a single pass over the topic levels.
+
+    Patterns are written with named and optionally typed parameters, e.g.
+
+        'user/{username}/client/{client_id}/ambulance/{ambulance_id:int}/data'
+
+    Each parameter matches exactly one topic level, like '+' in an MQTT filter.
+    Literal levels take precedence over parameters; if no route matches
+    through a literal level, the parameter is tried instead. A level that
+    cannot be converted to the parameter type does not match.
+    """
+
+    converters = {
+        'str': str,
+        'int': int,
+    }
+
+    param_regex = re.compile(r'^{(\w+)(?::(\w+))?}$')
+
+    def __init__(self, routes=()):
+        self.root = _Node()
+        self.routes = []
+        for route in routes:
+            self.add(*route)
+
+    def add(self, pattern, handler, key=None):
+
+        node = self.root
+        for level in pattern.split('/'):
+
+            match = self.param_regex.match(level)
+            if match:
+
+                # parameter
+                name, converter = match.group(1), match.group(2) or 'str'
+                if node.param is None:
+                    node.param = (name, self.converters[converter], _Node())
+                elif node.param[0] != name or node.param[1] is not self.converters[converter]:
+                    raise ValueError("Conflicting parameter '{}' in pattern '{}'".format(level, pattern))
+                node = node.param[2]
+
+            else:
+
+                # literal
+                node = node.children.setdefault(level, _Node())
+
+        if node.route is not None:
+            raise ValueError("Pattern '{}' already has a handler".format(pattern))
+
+        node.route = Route(pattern, handler, key)
+        self.routes.append(node.route)
+
+    def subscriptions(self):
+        """
+        Returns the MQTT subscription filters that cover all routes.
+        """
+        return [re.sub(r'{[^}]*}', '+', route.pattern) for route in self.routes]
+
+    def match(self, topic):
+        """
+        Returns (route, params) for topic or None if no route matches.
+        """
+
+        params = {}
+        route = self._match(self.root, topic.split('/'), 0, params)
+        if route is None:
+            return None
+
+        return route, params
+
+    def _match(self, node, levels, index, params):
+
+        # end of the topic?
+        if index == len(levels):
+            return node.route
+
+        level = levels[index]
+
+        # literals first
+        child = node.children.get(level)
+        if child is not None:
+            route = self._match(child, levels, index + 1, params)
+            if route is not None:
+                return route
+
+        # then back to the parameter
+        if node.param is not None:
+            (name, converter, child) = node.param
+            try:
+                params[name] = converter(level)
+            except ValueError:
+                return None
+
+            route = self._match(child, levels, index + 1, params)
+            if route is not None:
+                return route
+            del params[name]
+
+        return None
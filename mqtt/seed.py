@@ -0,0 +1,22 @@
+SEED_CHUNK_SIZE = 500
+SEED_WINDOW = 1000
+
+
+def chunked(queryset, chunk_size=SEED_CHUNK_SIZE):
+    """
+    Iterates over queryset in chunks of chunk_size objects ordered by pk.
+
+    Each chunk is a separate query, so prefetch_related on queryset applies
+    to every chunk, unlike with queryset.iterator().
+    """
+
+    last = None
+    while True:
+        chunk = queryset.order_by('pk')
+        if last is not None:
+            chunk = chunk.filter(pk__gt=last)
+        chunk = list(chunk[:chunk_size])
+        yield from chunk
+        if len(chunk) < chunk_size:
+            break
+        last = chunk[-1].pk
@@ -0,0 +1,242 @@
+import itertools
+import logging
+from abc import ABC, abstractmethod
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+logger = logging.getLogger(__name__)
+
+SPOOL_SIZE = 10000
+SPOOL_BATCH_SIZE = 100
+
+DROP_OLDEST = 'drop-oldest'
+COALESCE = 'coalesce'
+OVERFLOW_POLICIES = (DROP_OLDEST, COALESCE)
+
+SpoolInfo = namedtuple('SpoolInfo', ['depth', 'age', 'sent', 'dropped', 'coalesced'])
+
+
+# BaseSpool
+
+class BaseSpool(ABC):
+    """
+    Bounded FIFO of messages waiting to be published.
+
+    When the spool is full the overflow policy decides what gives:
+    DROP_OLDEST drops the oldest message, COALESCE replaces the spooled
+    message with the same topic, if any, and otherwise drops the oldest.
+    """
+
+    def __init__(self, maxsize=SPOOL_SIZE, overflow=DROP_OLDEST, clock=time.time):
+
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError("Unknown overflow policy '{}'".format(overflow))
+
+        self.maxsize = maxsize
+        self.overflow = overflow
+        self.clock = clock
+        self.lock = threading.RLock()
+        self.sent = 0
+        self.dropped = 0
+        self.coalesced = 0
+
+    def append(self, topic, payload=None, qos=0, retain=False):
+
+        with self.lock:
+
+            # full?
+            if len(self) >= self.maxsize:
+                if self.overflow == COALESCE and self._remove_topic(topic):
+                    self.coalesced += 1
+                else:
+                    self._remove_oldest()
+                    self.dropped += 1
+
+            self._append(self.clock(), {'topic': topic, 'payload': payload, 'qos': qos, 'retain': retain})
+
+    def drain(self, send, batch_size=SPOOL_BATCH_SIZE):
+        """
+        Calls send(message) on up to batch_size of the oldest messages and removes
+        the ones that were sent. Exceptions raised by send stop the batch and are
+        raised after the messages already sent are removed. Returns the number sent.
+        """
+
+        with self.lock:
+            sent = 0
+            try:
+                for (key, message) in self._peek(batch_size):
+                    send(message)
+                    sent += 1
+            finally:
+                self._remove_first(sent)
+                self.sent += sent
+            return sent
+
+    def info(self):
+        with self.lock:
+            oldest = self._oldest()
+            return SpoolInfo(len(self),
+                             self.clock() - oldest if oldest is not None else 0,
+                             self.sent, self.dropped, self.coalesced)
+
+    def close(self):
+        pass
+
+    @abstractmethod
+    def __len__(self):
+        pass
+
+    @abstractmethod
+    def _append(self, created, message):
+        pass
+
+    @abstractmethod
+    def _peek(self, n):
+        pass
+
+    @abstractmethod
+    def _remove_first(self, n):
+        pass
+
+    def _remove_oldest(self):
+        self._remove_first(1)
+
+    @abstractmethod
+    def _remove_topic(self, topic):
+        pass
+
+    @abstractmethod
+    def _oldest(self):
+        pass
+
+
+# MemorySpool
+
+class MemorySpool(BaseSpool):
+    """
+    Spool kept in memory; lost if the process restarts.
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.messages = OrderedDict()
+        self.topics = {}
+        self.sequence = 0
+
+    def __len__(self):
+        return len(self.messages)
+
+    def _append(self, created, message):
+        self.sequence += 1
+        self.messages[self.sequence] = (created, message)
+        self.topics[message['topic']] = self.sequence
+
+    def _peek(self, n):
+        result = []
+        for (key, (created, message)) in self.messages.items():
+            if len(result) >= n:
+                break
+            result.append((key, message))
+        return result
+
+    def _remove(self, key):
+        (created, message) = self.messages.pop(key)
+        if self.topics.get(message['topic']) == key:
+            del self.topics[message['topic']]
+
+    def _remove_first(self, n):
+        for key in list(itertools.islice(self.messages, n)):
+            self._remove(key)
+
+    def _remove_oldest(self):
+        if self.messages:
+            self._remove(next(iter(self.messages)))
+
+    def _remove_topic(self, topic):
+        key = self.topics.get(topic)
+        if key is None:
+            return False
+        self._remove(key)
+        return True
+
+    def _oldest(self):
+        for (created, message) in self.messages.values():
+            return created
+        return None
+
+
+# SQLiteSpool
+
+class SQLiteSpool(BaseSpool):
+    """
+    Spool kept in an SQLite database so that it survives restarts.
+
+    Several processes may share the same file: draining holds a write
+    transaction, so each message is sent by only one of them.
+    """
+
+    def __init__(self, path, **kwargs):
+        super().__init__(**kwargs)
+        self.path = path
+        self.connection = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS spool ('
+                                'id INTEGER PRIMARY KEY AUTOINCREMENT, '
+                                'created REAL NOT NULL, '
+                                'topic TEXT NOT NULL, '
+                                'payload BLOB, '
+                                'qos INTEGER NOT NULL, '
+                                'retain INTEGER NOT NULL)')
+        self.connection.execute('CREATE INDEX IF NOT EXISTS spool_topic ON spool (topic)')
+
+    def __len__(self):
+        with self.lock:
+            return self.connection.execute('SELECT COUNT(*) FROM spool').fetchone()[0]
+
+    def append(self, topic, payload=None, qos=0, retain=False):
+        with self.lock:
+            self.connection.execute('BEGIN IMMEDIATE')
+            try:
+                super().append(topic, payload, qos, retain)
+                self.connection.execute('COMMIT')
+            except BaseException:
+                self.connection.execute('ROLLBACK')
+                raise
+
+    def drain(self, send, batch_size=SPOOL_BATCH_SIZE):
+        with self.lock:
+            self.connection.execute('BEGIN IMMEDIATE')
+            try:
+                return super().drain(send, batch_size)
+            finally:
+                self.connection.execute('COMMIT')
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+    def _append(self, created, message):
+        payload = message['payload']
+        if isinstance(payload, str):
+            payload = payload.encode('utf-8')
+        self.connection.execute('INSERT INTO spool (created, topic, payload, qos, retain) VALUES (?, ?, ?, ?, ?)',
+                                (created, message['topic'], payload, message['qos'], int(message['retain'])))
+
+    def _peek(self, n):
+        rows = self.connection.execute('SELECT id, topic, payload, qos, retain FROM spool ORDER BY id LIMIT ?', (n,))
+        return [(id, {'topic': topic, 'payload': payload, 'qos': qos, 'retain': bool(retain)})
+                for (id, topic, payload, qos, retain) in rows.fetchall()]
+
+    def _remove_first(self, n):
+        if n > 0:
+            self.connection.execute('DELETE FROM spool WHERE id IN (SELECT id FROM spool ORDER BY id LIMIT ?)', (n,))
+
+    def _remove_topic(self, topic):
+        return self.connection.execute('DELETE FROM spool WHERE id = '
+                                       '(SELECT MAX(id) FROM spool WHERE topic = ?)', (topic,)).rowcount > 0
+
+    def _oldest(self):
+        return self.connection.execute('SELECT MIN(created) FROM spool').fetchone()[0]
@@ -1,4 +1,5 @@
 import logging
+import threading
 from io import BytesIO
 
 from django.contrib.auth.models import User
@@ -16,8 +17,16 @@ from equipment.serializers import EquipmentItemSerializer
 from hospital.models import Hospital
 from hospital.serializers import HospitalSerializer
 from login.models import Client, ClientLog, ClientStatus, ClientActivity
-from login.permissions import cache_clear
+from login.permissions import cache_clear, cache_evict as permission_cache_evict, \
+    cache_info as permission_cache_info, permission_cache
 from .client import BaseClient
+from .coalesce import Coalescer
+from .errors import ErrorLimiter, ERROR_WINDOW, ERROR_RATE
+from .identity import get_identity, cache_clear as identity_cache_clear, cache_evict as identity_cache_evict
+from .payloads import cache_info as payload_cache_info
+from .router import TopicRouter
+from .telemetry import AmbulanceTelemetry, DecodedTelemetry, parse_json
+from .workers import WorkerPool, partition
 
 logger = logging.getLogger(__name__)
 
@@ -34,10 +43,81 @@ class ClientException(Exception):
     pass
 
 
+# ambulance updates that can be coalesced: position only
+COALESCE_FIELDS = frozenset(('location', 'orientation', 'timestamp'))
+
+
 # SubscribeClient
 
 class SubscribeClient(BaseClient):
 
+    # topic routes: (pattern, handler, shard key)
+    routes = (
+        ('message',
+         'on_message', None),
+        ('user/{username}/client/{client_id}/ambulance/{ambulance_id:int}/data',
+         'on_ambulance', 'ambulance/{ambulance_id}'),
+        ('user/{username}/client/{client_id}/ambulance/{ambulance_id:int}/telemetry',
+         'on_ambulance_telemetry', 'ambulance/{ambulance_id}'),
+        ('user/{username}/client/{client_id}/hospital/{hospital_id:int}/data',
+         'on_hospital', 'hospital/{hospital_id}'),
+        ('user/{username}/client/{client_id}/equipment/{equipmentholder_id:int}/item/{equipment_id:int}/data',
+         'on_equipment_item', 'equipment/{equipmentholder_id}'),
+        ('user/{username}/client/{client_id}/status',
+         'on_client_status', 'client/{client_id}'),
+        ('user/{username}/client/{client_id}/ambulance/{ambulance_id:int}/call/{call_id:int}/status',
+         'on_call_ambulance', 'ambulance/{ambulance_id}'),
+        ('user/{username}/client/{client_id}/ambulance/{ambulance_id:int}/call/{call_id:int}/waypoint/{waypoint_id:int}/data',
+         'on_call_ambulance_waypoint', 'ambulance/{ambulance_id}'),
+    )
+
+    def __init__(self, broker, **kwargs):
+
+        # handle only the objects in one of many partitions?
+        self.partitions = kwargs.pop('partitions', 1)
+        self.partition = kwargs.pop('partition', 0)
+        if not 0 <= self.partition < self.partitions:
+            raise ValueError('Partition must be between 0 and {}'.format(self.partitions - 1))
+        self.skipped = 0
+
+        # run handlers on a worker pool?
+        workers = kwargs.pop('workers', 0)
+        queue_size = kwargs.pop('queue_size', 100)
+        if workers > 0:
+            self.pool = WorkerPool(workers, queue_size=queue_size)
+        else:
+            self.pool = None
+
+        # coalesce position updates within a time window?
+        coalesce = kwargs.pop('coalesce', 0)
+        if coalesce > 0:
+            self.coalescer = Coalescer(coalesce, self.expire_ambulance)
+        else:
+            self.coalescer = None
+
+        # limit error messages sent back to clients
+        self.error_limiter = ErrorLimiter(window=kwargs.pop('error_window', ERROR_WINDOW),
+                                          rate=kwargs.pop('error_rate', ERROR_RATE),
+                                          report=self.send_error_summary)
+
+        # fast path for ambulance updates
+        self.telemetry = AmbulanceTelemetry()
+
+        # set by AsyncioEngine when running on asyncio
+        self.engine = None
+
+        # collect handler metrics?
+        self.metrics = kwargs.pop('metrics', None)
+
+        # handlers run one at a time unless on the worker pool
+        self.dispatch_lock = threading.RLock()
+
+        # router is compiled on connect
+        self.router = None
+
+        # call super
+        super().__init__(broker, **kwargs)
+
     # The callback for when the client receives a CONNACK
     # response from the server.
     def on_connect(self, client, userdata, flags, rc):
@@ -46,57 +126,104 @@ class SubscribeClient(BaseClient):
         if not super().on_connect(client, userdata, flags, rc):
             return False
 
+        # compile router
+        if self.router is None:
+            self.router = TopicRouter((pattern, getattr(self, handler), key)
+                                      for (pattern, handler, key) in self.routes)
+
+        # all messages go through the router
+        self.client.on_message = self.route
+
         # Subscribing in on_connect() means that if we lose the
         # connection and reconnect then subscriptions will be renewed.
-        # client.subscribe('#', 2)
-
-        # message handler
-        self.client.message_callback_add('message',
-                                         self.on_message)
-
-        # ambulance handler
-        self.client.message_callback_add('user/+/client/+/ambulance/+/data',
-                                         self.on_ambulance)
-
-        # # client ambulance status handler
-        # self.client.message_callback_add('user/+/client/+/ambulance/+/status',
-        #                                  self.on_client_ambulance_status)
-
-        # hospital handler
-        self.client.message_callback_add('user/+/client/+/hospital/+/data',
-                                         self.on_hospital)
-
-        # hospital equipment handler
-        self.client.message_callback_add('user/+/client/+/equipment/+/item/+/data',
-                                         self.on_equipment_item)
-
-        # client status handler
-        self.client.message_callback_add('user/+/client/+/status',
-                                         self.on_client_status)
-
-        # ambulance call handler
-        self.client.message_callback_add('user/+/client/+/ambulance/+/call/+/status',
-                                         self.on_call_ambulance)
-
-        # ambulance call waypoint handler
-        self.client.message_callback_add('user/+/client/+/ambulance/+/call/+/waypoint/+/data',
-                                         self.on_call_ambulance_waypoint)
-
-        # subscribe
-        self.subscribe('message', 2)
-        self.subscribe('user/+/client/+/ambulance/+/data', 2)
-        # self.subscribe('user/+/client/+/ambulance/+/status', 2)
-        self.subscribe('user/+/client/+/hospital/+/data', 2)
-        self.subscribe('user/+/client/+/equipment/+/item/+/data', 2)
-        self.subscribe('user/+/client/+/status', 2)
-        self.subscribe('user/+/client/+/ambulance/+/call/+/status', 2)
-        self.subscribe('user/+/client/+/ambulance/+/call/+/waypoint/+/data', 2)
+        for topic in self.router.subscriptions():
+            self.subscribe(topic, 2)
 
         if self.verbosity > 0:
-            self.stdout.write(self.style.SUCCESS(">> Listening to MQTT messages..."))
+            if self.partitions > 1:
+                self.stdout.write(self.style.SUCCESS(">> Listening to MQTT messages in partition {} of {}..."
+                                                     .format(self.partition, self.partitions)))
+            else:
+                self.stdout.write(self.style.SUCCESS(">> Listening to MQTT messages..."))
 
         return True
 
+    def route(self, clnt, userdata, msg):
+
+        match = self.router.match(msg.topic)
+        if match is None:
+            logger.warning("mqtt.SubscribeClient: no route for topic '{}'".format(msg.topic))
+            return
+
+        (route, params) = match
+        key = route.key.format(**params) if route.key is not None else None
+
+        # belongs to another partition?
+        # messages without a key are handled by all partitions
+        if self.partitions > 1 and key is not None and partition(key, self.partitions) != self.partition:
+            self.skipped += 1
+            return
+
+        self.dispatch(key, route.handler, clnt, userdata, msg, **params)
+
+    def dispatch(self, key, fn, *args, **kwargs):
+
+        # measure handler?
+        if self.metrics is not None:
+            args = (fn.__name__, fn) + args
+            fn = self.metrics.measure
+
+        # run on the asyncio engine?
+        if self.engine is not None:
+            self.engine.submit(key, fn, *args, **kwargs)
+
+        # run on the worker pool?
+        # work for the same object always goes to the same worker
+        elif self.pool is not None and key is not None:
+            self.pool.submit(key, fn, *args, **kwargs)
+        else:
+            with self.dispatch_lock:
+                fn(*args, **kwargs)
+
+    def disconnect(self):
+
+        # flush pending position updates
+        if self.coalescer is not None:
+            self.coalescer.stop()
+
+            if self.verbosity > 0:
+                info = self.coalescer.info()
+                self.stdout.write(self.style.SUCCESS((">> Coalesced {} out of {} position updates " +
+                                                      "into {} writes").format(info.coalesced,
+                                                                               info.received,
+                                                                               info.flushed)))
+
+        # report errors still suppressed
+        self.error_limiter.stop()
+
+        if self.verbosity > 0:
+            info = self.error_limiter.info()
+            self.stdout.write(self.style.SUCCESS((">> Sent {} error messages, suppressed {} repeated " +
+                                                  "and {} over the rate limit").format(info.sent,
+                                                                                       info.duplicates,
+                                                                                       info.rate_limited)))
+
+            info = payload_cache_info()
+            self.stdout.write(self.style.SUCCESS(">> Payload cache: {} hits, {} misses, {} invalidations".format(
+                info.hits, info.misses, info.invalidations)))
+
+            info = permission_cache_info()
+            self.stdout.write(self.style.SUCCESS(">> Permission cache: {} hits ({} shared), {} misses".format(
+                info.hits, info.shared_hits, info.misses)))
+
+        # finish pending work before disconnecting
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+
+        # call super
+        super().disconnect()
+
     def send_error_message(self, username, client, topic, payload, error, qos=2):
 
         logger.debug("send_error_message: {}, '{}:{}': '{}'".format(username,
@@ -104,19 +231,36 @@ class SubscribeClient(BaseClient):
                                                                     payload,
                                                                     error))
 
+        # collapse repeated errors and cap errors per client
+        repeated = self.error_limiter.check(getattr(client, 'client_id', None), topic, str(error),
+                                            context=username)
+        if repeated is None:
+            logger.debug('send_error_message: SUPPRESSED')
+            return
+
         if self.verbosity > 0:
             self.stdout.write(self.style.ERROR("*> Error {}, '{}:{}': {}".format(username,
                                                                                  topic,
                                                                                  payload,
                                                                                  error)))
 
+        # binary payloads are sent back in hex
+        if isinstance(payload, bytes):
+            try:
+                payload = payload.decode()
+            except UnicodeDecodeError:
+                payload = payload.hex()
+
         try:
 
-            message = JSONRenderer().render({
+            message = {
                 'topic': topic,
                 'payload': payload,
                 'error': str(error)
-            })
+            }
+            if repeated:
+                message['repeated'] = repeated
+            message = JSONRenderer().render(message)
             self.publish('user/{}/client/{}/error'.format(username, client.client_id), message, qos=qos)
 
         except Exception as e:
@@ -130,7 +274,23 @@ class SubscribeClient(BaseClient):
                                                      error,
                                                      e))
 
-    def parse_topic(self, msg, expect, json=True, new_client=False):
+    def send_error_summary(self, client_id, username, topic, error, repeated, qos=2):
+
+        # client is unknown?
+        if client_id is None or username is None:
+            return
+
+        logger.debug("send_error_summary: {}, '{}': '{}' repeated {} times".format(username, topic,
+                                                                                  error, repeated))
+
+        message = JSONRenderer().render({
+            'topic': topic,
+            'error': error,
+            'repeated': repeated
+        })
+        self.publish('user/{}/client/{}/error'.format(username, client_id), message, qos=qos)
+
+    def parse_message(self, msg, username, client_id, json=True, new_client=False, decode=None):
 
         # empty payload ?
         if not msg.payload:
@@ -139,26 +299,19 @@ class SubscribeClient(BaseClient):
         if self.verbosity > 0:
             self.stdout.write(self.style.SUCCESS(" > Parsing message '{}:{}'".format(msg.topic,
                                                                                      msg.payload)))
-        # empty topic?
-        if not msg.topic:
-            raise ParseException('Empty topic')
 
-        # parse topic
-        values = msg.topic.split('/')
+        try:
 
-        # not enough topics?
-        min_size = expect * 2 - 1
-        if len(values) < expect * 2 - 1:
-            raise ParseException('Topic with less than size {}'.format(min_size))
+            if new_client:
 
-        username = '__unknown__'
-        try:
+                # client will be modified, bypass identity cache
+                user = User.objects.get(username=username)
+                client = Client.objects.get(client_id=client_id)
 
-            # retrieve user
-            username = values[1]
+            else:
 
-            # print(User.objects.all())
-            user = User.objects.get(username=values[1])
+                # retrieve user and client
+                user, client = get_identity(username, client_id)
 
         except User.DoesNotExist as e:
 
@@ -172,11 +325,6 @@ class SubscribeClient(BaseClient):
                                                      e))
             raise ParseException('User does not exist')
 
-        try:
-
-            # retrieve client
-            client = Client.objects.get(client_id=values[3])
-
         except Client.DoesNotExist as e:
 
             if not new_client:
@@ -194,15 +342,29 @@ class SubscribeClient(BaseClient):
             else:
 
                 # create new client
-                client = Client(client_id=values[3], user=user)
+                client = Client(client_id=client_id, user=user)
+
+        if decode is not None:
+
+            # decode binary data
+            try:
 
-        if json:
+                data = decode(msg.payload)
+
+            except ValueError as e:
+
+                # send error message to user
+                self.send_error_message(user, client, msg.topic, msg.payload,
+                                        "Telemetry encoded incorrectly: {}".format(e))
+                raise ParseException('Telemetry encoded incorrectly: {}'.format(e))
+
+        elif json:
 
             # parse data
             try:
 
                 # Parse data into json dict
-                data = JSONParser().parse(BytesIO(msg.payload))
+                data = parse_json(msg.payload)
 
             except Exception as e:
 
@@ -215,41 +377,18 @@ class SubscribeClient(BaseClient):
 
             data = msg.payload.decode()
 
-        if expect == 3 and len(values) == 5:
-
-            return user, client, data
-
-        elif expect == 4 and len(values) == 7:
-
-            return user, client, data, values[5]
-
-        elif expect == 5 and len(values) == 9:
-
-            return user, client, data, values[5], values[7]
-
-        elif expect == 6 and len(values) == 11:
-
-            return user, client, data, values[5], values[7], values[9]
-
-        else:
-
-            # send error message to user
-            # this should never happen because no subscriptions will match
-            # topics with different sizes
-            self.send_error_message(user, client, msg.topic, msg.payload,
-                                    "Invalid topic")
-            raise ParseException('Invalid topic {}'.format(msg.topic))
+        return user, client, data
 
     # Update ambulance
 
-    def on_ambulance(self, clnt, userdata, msg):
+    def on_ambulance(self, clnt, userdata, msg, username, client_id, ambulance_id, decode=None):
 
         try:
 
             logger.debug("on_ambulance: msg = '{}'".format(msg.topic, msg.payload))
 
             # parse topic
-            user, client, data, ambulance_id = self.parse_topic(msg, 4)
+            user, client, data = self.parse_message(msg, username, client_id, decode=decode)
 
         except Exception as e:
 
@@ -281,68 +420,140 @@ class SubscribeClient(BaseClient):
             logger.debug("on_ambulance: ambulance = '{}', data = '{}'".format(ambulance, data))
 
             # updates must match client
-            if client.ambulance != ambulance:
+            if client.ambulance_id != ambulance.id:
+
+                # cached client may be stale, check again
+                user, client = get_identity(username, client_id, refresh=True)
+
+            if client.ambulance_id != ambulance.id:
                 # send error message to user
                 self.send_error_message(user, client, msg.topic, msg.payload,
                                         "Client '{}' is not currently authorized to update ambulance '{}'"
                                         .format(client.client_id, ambulance.identifier))
                 return
 
-            is_valid = False
-            if isinstance(data, (list, tuple)):
+            if self.coalescer is not None:
 
-                # update ambulances in bulk
-                serializer = AmbulanceUpdateSerializer(data=data,
-                                                       many=True,
-                                                       partial=True)
+                # hold position updates, only the latest in the window is saved
+                if isinstance(data, dict) and 'location' in data and COALESCE_FIELDS.issuperset(data):
+                    self.coalescer.add(ambulance.id, (user, client, msg, data))
+                    return
 
-                if serializer.is_valid():
+                # anything else saves the pending position update first
+                if self.flush_ambulance(ambulance.id):
+                    ambulance = Ambulance.objects.get(id=ambulance.id)
 
-                    # save to database
-                    serializer.save(ambulance=ambulance, updated_by=user)
-                    is_valid = True
+            self.update_ambulance(user, client, msg, ambulance, data)
 
-            else:
+        except Exception as e:
 
-                # update ambulance
-                serializer = AmbulanceSerializer(ambulance,
-                                                 data=data,
-                                                 partial=True)
+            logger.debug('on_ambulance: EXCEPTION')
+
+            # send error message to user
+            self.send_error_message(user, client, msg.topic, msg.payload,
+                                    "Exception '{}'".format(e))
 
-                if serializer.is_valid():
+        logger.debug('on_ambulance: DONE')
 
-                    # save to database
-                    serializer.save(updated_by=user)
-                    is_valid = True
+    def on_ambulance_telemetry(self, clnt, userdata, msg, username, client_id, ambulance_id):
 
-            if not is_valid:
+        # binary telemetry, decoded straight into validated data
+        self.on_ambulance(clnt, userdata, msg, username, client_id, ambulance_id,
+                          decode=self.telemetry.decode)
 
-                logger.debug('on_ambulance: INVALID serializer')
+    def update_ambulance(self, user, client, msg, ambulance, data, coalesced=0):
 
-                # send error message to user
-                self.send_error_message(user, client, msg.topic, msg.payload,
-                                        serializer.errors)
+        # recorded in the AmbulanceUpdate written by this update
+        ambulance.coalesced = coalesced
 
-        except Exception as e:
+        is_valid = False
+        if isinstance(data, (list, tuple)):
 
-            logger.debug('on_ambulance: EXCEPTION')
+            # update ambulances in bulk
+            serializer = AmbulanceUpdateSerializer(data=data,
+                                                   many=True,
+                                                   partial=True)
+
+            if serializer.is_valid():
+
+                # save to database
+                serializer.save(ambulance=ambulance, updated_by=user)
+                is_valid = True
+
+        elif isinstance(data, DecodedTelemetry):
+
+            # binary telemetry is already validated
+            self.telemetry.save(ambulance, data, updated_by=user)
+            return
+
+        else:
+
+            # common updates skip the serializer
+            validated_data = self.telemetry.validate(data)
+            if validated_data is not None:
+                self.telemetry.save(ambulance, validated_data, updated_by=user)
+                return
+
+            # update ambulance
+            serializer = AmbulanceSerializer(ambulance,
+                                             data=data,
+                                             partial=True)
+
+            if serializer.is_valid():
+
+                # save to database
+                serializer.save(updated_by=user)
+                is_valid = True
+
+        if not is_valid:
+
+            logger.debug('on_ambulance: INVALID serializer')
+
+            # send error message to user
+            self.send_error_message(user, client, msg.topic, msg.payload,
+                                    serializer.errors)
+
+    def flush_ambulance(self, ambulance_id):
+        """
+        Saves the position update pending for ambulance_id, if any.
+        Must run where updates to this ambulance are serialized.
+        """
+
+        pending = self.coalescer.pop(ambulance_id)
+        if pending is None:
+            return False
+
+        ((user, client, msg, data), coalesced) = pending
+        logger.debug('flush_ambulance: ambulance = {}, coalesced = {}'.format(ambulance_id, coalesced))
+
+        try:
+
+            ambulance = Ambulance.objects.get(id=ambulance_id)
+            self.update_ambulance(user, client, msg, ambulance, data, coalesced=coalesced)
+
+        except Exception as e:
 
             # send error message to user
             self.send_error_message(user, client, msg.topic, msg.payload,
                                     "Exception '{}'".format(e))
 
-        logger.debug('on_ambulance: DONE')
+        return True
+
+    def expire_ambulance(self, ambulance_id):
+
+        # flush in line with the other updates to this ambulance
+        self.dispatch('ambulance/{}'.format(ambulance_id), self.flush_ambulance, ambulance_id)
 
     # Update hospital
 
-    def on_hospital(self, clnt, userdata, msg):
+    def on_hospital(self, clnt, userdata, msg, username, client_id, hospital_id):
 
         try:
 
             logger.debug("on_hospital: msg = '{}:{}'".format(msg.topic, msg.payload))
 
             # parse topic
-            user, client, data, hospital_id = self.parse_topic(msg, 4)
+            user, client, data = self.parse_message(msg, username, client_id)
 
         except Exception as e:
 
@@ -373,7 +584,12 @@ class SubscribeClient(BaseClient):
             logger.debug('on_hospital: hospital = {}'.format(hospital))
 
             # updates must match client
-            if client.hospital != hospital:
+            if client.hospital_id != hospital.id:
+
+                # cached client may be stale, check again
+                user, client = get_identity(username, client_id, refresh=True)
+
+            if client.hospital_id != hospital.id:
                 # send error message to user
                 self.send_error_message(user, client, msg.topic, msg.payload,
                                         "Client '{}' is not currently authorized to update hospital '{}'"
@@ -411,14 +627,14 @@ class SubscribeClient(BaseClient):
 
     # Update equipment
 
-    def on_equipment_item(self, clnt, userdata, msg):
+    def on_equipment_item(self, clnt, userdata, msg, username, client_id, equipmentholder_id, equipment_id):
 
         try:
 
             logger.debug("on_equipment_item: msg = '{}:{}'".format(msg.topic, msg.payload))
 
             # parse topic
-            user, client, data, equipmentholder_id, equipment_id = self.parse_topic(msg, 5)
+            user, client, data = self.parse_message(msg, username, client_id)
 
         except Exception as e:
 
@@ -481,14 +697,14 @@ class SubscribeClient(BaseClient):
 
     # update client information
 
-    def on_client_status(self, clnt, userdata, msg):
+    def on_client_status(self, clnt, userdata, msg, username, client_id):
 
         try:
 
             logger.debug("on_client_status: msg = '{}:{}'".format(msg.topic, msg.payload))
 
             # parse topic
-            user, client, data = self.parse_topic(msg, 3, json=False, new_client=True)
+            user, client, data = self.parse_message(msg, username, client_id, json=False, new_client=True)
 
         except Exception as e:
 
@@ -535,14 +751,14 @@ class SubscribeClient(BaseClient):
 
     # handle calls
 
-    def on_call_ambulance(self, clnt, userdata, msg):
+    def on_call_ambulance(self, clnt, userdata, msg, username, client_id, ambulance_id, call_id):
 
         try:
 
             logger.debug("on_call_ambulance: msg = '{}:{}'".format(msg.topic, msg.payload))
 
             # parse topic
-            user, client, status, ambulance_id, call_id = self.parse_topic(msg, 5, json=False)
+            user, client, status = self.parse_message(msg, username, client_id, json=False)
 
         except Exception as e:
 
@@ -634,15 +850,14 @@ class SubscribeClient(BaseClient):
 
     # handle calls waypoints
 
-    def on_call_ambulance_waypoint(self, clnt, userdata, msg):
+    def on_call_ambulance_waypoint(self, clnt, userdata, msg, username, client_id, ambulance_id, call_id, waypoint_id):
 
         try:
 
             logger.debug("on_call_ambulance_waypoint: msg = '{}:{}'".format(msg.topic, msg.payload))
 
             # parse topic
-            user, client, data, ambulance_id, call_id, waypoint_id = self.parse_topic(msg, 6)
-            waypoint_id = int(waypoint_id)
+            user, client, data = self.parse_message(msg, username, client_id)
 
         except Exception as e:
 
@@ -757,7 +972,7 @@ class SubscribeClient(BaseClient):
                                                                                          msg.payload)))
 
             # Parse message
-            data = msg.payload.decode()
+            data = JSONParser().parse(BytesIO(msg.payload))
 
         except Exception as e:
 
@@ -766,14 +981,30 @@ class SubscribeClient(BaseClient):
 
         try:
 
-            if data == '"cache_clear"':
+            if data == 'cache_clear':
 
-                # call cache clear
-                cache_clear()
+                # call cache clear, versions in the shared cache were bumped by the sender
+                # unless the cache is private to each process
+                cache_clear(shared=permission_cache.local)
+                identity_cache_clear()
 
                 if self.verbosity > 0:
                     self.stdout.write(self.style.SUCCESS(" > Clearing cache"))
 
+            elif isinstance(data, dict) and 'cache_clear' in data:
+
+                # targeted cache clear
+                targets = data['cache_clear']
+                if 'client' in targets:
+                    identity_cache_evict(targets['client'])
+                for user_id in targets.get('users', []):
+                    # versions in the shared cache were bumped by the sender
+                    # unless the cache is private to each process
+                    permission_cache_evict(user_id, shared=permission_cache.local)
+
+                if self.verbosity > 0:
+                    self.stdout.write(self.style.SUCCESS(" > Clearing cache for '{}'".format(targets)))
+
             else:
 
                 logger.debug("on_message: unknown message '{}'".format(data))
@@ -0,0 +1,245 @@
+import json
+import logging
+import struct
+from datetime import datetime, timedelta, timezone
+
+from django.contrib.gis.geos import Point
+from rest_framework.exceptions import PermissionDenied, ValidationError
+
+from ambulance.serializers import AmbulanceSerializer
+from login.permissions import get_permissions
+
+logger = logging.getLogger(__name__)
+
+
+def _strict_constant(value):
+    # same as rest_framework.utils.json.strict_constant
+    raise ValueError('Out of range float values are not JSON compliant: ' + repr(value))
+
+
+def parse_json(payload):
+    """
+    Parses a JSON payload like rest_framework.parsers.JSONParser with STRICT_JSON.
+    """
+    return json.loads(payload.decode('utf-8'), parse_constant=_strict_constant)
+
+
+# Binary telemetry
+#
+# version 1, little endian:
+#
+#   version   B  1
+#   fields    B  bit mask of the fields that follow, in this order:
+#   location  ii latitude and longitude in 1e-7 degrees (1)
+#   orientation H  degrees in 1e-2 degrees, [0, 36000) (2)
+#   status    B  index in TELEMETRY_STATUS (4)
+#   timestamp q  milliseconds since the epoch (8)
+
+TELEMETRY_VERSION = 1
+
+TELEMETRY_LOCATION = 1
+TELEMETRY_ORIENTATION = 2
+TELEMETRY_STATUS_FIELD = 4
+TELEMETRY_TIMESTAMP = 8
+
+# wire codes of AmbulanceStatus; append only
+TELEMETRY_STATUS = ('UK', 'AV', 'OS', 'PB', 'AP', 'HB', 'AH', 'BB', 'AB', 'WB', 'AW')
+TELEMETRY_STATUS_CODES = {name: code for (code, name) in enumerate(TELEMETRY_STATUS)}
+
+_header = struct.Struct('<BB')
+_fields = (
+    (TELEMETRY_LOCATION, 'location', struct.Struct('<ii')),
+    (TELEMETRY_ORIENTATION, 'orientation', struct.Struct('<H')),
+    (TELEMETRY_STATUS_FIELD, 'status', struct.Struct('<B')),
+    (TELEMETRY_TIMESTAMP, 'timestamp', struct.Struct('<q')),
+)
+_epoch = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+class DecodedTelemetry(dict):
+    """
+    Validated data decoded from binary telemetry, ready for AmbulanceTelemetry.save.
+    """
+    pass
+
+
+def encode_telemetry(location=None, orientation=None, status=None, timestamp=None):
+    """
+    Encodes the given values, skipping the ones that are None. location is a
+    Point, status an AmbulanceStatus name and timestamp an aware datetime.
+    """
+
+    flags = 0
+    values = []
+    if location is not None:
+        flags |= TELEMETRY_LOCATION
+        values.append(_fields[0][2].pack(round(location.y * 1e7), round(location.x * 1e7)))
+    if orientation is not None:
+        flags |= TELEMETRY_ORIENTATION
+        values.append(_fields[1][2].pack(round(orientation * 100) % 36000))
+    if status is not None:
+        flags |= TELEMETRY_STATUS_FIELD
+        values.append(_fields[2][2].pack(TELEMETRY_STATUS_CODES[status]))
+    if timestamp is not None:
+        flags |= TELEMETRY_TIMESTAMP
+        values.append(_fields[3][2].pack((timestamp - _epoch) // timedelta(milliseconds=1)))
+
+    return _header.pack(TELEMETRY_VERSION, flags) + b''.join(values)
+
+
+def decode_telemetry(payload, srid=4326):
+    """
+    Decodes binary telemetry into DecodedTelemetry. Raises ValueError if the
+    payload is malformed or of another version.
+    """
+
+    try:
+        (version, flags) = _header.unpack_from(payload)
+    except struct.error:
+        raise ValueError('Telemetry too short')
+
+    if version != TELEMETRY_VERSION:
+        raise ValueError("Unknown telemetry version '{}'".format(version))
+    if not flags or flags & ~(TELEMETRY_LOCATION | TELEMETRY_ORIENTATION |
+                              TELEMETRY_STATUS_FIELD | TELEMETRY_TIMESTAMP):
+        raise ValueError("Invalid telemetry fields '{}'".format(flags))
+
+    data = DecodedTelemetry()
+    offset = _header.size
+    try:
+        for (flag, name, field) in _fields:
+            if flags & flag:
+                data[name] = field.unpack_from(payload, offset)
+                offset += field.size
+    except struct.error:
+        raise ValueError('Telemetry too short')
+
+    if offset != len(payload):
+        raise ValueError('Telemetry too long')
+
+    if 'location' in data:
+        (latitude, longitude) = data['location']
+        data['location'] = Point(longitude / 1e7, latitude / 1e7, srid=srid)
+    if 'orientation' in data:
+        (orientation,) = data['orientation']
+        if orientation >= 36000:
+            raise ValueError("Invalid orientation '{}'".format(orientation))
+        data['orientation'] = orientation / 100
+    if 'status' in data:
+        (code,) = data['status']
+        if code >= len(TELEMETRY_STATUS):
+            raise ValueError("Invalid status '{}'".format(code))
+        data['status'] = TELEMETRY_STATUS[code]
+    if 'timestamp' in data:
+        (milliseconds,) = data['timestamp']
+        try:
+            data['timestamp'] = _epoch + timedelta(milliseconds=milliseconds)
+        except OverflowError:
+            raise ValueError("Invalid timestamp '{}'".format(milliseconds))
+
+    # timestamp must be defined together with either status or location
+    if 'timestamp' in data and not ('location' in data or 'status' in data):
+        raise ValueError('timestamp can only be set when either location or status are modified')
+
+    return data
+
+
+# AmbulanceTelemetry
+
+class AmbulanceTelemetry:
+    """
+    Fast path for the common shape of ambulance updates.
+
+    validate() returns the same validated data as AmbulanceSerializer for
+    payloads made only of well-formed location, orientation, status, timestamp
+    and comment values, and None for anything else, in which case the payload
+    must go through AmbulanceSerializer, which also produces the error messages.
+    The serializer fields are built once and reused for every message.
+    """
+
+    field_names = frozenset(('location', 'orientation', 'status', 'timestamp', 'comment'))
+
+    def __init__(self):
+
+        fields = AmbulanceSerializer().fields
+        self.location_srid = getattr(fields['location'], 'srid', None)
+        self.status_choices = fields['status'].choice_strings_to_values
+        self.comment_max_length = fields['comment'].max_length
+        self.timestamp_field = fields['timestamp']
+
+        self.validators = {
+            'location': self.validate_location,
+            'orientation': self.validate_orientation,
+            'status': self.validate_status,
+            'timestamp': self.validate_timestamp,
+            'comment': self.validate_comment,
+        }
+
+    def validate_location(self, value):
+        if type(value) is dict and len(value) == 2:
+            latitude, longitude = value.get('latitude'), value.get('longitude')
+            if type(latitude) in (int, float) and type(longitude) in (int, float):
+                return Point(float(longitude), float(latitude), srid=self.location_srid)
+        raise ValueError
+
+    def validate_orientation(self, value):
+        if type(value) in (int, float):
+            return float(value)
+        raise ValueError
+
+    def validate_status(self, value):
+        if type(value) is str:
+            return self.status_choices[value]
+        raise ValueError
+
+    def validate_timestamp(self, value):
+        if type(value) is str:
+            return self.timestamp_field.run_validation(value)
+        raise ValueError
+
+    def validate_comment(self, value):
+        if type(value) is str:
+            value = value.strip()
+            if len(value) <= self.comment_max_length and '\x00' not in value:
+                return value
+        raise ValueError
+
+    def validate(self, data):
+        """
+        Returns the validated data or None if data must go through AmbulanceSerializer.
+        """
+
+        if type(data) is not dict or not data or not self.field_names.issuperset(data):
+            return None
+
+        # timestamp must be defined together with either comment, status or location
+        if 'timestamp' in data and not ('comment' in data or 'location' in data or 'status' in data):
+            return None
+
+        try:
+            return {key: self.validators[key](value) for (key, value) in data.items()}
+        except (ValueError, KeyError, OverflowError, ValidationError):
+            return None
+
+    def decode(self, payload):
+        """
+        Returns the validated data in binary telemetry, see decode_telemetry.
+        """
+        return decode_telemetry(payload, srid=self.location_srid)
+
+    def save(self, ambulance, validated_data, updated_by):
+        """
+        Saves validated data to ambulance like AmbulanceSerializer.update.
+        """
+
+        # check credentials
+        if not updated_by.is_superuser:
+            if not get_permissions(updated_by).check_can_write(ambulance=ambulance.id):
+                raise PermissionDenied()
+
+        for attr, value in validated_data.items():
+            setattr(ambulance, attr, value)
+        ambulance.updated_by = updated_by
+        ambulance.save()
+
+        return ambulance
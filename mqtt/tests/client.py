@@ -2,6 +2,7 @@ import logging
 import os
 import re
 import subprocess
+import threading
 import time
 from pathlib import Path
 
@@ -15,7 +16,8 @@ from hospital.models import Hospital
 from equipment.models import EquipmentType, Equipment, EquipmentItem
 from login.models import GroupAmbulancePermission, GroupHospitalPermission, \
     UserAmbulancePermission, UserHospitalPermission
-from mqtt.client import BaseClient
+from mqtt.aio import AsyncioEngine
+from mqtt.client import BaseClient, MQTTException
 from mqtt.subscribe import SubscribeClient
 
 logger = logging.getLogger(__name__)
@@ -537,6 +539,50 @@ class MQTTTestSubscribeClient(MQTTTestClientPublishSubscribeMixin,
         super().__init__(*args, **kwargs)
 
 
+class MQTTTestAsyncioSubscribeClient(MQTTTestSubscribeClient):
+    """
+    MQTTTestSubscribeClient driven by an AsyncioEngine running on its own thread.
+
+    loop() only gives the engine time to read, and done() also waits for the
+    handlers in flight on the engine executor.
+    """
+
+    def __init__(self, *args, **kwargs):
+
+        engine = kwargs.pop('engine', {})
+
+        # call supper
+        super().__init__(*args, **kwargs)
+
+        # start engine
+        self.asyncio_engine = AsyncioEngine(self, **engine)
+        self.engine_thread = threading.Thread(target=self.asyncio_engine.run, daemon=True)
+        self.engine_thread.start()
+
+        # wait for the engine to take over the socket
+        k = 0
+        while self.asyncio_engine.executor is None and k < 100:
+            k += 1
+            time.sleep(0.01)
+
+    def loop(self, *args, **kwargs):
+        # socket is read by the engine
+        time.sleep(0.1)
+
+    def done(self):
+        executor = self.asyncio_engine.executor
+        return super().done() and executor is not None and len(executor) == 0
+
+    def wait(self, max_tries=10):
+
+        # engine disconnects on shutdown
+        self.asyncio_engine.stop()
+        self.engine_thread.join(timeout=max_tries)
+
+        if self.engine_thread.is_alive() or self.connected:
+            raise MQTTException('Could not disconnect')
+
+
 # MQTTTestClient
 class MQTTTestClient(MQTTTestClientPublishSubscribeMixin,
                      BaseClient):
@@ -0,0 +1,188 @@
+import asyncio
+import socket
+import threading
+import time
+
+from django.conf import settings
+from django.test import SimpleTestCase
+
+from mqtt.aio import KeyedExecutor
+from mqtt.benchmarks import make_router
+from .client import MQTTTestCase, MQTTTestClient, MQTTTestAsyncioSubscribeClient, TestMQTT
+
+
+class TestKeyedExecutor(SimpleTestCase):
+
+    def run_loop(self, coroutine):
+        loop = asyncio.new_event_loop()
+        try:
+            return loop.run_until_complete(coroutine(loop))
+        finally:
+            loop.close()
+
+    def test_ordering(self):
+
+        lock = threading.Lock()
+        processed = {}
+
+        def handler(key, seq):
+            # make later calls finish faster to expose reordering
+            time.sleep(0.001 * ((10 - seq) % 3))
+            with lock:
+                processed.setdefault(key, []).append(seq)
+
+        async def main(loop):
+            executor = KeyedExecutor(loop, workers=4)
+            for seq in range(10):
+                for key in range(10):
+                    executor.submit(key, handler, key, seq)
+            await executor.shutdown()
+            self.assertEqual(len(executor), 0)
+            self.assertEqual(executor.tails, {})
+
+        self.run_loop(main)
+
+        # each key is processed in order
+        self.assertEqual(len(processed), 10)
+        for key, seqs in processed.items():
+            self.assertEqual(seqs, list(range(10)))
+
+    def test_backpressure(self):
+
+        events = []
+        release = threading.Event()
+
+        async def main(loop):
+            executor = KeyedExecutor(loop, workers=2, max_pending=4,
+                                     pause=lambda: events.append('pause'),
+                                     resume=lambda: events.append('resume'))
+            for key in range(4):
+                executor.submit(key, release.wait)
+            self.assertEqual(events, ['pause'])
+
+            release.set()
+            await executor.shutdown()
+
+        self.run_loop(main)
+        self.assertEqual(events, ['pause', 'resume'])
+
+    def test_exception(self):
+
+        processed = []
+
+        def fail():
+            raise Exception('handler failed')
+
+        async def main(loop):
+            executor = KeyedExecutor(loop, workers=1)
+            executor.submit('a', fail)
+            executor.submit('a', processed.append, 1)
+            await executor.shutdown()
+
+        with self.assertLogs('mqtt.aio', level='ERROR'):
+            self.run_loop(main)
+
+        # next call with the same key still runs
+        self.assertEqual(processed, [1])
+
+    def test_cancel(self):
+
+        processed = []
+        release = threading.Event()
+
+        async def main(loop):
+            executor = KeyedExecutor(loop, workers=1)
+            executor.submit('a', release.wait, 1)
+            for seq in range(5):
+                executor.submit('a', processed.append, seq)
+
+            # calls that have not started are cancelled
+            await executor.shutdown(timeout=0.1)
+            release.set()
+
+        self.run_loop(main)
+        self.assertEqual(processed, [])
+
+
+class TestAsyncioEngine(TestMQTT, MQTTTestCase):
+
+    def wait_until(self, condition, max_tries=100):
+        k = 0
+        while not condition() and k < max_tries:
+            k += 1
+            time.sleep(TestMQTT.DELAY)
+        self.assertTrue(condition())
+
+    def test(self):
+
+        broker = {
+            'HOST': 'localhost',
+            'PORT': 1883,
+            'KEEPALIVE': 60,
+            'CLEAN_SESSION': True
+        }
+        broker.update(settings.MQTT)
+
+        lock = threading.Lock()
+        release = threading.Event()
+        handled = []
+
+        def handler(clnt, userdata, msg, **params):
+            release.wait()
+            with lock:
+                handled.append(msg.payload)
+
+        # subscriber on the asyncio engine with everything going to handler
+        broker['CLIENT_ID'] = 'test_asyncio_engine'
+        subscriber = MQTTTestAsyncioSubscribeClient(broker, debug=True,
+                                                    engine={'workers': 2, 'max_pending': 4})
+        subscriber.router = make_router(handler)
+        engine = subscriber.asyncio_engine
+        self.is_connected(subscriber)
+        self.is_subscribed(subscriber)
+        self.assertTrue(engine.reading)
+
+        broker['CLIENT_ID'] = 'test_asyncio_engine_publisher'
+        publisher = MQTTTestClient(broker, debug=True)
+        self.is_connected(publisher)
+
+        topic = 'user/{}/client/test/ambulance/{}/data'
+        for k in range(10):
+            publisher.publish(topic.format(self.u1.username, k), str(k), qos=1)
+        self.loop(publisher)
+
+        # reading from the socket stops while handlers are blocked
+        self.wait_until(lambda: engine.executor.paused)
+        self.assertFalse(engine.reading)
+        with lock:
+            self.assertEqual(handled, [])
+
+        # and resumes once they drain
+        release.set()
+        self.wait_until(lambda: len(handled) == 10)
+        self.wait_until(lambda: engine.reading)
+        self.assertCountEqual(handled, [str(k).encode() for k in range(10)])
+
+        # reconnects when the connection is lost
+        subscriber.client.socket().shutdown(socket.SHUT_RDWR)
+        self.wait_until(lambda: not subscriber.is_connected())
+        self.wait_until(lambda: subscriber.is_connected())
+        self.is_subscribed(subscriber)
+
+        publisher.publish(topic.format(self.u1.username, 0), 'after', qos=1)
+        self.loop(publisher)
+        self.wait_until(lambda: b'after' in handled)
+
+        # handlers in flight finish on shutdown
+        release.clear()
+        publisher.publish(topic.format(self.u1.username, 1), 'shutdown', qos=1)
+        self.loop(publisher)
+        self.wait_until(lambda: len(engine.executor) == 1)
+        threading.Timer(0.5, release.set).start()
+        subscriber.wait()
+
+        self.assertIn(b'shutdown', handled)
+        self.assertIsNone(subscriber.client.socket())
+        self.assertFalse(subscriber.engine_thread.is_alive())
+
+        publisher.wait()
@@ -0,0 +1,104 @@
+import threading
+import time
+from functools import partial
+
+from django.test import SimpleTestCase
+
+from ambulance.models import Ambulance, AmbulanceStatus, AmbulanceUpdate
+from login.tests.setup_data import TestSetup
+from mqtt.benchmarks import make_message
+from mqtt.broker import LocalBroker, LocalClient
+from mqtt.coalesce import Coalescer
+from mqtt.subscribe import SubscribeClient
+
+
+class TestCoalescer(SimpleTestCase):
+
+    def test_coalesce(self):
+
+        lock = threading.Lock()
+        flushed = []
+        coalescer = None
+
+        def expire(key):
+            pending = coalescer.pop(key)
+            with lock:
+                flushed.append((key, pending))
+
+        coalescer = Coalescer(0.05, expire)
+        for seq in range(10):
+            for key in range(3):
+                coalescer.add(key, seq)
+
+        # nothing is flushed before the window expires
+        self.assertEqual(flushed, [])
+
+        time.sleep(0.2)
+
+        # only the latest value per key is flushed
+        self.assertCountEqual(flushed, [(0, (9, 9)), (1, (9, 9)), (2, (9, 9))])
+
+        info = coalescer.info()
+        self.assertEqual(info.received, 30)
+        self.assertEqual(info.coalesced, 27)
+        self.assertEqual(info.flushed, 3)
+        self.assertEqual(info.pending, 0)
+        self.assertEqual(coalescer.coalesced_by_key, {0: 9, 1: 9, 2: 9})
+
+        coalescer.stop()
+
+    def test_pop_and_stop(self):
+
+        flushed = []
+        coalescer = None
+
+        def expire(key):
+            flushed.append((key, coalescer.pop(key)))
+
+        coalescer = Coalescer(10, expire)
+        coalescer.add(1, 'a')
+        coalescer.add(1, 'b')
+        coalescer.add(2, 'c')
+
+        # popping flushes ahead of the window
+        self.assertEqual(coalescer.pop(1), ('b', 1))
+        self.assertIsNone(coalescer.pop(1))
+
+        # stopping flushes everything still pending
+        coalescer.stop()
+        self.assertEqual(flushed, [(2, ('c', 0))])
+
+
+class TestCoalescedUpdates(TestSetup):
+
+    def test_coalesced(self):
+
+        client = SubscribeClient({'USERNAME': '', 'PASSWORD': '', 'HOST': 'localhost', 'PORT': 1883,
+                                  'KEEPALIVE': 60, 'CLIENT_ID': '', 'CLEAN_SESSION': True},
+                                 client_class=partial(LocalClient, broker=LocalBroker()),
+                                 verbosity=0,
+                                 coalesce=10)
+        topic = 'user/{}/client/test/ambulance/{}/data'.format(self.u1.username, self.a1.id)
+
+        try:
+            for seq in range(4):
+                data = {'location': {'latitude': 32.5 + seq / 100, 'longitude': -117.0}}
+                client.coalescer.add(self.a1.id, (self.u1, None, make_message(topic, b''), data))
+            self.assertTrue(client.flush_ambulance(self.a1.id))
+        finally:
+            client.coalescer.stop()
+
+        # the number of updates replaced is saved with the update
+        update = AmbulanceUpdate.objects.filter(ambulance=self.a1).latest('id')
+        self.assertEqual(update.coalesced, 3)
+        self.assertAlmostEqual(update.location.y, 32.53)
+
+        # and not with the next one
+        ambulance = Ambulance.objects.get(id=self.a1.id)
+        ambulance.coalesced = 2
+        ambulance.status = AmbulanceStatus.AH.name
+        ambulance.save()
+        self.assertEqual(AmbulanceUpdate.objects.filter(ambulance=self.a1).latest('id').coalesced, 2)
+        ambulance.status = AmbulanceStatus.AV.name
+        ambulance.save()
+        self.assertEqual(AmbulanceUpdate.objects.filter(ambulance=self.a1).latest('id').coalesced, 0)
@@ -0,0 +1,140 @@
+from django.db import transaction
+from django.test import TransactionTestCase
+
+from mqtt.collector import PublishCollector
+
+
+class TestPublishCollector(TransactionTestCase):
+
+    def setUp(self):
+        self.published = []
+        self.collector = PublishCollector()
+
+    def publish(self, topic, payload):
+        self.published.append((topic, payload))
+
+    def test_autocommit(self):
+
+        # published right away
+        self.collector.add('call/1/data', self.publish, 'call/1/data', 1)
+        self.collector.add('call/1/data', self.publish, 'call/1/data', 2)
+        self.assertEqual(self.published, [('call/1/data', 1), ('call/1/data', 2)])
+
+    def test_no_defer(self):
+
+        # published right away inside transactions too
+        collector = PublishCollector(defer=False)
+        with transaction.atomic():
+            collector.add('call/1/data', self.publish, 'call/1/data', 1)
+            self.assertEqual(self.published, [('call/1/data', 1)])
+
+    def test_commit(self):
+
+        with transaction.atomic():
+            for k in range(10):
+                self.collector.add('call/1/data', self.publish, 'call/1/data', k)
+                self.collector.add('ambulance/1/call/1/status', self.publish, 'ambulance/1/call/1/status', k)
+            self.collector.add(None, self.publish, 'message', 'a')
+            self.collector.add(None, self.publish, 'message', 'b')
+            self.collector.add('call/1/data', self.publish, 'call/1/data', 'final')
+
+            # nothing before commit
+            self.assertEqual(self.published, [])
+
+        # last payload per topic, once
+        self.assertEqual(self.published, [('ambulance/1/call/1/status', 9),
+                                          ('message', 'a'),
+                                          ('message', 'b'),
+                                          ('call/1/data', 'final')])
+
+        info = self.collector.info()
+        self.assertEqual(info.collected, 23)
+        self.assertEqual(info.coalesced, 19)
+        self.assertEqual(info.published, 4)
+
+    def test_rollback(self):
+
+        with transaction.atomic():
+            self.collector.add('call/1/data', self.publish, 'call/1/data', 1)
+            transaction.set_rollback(True)
+
+        self.assertEqual(self.published, [])
+
+        # next transaction is not affected
+        with transaction.atomic():
+            self.collector.add('call/2/data', self.publish, 'call/2/data', 2)
+
+        self.assertEqual(self.published, [('call/2/data', 2)])
+
+    def test_savepoint_rollback(self):
+
+        with transaction.atomic():
+
+            with transaction.atomic():
+                self.collector.add('call/1/data', self.publish, 'call/1/data', 1)
+                transaction.set_rollback(True)
+
+            self.collector.add('call/2/data', self.publish, 'call/2/data', 2)
+
+        # calls of the rolled back savepoint are dropped
+        self.assertEqual(self.published, [('call/2/data', 2)])
+
+    def test_savepoint_commit(self):
+
+        with transaction.atomic():
+            self.collector.add('call/1/data', self.publish, 'call/1/data', 1)
+
+            with transaction.atomic():
+                self.collector.add('call/1/data', self.publish, 'call/1/data', 2)
+                self.collector.add('call/2/data', self.publish, 'call/2/data', 1)
+                self.collector.add('call/2/data', self.publish, 'call/2/data', 2)
+
+            with transaction.atomic():
+                self.collector.add('call/1/data', self.publish, 'call/1/data', 3)
+                self.collector.add('call/2/data', self.publish, 'call/2/data', 3)
+                transaction.set_rollback(True)
+
+        # coalesced through enclosing savepoints, rolled back calls dropped
+        self.assertEqual(self.published, [('call/1/data', 2), ('call/2/data', 2)])
+
+        info = self.collector.info()
+        self.assertEqual(info.collected, 6)
+        self.assertEqual(info.coalesced, 2)
+        self.assertEqual(info.published, 2)
+
+    def test_nested_rollback(self):
+
+        with transaction.atomic():
+            self.collector.add('call/1/data', self.publish, 'call/1/data', 1)
+
+            with transaction.atomic():
+                self.collector.add('call/1/data', self.publish, 'call/1/data', 2)
+                transaction.set_rollback(True)
+
+        # the replaced call runs instead
+        self.assertEqual(self.published, [('call/1/data', 1)])
+
+    def test_rollback_state(self):
+
+        with transaction.atomic():
+            self.collector.add('call/1/data', self.publish, 'call/1/data', 1)
+            transaction.set_rollback(True)
+
+        # nothing carries over into the next transaction
+        with transaction.atomic():
+            self.collector.add('call/1/data', self.publish, 'call/1/data', 2)
+
+        self.assertEqual(self.published, [('call/1/data', 2)])
+        self.assertEqual(self.collector.info().coalesced, 0)
+
+    def test_exception(self):
+
+        def fail():
+            raise ValueError('fail')
+
+        with transaction.atomic():
+            self.collector.add('call/1/data', fail)
+            self.collector.add('call/2/data', self.publish, 'call/2/data', 2)
+
+        # failures after commit do not stop the other publishes
+        self.assertEqual(self.published, [('call/2/data', 2)])
@@ -0,0 +1,107 @@
+from functools import partial
+
+from ambulance.models import Call, CallStatus
+from login.tests.setup_data import TestSetup
+from mqtt.broker import LocalBroker, LocalClient
+from mqtt.consistency import ConsistencyChecker
+from mqtt.management.commands.mqttcheck import Client
+from mqtt.management.commands.mqttseed import Client as SeedClient
+
+
+class TestConsistencyChecker(TestSetup):
+
+    settings = {'USERNAME': '', 'PASSWORD': '', 'HOST': 'localhost', 'PORT': 1883,
+                'KEEPALIVE': 60, 'CLIENT_ID': '', 'CLEAN_SESSION': True, 'RETAIN': True}
+
+    def setUp(self):
+
+        self.broker = LocalBroker()
+        self.checker = ConsistencyChecker(chunk_size=2)
+
+        # everything in the database is seeded
+        self.seeder = SeedClient(self.settings, client_class=partial(LocalClient, broker=self.broker),
+                                 verbosity=0)
+        self.seeder.loop()
+        self.seeder.seed()
+
+    def tearDown(self):
+        self.seeder.disconnect()
+
+    def collect(self, **settings):
+
+        self.checker.retained = {}
+        client = Client(dict(self.settings, **settings), client_class=partial(LocalClient, broker=self.broker),
+                        checker=self.checker, verbosity=0)
+        while client.client.loop(timeout=0.1) == 0 and client.client.pending():
+            pass
+        return client
+
+    def retained(self):
+
+        # retained messages are sent on subscribe
+        received = {}
+        subscriber = LocalClient(broker=self.broker)
+        subscriber.on_message = lambda client, userdata, msg: received.update({msg.topic: msg.payload})
+        subscriber.connect()
+        subscriber.subscribe('#')
+        while subscriber.pending():
+            subscriber.loop(timeout=0)
+        subscriber.disconnect()
+        return received
+
+    def test_consistent(self):
+
+        client = self.collect()
+        report = self.checker.check()
+        client.disconnect()
+
+        self.assertGreater(report.checked, 0)
+        self.assertEqual(report.checked, len(self.checker.retained))
+        self.assertEqual((report.missing, report.stale, report.orphaned), ([], [], []))
+
+    def test_repair(self):
+
+        # missing, stale and orphaned topics
+        self.seeder.remove_topic('ambulance/{}/data'.format(self.a1.id))
+        self.seeder.publish_topic('hospital/{}/data'.format(self.h1.id), {'id': 0})
+        self.seeder.publish_topic('ambulance/999999/data', {})
+
+        # ended calls are not retained
+        call = Call.objects.create(status=CallStatus.E.name, updated_by=self.u1)
+        self.seeder.publish_topic('call/{}/data'.format(call.id), {})
+
+        client = self.collect()
+        report = self.checker.check()
+        self.assertEqual(report.missing, ['ambulance/{}/data'.format(self.a1.id)])
+        self.assertEqual(report.stale, ['hospital/{}/data'.format(self.h1.id)])
+        self.assertEqual(report.orphaned, sorted(['ambulance/999999/data', 'call/{}/data'.format(call.id)]))
+
+        # only the inconsistent topics are published
+        self.assertEqual(self.checker.repair(client, report), 4)
+        client.disconnect()
+
+        retained = self.retained()
+        self.assertIn('ambulance/{}/data'.format(self.a1.id), retained)
+        self.assertNotIn('ambulance/999999/data', retained)
+
+        # other topics are not checked
+        self.assertIn('settings', retained)
+
+        client = self.collect()
+        report = self.checker.check()
+        client.disconnect()
+        self.assertEqual((report.missing, report.stale, report.orphaned), ([], [], []))
+
+    def test_retain(self):
+
+        topic = 'ambulance/{}/data'.format(self.a1.id)
+        self.seeder.remove_topic(topic)
+
+        # repairs follow the retain policy of the client, like mqttseed
+        client = self.collect(RETAIN=False)
+        report = self.checker.check()
+        self.assertEqual(report.missing, [topic])
+        self.checker.repair(client, report)
+        client.disconnect()
+
+        self.assertNotIn(topic, self.retained())
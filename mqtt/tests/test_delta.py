@@ -0,0 +1,76 @@
+from django.test import SimpleTestCase
+
+from mqtt.delta import DeltaEncoder, DELTA_VERSION, SNAPSHOT, DELTA
+
+
+class Clock:
+    now = 0.
+
+    def __call__(self):
+        return self.now
+
+
+class TestDeltaEncoder(SimpleTestCase):
+
+    def test_encode(self):
+
+        clock = Clock()
+        encoder = DeltaEncoder(interval=30, clock=clock)
+        topic = 'ambulance/1/delta'
+
+        # first message is a snapshot
+        data = {'id': 1, 'identifier': 'A1', 'status': 'AV', 'comment': 'x'}
+        (message, snapshot) = encoder.encode(topic, data)
+        self.assertTrue(snapshot)
+        stream = message['stream']
+        self.assertEqual(message, {'v': DELTA_VERSION, 'stream': stream, 'seq': 1,
+                                   'type': SNAPSHOT, 'data': data})
+
+        # changes only, removed fields are listed
+        clock.now = 5
+        (message, snapshot) = encoder.encode(topic, {'id': 1, 'identifier': 'A1', 'status': 'PB'})
+        self.assertFalse(snapshot)
+        self.assertEqual(message, {'v': DELTA_VERSION, 'stream': stream, 'seq': 2,
+                                   'type': DELTA, 'data': {'status': 'PB'}, 'removed': ['comment']})
+
+        # null is a value
+        (message, snapshot) = encoder.encode(topic, {'id': 1, 'identifier': None, 'status': 'PB'})
+        self.assertEqual(message, {'v': DELTA_VERSION, 'stream': stream, 'seq': 3,
+                                   'type': DELTA, 'data': {'identifier': None}})
+
+        # nothing changed
+        self.assertEqual(encoder.encode(topic, {'id': 1, 'identifier': None, 'status': 'PB'}), (None, False))
+
+        # other topics are independent
+        (message, snapshot) = encoder.encode('ambulance/2/delta', {'id': 2})
+        self.assertTrue(snapshot)
+        self.assertEqual(message['seq'], 1)
+
+        # snapshot once the interval expires
+        clock.now = 30
+        (message, snapshot) = encoder.encode(topic, {'id': 1, 'identifier': 'A1', 'status': 'AV'})
+        self.assertTrue(snapshot)
+        self.assertEqual((message['stream'], message['seq']), (stream, 4))
+        self.assertEqual(message['data'], {'id': 1, 'identifier': 'A1', 'status': 'AV'})
+
+        # starts a new stream after reset
+        encoder.reset(topic)
+        (message, snapshot) = encoder.encode(topic, {'id': 1})
+        self.assertTrue(snapshot)
+        self.assertEqual(message['seq'], 1)
+        self.assertNotEqual(message['stream'], stream)
+
+        info = encoder.info()
+        self.assertEqual((info.snapshots, info.deltas, info.unchanged), (4, 2, 1))
+
+    def test_maxsize(self):
+
+        encoder = DeltaEncoder(maxsize=2)
+        for k in range(3):
+            encoder.encode('ambulance/{}/delta'.format(k), {'id': k})
+
+        # least recently published is dropped and gets a snapshot
+        (message, snapshot) = encoder.encode('ambulance/0/delta', {'id': 0})
+        self.assertTrue(snapshot)
+        (message, snapshot) = encoder.encode('ambulance/2/delta', {'id': 2, 'status': 'AV'})
+        self.assertFalse(snapshot)
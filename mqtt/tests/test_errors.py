@@ -0,0 +1,101 @@
+from django.test import SimpleTestCase
+
+from mqtt.errors import ErrorLimiter
+
+
+class Clock:
+
+    def __init__(self):
+        self.now = 0.
+
+    def __call__(self):
+        return self.now
+
+
+class TestErrorLimiter(SimpleTestCase):
+
+    def test_duplicates(self):
+
+        clock = Clock()
+        limiter = ErrorLimiter(window=10, rate=5, clock=clock)
+
+        # first error is sent
+        self.assertEqual(limiter.check('c1', 'topic', 'error'), 0)
+
+        # identical errors within window are suppressed
+        for k in range(20):
+            clock.now += 0.1
+            self.assertIsNone(limiter.check('c1', 'topic', 'error'))
+
+        # other errors and other clients are not
+        self.assertEqual(limiter.check('c1', 'topic', 'other error'), 0)
+        self.assertEqual(limiter.check('c2', 'topic', 'error'), 0)
+
+        # after the window the error is sent with the repeat count
+        clock.now += 10
+        self.assertEqual(limiter.check('c1', 'topic', 'error'), 20)
+        self.assertIsNone(limiter.check('c1', 'topic', 'error'))
+
+        info = limiter.info()
+        self.assertEqual(info.sent, 4)
+        self.assertEqual(info.duplicates, 21)
+        self.assertEqual(info.rate_limited, 0)
+        self.assertEqual(info.clients, 2)
+
+    def test_rate(self):
+
+        clock = Clock()
+        limiter = ErrorLimiter(window=10, rate=5, clock=clock)
+
+        # at most rate errors per second
+        results = [limiter.check('c1', 'topic', 'error {}'.format(k)) for k in range(10)]
+        self.assertEqual(results, [0] * 5 + [None] * 5)
+
+        # other clients are not affected
+        self.assertEqual(limiter.check('c2', 'topic', 'error 9'), 0)
+
+        # next second
+        clock.now += 1
+        self.assertEqual(limiter.check('c1', 'topic', 'error 9'), 0)
+
+        self.assertEqual(limiter.info().rate_limited, 5)
+
+    def test_maxclients(self):
+
+        limiter = ErrorLimiter(maxclients=10, clock=Clock())
+        for k in range(100):
+            limiter.check('c{}'.format(k), 'topic', 'error')
+        self.assertEqual(limiter.info().clients, 10)
+
+    def test_sweep(self):
+
+        clock = Clock()
+        limiter = ErrorLimiter(window=10, rate=5, clock=clock)
+
+        # a client sends the same error many times and stops
+        self.assertEqual(limiter.check('c1', 'topic', 'error', context='user1'), 0)
+        for k in range(499):
+            self.assertIsNone(limiter.check('c1', 'topic', 'error'))
+        self.assertEqual(limiter.check('c2', 'topic', 'error', context='user2'), 0)
+
+        # reported once the window closes
+        clock.now += 5
+        self.assertEqual(limiter.sweep(), [])
+        clock.now += 5
+        self.assertEqual(limiter.sweep(), [('c1', 'user1', 'topic', 'error', 499)])
+        self.assertEqual(limiter.sweep(), [])
+
+        # next identical error is sent without a count
+        self.assertEqual(limiter.check('c1', 'topic', 'error'), 0)
+
+    def test_report(self):
+
+        reported = []
+        limiter = ErrorLimiter(window=10, report=lambda *args: reported.append(args))
+        limiter.check('c1', 'topic', 'error', context='user1')
+        limiter.check('c1', 'topic', 'error')
+        limiter.check('c1', 'topic', 'error')
+
+        # everything still suppressed is reported on stop
+        limiter.stop()
+        self.assertEqual(reported, [('c1', 'user1', 'topic', 'error', 2)])
@@ -0,0 +1,87 @@
+from django.contrib.auth.models import User
+
+from login.models import Client, ClientStatus
+from login.tests.setup_data import TestSetup
+from mqtt.identity import IdentityCache
+
+
+class TestIdentityCache(TestSetup):
+
+    def test(self):
+
+        client = Client.objects.create(client_id='client_id_1', user=self.u1,
+                                       status=ClientStatus.O.name)
+
+        cache = IdentityCache(maxsize=2)
+
+        # miss
+        user, cached = cache.get(self.u1.username, client.client_id)
+        self.assertEqual(user, self.u1)
+        self.assertEqual(cached, client)
+        self.assertEqual(cached.ambulance_id, None)
+
+        # hit, no queries
+        with self.assertNumQueries(0):
+            user, cached = cache.get(self.u1.username, client.client_id)
+        self.assertEqual(user, self.u1)
+        self.assertEqual(cached, client)
+
+        info = cache.info()
+        self.assertEqual(info.hits, 1)
+        self.assertEqual(info.misses, 1)
+        self.assertEqual(info.currsize, 1)
+
+        # different user is not a hit
+        user, cached = cache.get(self.u2.username, client.client_id)
+        self.assertEqual(user, self.u2)
+        self.assertEqual(cache.info().misses, 2)
+
+        # refresh
+        user, cached = cache.get(self.u1.username, client.client_id, refresh=True)
+        self.assertEqual(cache.info().misses, 3)
+
+        # evict
+        cache.evict(client.client_id)
+        self.assertEqual(cache.info().currsize, 0)
+
+        # does not exist
+        with self.assertRaises(Client.DoesNotExist):
+            cache.get(self.u1.username, 'client_id_2')
+        with self.assertRaises(User.DoesNotExist):
+            cache.get('unknown_user', client.client_id)
+
+        # bounded
+        Client.objects.create(client_id='client_id_2', user=self.u2, status=ClientStatus.O.name)
+        Client.objects.create(client_id='client_id_3', user=self.u3, status=ClientStatus.O.name)
+        cache.get(self.u1.username, 'client_id_1')
+        cache.get(self.u2.username, 'client_id_2')
+        cache.get(self.u3.username, 'client_id_3')
+        self.assertEqual(cache.info().currsize, 2)
+        self.assertNotIn('client_id_1', cache.cache)
+
+        # clear
+        cache.clear()
+        info = cache.info()
+        self.assertEqual(info.hits, 0)
+        self.assertEqual(info.misses, 0)
+        self.assertEqual(info.currsize, 0)
+
+    def test_client_save(self):
+
+        from mqtt.identity import get_identity, cache_info, cache_clear
+
+        cache_clear()
+
+        client = Client.objects.create(client_id='client_id_1', user=self.u1,
+                                       status=ClientStatus.O.name)
+
+        get_identity(self.u1.username, client.client_id)
+        self.assertEqual(cache_info().currsize, 1)
+
+        # login to ambulance evicts client
+        client.ambulance = self.a1
+        client.save()
+        self.assertEqual(cache_info().currsize, 0)
+
+        user, cached = get_identity(self.u1.username, client.client_id)
+        self.assertEqual(cached.ambulance_id, self.a1.id)
@@ -14,6 +14,7 @@ from hospital.models import Hospital
 from login.models import Client, ClientStatus, ClientLog
 from .client import MQTTTestCase, MQTTTestClient, TestMQTT
 from .client import MQTTTestSubscribeClient as SubscribeClient
+from .client import MQTTTestAsyncioSubscribeClient as AsyncioSubscribeClient
 
 logger = logging.getLogger(__name__)
 
@@ -218,6 +219,8 @@ class TestMQTTPublish(TestMQTT, MQTTTestCase):
 
 class TestMQTTSubscribe(TestMQTT, MQTTTestCase):
 
+    subscribe_client_class = SubscribeClient
+
     def test(self):
 
         # Start client as admin
@@ -232,8 +235,8 @@ class TestMQTTSubscribe(TestMQTT, MQTTTestCase):
         broker.update(settings.MQTT)
         broker['CLIENT_ID'] = 'test_mqttclient'
 
-        subscribe_client = SubscribeClient(broker,
-                                           debug=True)
+        subscribe_client = self.subscribe_client_class(broker,
+                                                       debug=True)
         self.is_connected(subscribe_client)
         self.is_subscribed(subscribe_client)
 
@@ -434,6 +437,12 @@ class TestMQTTSubscribe(TestMQTT, MQTTTestCase):
         django_client.logout()
 
 
+class TestMQTTSubscribeAsyncio(TestMQTTSubscribe):
+
+    # same test on the asyncio engine
+    subscribe_client_class = AsyncioSubscribeClient
+
+
 class TestMQTTWill(TestMQTT, MQTTTestCase):
 
     def test(self):
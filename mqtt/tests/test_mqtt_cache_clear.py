@@ -18,6 +18,7 @@ class TestMQTTTestCache(TestMQTT, MQTTTestCase):
 
         # clear cache
         cache_clear()
+        start = cache_info()
 
         # retrieve permissions for user u1
         get_permissions(self.u1)
@@ -25,8 +26,8 @@ class TestMQTTTestCache(TestMQTT, MQTTTestCase):
         get_permissions(self.u1)
         get_permissions(self.u1)
         info = cache_info()
-        self.assertEqual(info.hits, 3)
-        self.assertEqual(info.misses, 1)
+        self.assertEqual(info.hits - start.hits, 3)
+        self.assertEqual(info.misses - start.misses, 1)
         self.assertEqual(info.currsize, 1)
 
         # retrieve permissions for user u2 and u1
@@ -35,17 +36,14 @@ class TestMQTTTestCache(TestMQTT, MQTTTestCase):
         get_permissions(self.u2)
         get_permissions(self.u1)
         info = cache_info()
-        self.assertEqual(info.hits, 6)
-        self.assertEqual(info.misses, 2)
+        self.assertEqual(info.hits - start.hits, 6)
+        self.assertEqual(info.misses - start.misses, 2)
         self.assertEqual(info.currsize, 2)
 
-        # clear cache
+        # clear cache, statistics are kept
         cache_clear()
 
-        info = cache_info()
-        self.assertEqual(info.hits, 0)
-        self.assertEqual(info.misses, 0)
-        self.assertEqual(info.currsize, 0)
+        self.assertEqual(cache_info(), info._replace(currsize=0))
 
 
 class TestMQTTSubscribe(TestMQTT, MQTTTestCase):
@@ -82,6 +80,7 @@ class TestMQTTSubscribe(TestMQTT, MQTTTestCase):
 
         # clear cache
         cache_clear()
+        start = cache_info()
 
         # retrieve permissions for user u1
         get_permissions(self.u1)
@@ -89,8 +88,8 @@ class TestMQTTSubscribe(TestMQTT, MQTTTestCase):
         get_permissions(self.u1)
         get_permissions(self.u1)
         info = cache_info()
-        self.assertEqual(info.hits, 3)
-        self.assertEqual(info.misses, 1)
+        self.assertEqual(info.hits - start.hits, 3)
+        self.assertEqual(info.misses - start.misses, 1)
         self.assertEqual(info.currsize, 1)
 
         # send cache_clear
@@ -99,14 +98,12 @@ class TestMQTTSubscribe(TestMQTT, MQTTTestCase):
 
         # process messages
         count = 0
-        while info.hits > 0 or count < 10:
+        while info.currsize > 0 or count < 10:
             self.loop(test_client, subscribe_client)
             time.sleep(0.1)
             info = cache_info()
             count += 1
 
-        self.assertEqual(info.hits, 0)
-        self.assertEqual(info.misses, 0)
         self.assertEqual(info.currsize, 0)
 
         # wait for disconnect
@@ -0,0 +1,139 @@
+import json
+from functools import partial
+
+from django.db import transaction
+
+from ambulance.models import Ambulance
+from login.tests.setup_data import TestSetup
+from mqtt.broker import LocalBroker, LocalClient
+from mqtt.client import MQTTException
+from mqtt.delta import DatabaseDeltaEncoder, SNAPSHOT, DELTA
+from mqtt.models import Outbox, DeltaState
+from mqtt.outbox import OutboxRelay
+from mqtt.publish import PublishClient
+
+
+class TestOutbox(TestSetup):
+
+    def setUp(self):
+
+        broker = LocalBroker()
+        self.received = []
+        self.subscriber = LocalClient(broker=broker)
+        self.subscriber.on_message = lambda client, userdata, msg: self.received.append((msg.topic, msg.payload))
+        self.subscriber.connect()
+        self.subscriber.subscribe('#')
+        self.subscriber.loop()
+
+        settings = {'USERNAME': '', 'PASSWORD': '', 'HOST': 'localhost', 'PORT': 1883,
+                    'KEEPALIVE': 60, 'CLIENT_ID': '', 'CLEAN_SESSION': True}
+        self.writer = PublishClient(settings, client_class=partial(LocalClient, broker=broker),
+                                    outbox=True, verbosity=0)
+        self.relay_client = PublishClient(settings, client_class=partial(LocalClient, broker=broker),
+                                          verbosity=0)
+        self.relay_client.loop()
+
+    def tearDown(self):
+        self.writer.disconnect()
+        self.relay_client.disconnect()
+
+    def receive(self):
+        while self.subscriber.pending():
+            self.subscriber.loop(timeout=0)
+        return self.received
+
+    def test_relay(self):
+
+        with transaction.atomic():
+            self.writer.publish_ambulance(self.a1)
+            self.writer.publish_message({'cache_clear': 'ambulance'})
+            self.a1.comment = 'final'
+            self.a1.save(publish=False)
+            self.writer.publish_ambulance(self.a1)
+            self.writer.remove_ambulance(self.a2)
+
+        # nothing is published by the writer
+        self.assertEqual(self.receive(), [])
+        self.assertEqual(Outbox.objects.count(), 4)
+
+        relay = OutboxRelay(self.relay_client, batch_size=10)
+        self.assertEqual(relay.drain(), 4)
+        self.assertEqual(Outbox.objects.count(), 0)
+        self.assertEqual(relay.published, 3)
+
+        # in order, the ambulance once with the latest data
+        received = self.receive()
+        self.assertEqual([topic for (topic, payload) in received],
+                         ['message', 'ambulance/{}/data'.format(self.a1.id), 'ambulance/{}/data'.format(self.a2.id)])
+        self.assertEqual(json.loads(received[0][1]), {'cache_clear': 'ambulance'})
+        self.assertEqual(json.loads(received[1][1])['comment'], 'final')
+        self.assertEqual(received[2][1], b'')
+
+    def test_rollback(self):
+
+        with transaction.atomic():
+            self.writer.publish_ambulance(self.a1)
+            transaction.set_rollback(True)
+
+        self.assertEqual(Outbox.objects.count(), 0)
+
+    def test_deleted(self):
+
+        ambulance = Ambulance.objects.create(identifier='deleted', capability=self.a1.capability,
+                                             updated_by=self.u1)
+        self.writer.publish_ambulance(ambulance)
+        self.writer.remove_ambulance(ambulance)
+        topic = 'ambulance/{}/data'.format(ambulance.id)
+        ambulance.delete()
+
+        # only the removal is published
+        relay = OutboxRelay(self.relay_client)
+        self.assertEqual(relay.drain(), 2)
+        self.assertEqual(self.receive(), [(topic, b'')])
+
+    def test_delta(self):
+
+        self.writer.delta = True
+        topic = 'ambulance/{}/delta'.format(self.a1.id)
+
+        # relays take turns, as if in different processes
+        relays = [OutboxRelay(self.relay_client, delta=DatabaseDeltaEncoder()) for k in range(2)]
+        for (k, comment) in enumerate(['first', None, None, 'last']):
+            if comment != self.a1.comment:
+                self.a1.comment = comment
+                self.a1.save(publish=False)
+            self.writer.publish_ambulance(self.a1)
+            relays[k % 2].drain()
+
+        # one stream, in sequence, without the unchanged message
+        messages = [json.loads(payload) for (_topic, payload) in self.receive() if _topic == topic]
+        self.assertEqual([(message['type'], message['seq']) for message in messages],
+                         [(SNAPSHOT, 1), (DELTA, 2), (DELTA, 3)])
+        self.assertEqual(len(set(message['stream'] for message in messages)), 1)
+        self.assertEqual(messages[1]['data']['comment'], None)
+        self.assertNotIn('removed', messages[1])
+        self.assertEqual(messages[2]['data']['comment'], 'last')
+
+        # removal ends the stream
+        self.writer.remove_ambulance(self.a1)
+        relays[0].drain()
+        self.assertEqual(self.receive()[-1], (topic, b''))
+        self.assertFalse(DeltaState.objects.filter(topic=topic).exists())
+
+        # skipped without an encoder
+        self.writer.publish_ambulance(self.a1)
+        OutboxRelay(self.relay_client).drain()
+        self.assertEqual(self.receive()[-1][0], 'ambulance/{}/data'.format(self.a1.id))
+
+    def test_broker_down(self):
+
+        self.writer.publish_ambulance(self.a1)
+
+        self.relay_client.client.disconnect()
+        self.relay_client.loop()
+
+        # batch stays in the outbox
+        relay = OutboxRelay(self.relay_client)
+        with self.assertRaises(MQTTException):
+            relay.relay()
+        self.assertEqual(Outbox.objects.count(), 1)
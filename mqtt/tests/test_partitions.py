@@ -0,0 +1,78 @@
+import threading
+from functools import partial
+
+from django.test import SimpleTestCase
+
+from mqtt.broker import LocalBroker, LocalClient
+from mqtt.router import TopicRouter
+from mqtt.subscribe import SubscribeClient
+from mqtt.workers import partition, shard
+
+
+class TestPartitions(SimpleTestCase):
+
+    def test_partition(self):
+
+        keys = ['ambulance/{}'.format(k) for k in range(1000)]
+
+        # partitions are stable and within range
+        for key in keys:
+            self.assertEqual(partition(key, 4), partition(key, 4))
+            self.assertIn(partition(key, 4), range(4))
+
+        # keys in one partition still spread over all shards
+        keys = [key for key in keys if partition(key, 2) == 0]
+        self.assertEqual(set(shard(key, 8) for key in keys), set(range(8)))
+
+    def test_subscribers(self):
+
+        broker = LocalBroker()
+        lock = threading.Lock()
+        handled = {}
+
+        def handler(clnt, userdata, msg, **params):
+            with lock:
+                handled.setdefault(msg.topic, []).append((clnt, msg.payload))
+
+        # three partitioned subscribers
+        clients = []
+        for k in range(3):
+            client = SubscribeClient({'USERNAME': '', 'PASSWORD': '', 'HOST': 'localhost', 'PORT': 1883,
+                                      'KEEPALIVE': 60, 'CLIENT_ID': '', 'CLEAN_SESSION': True},
+                                     client_class=partial(LocalClient, broker=broker),
+                                     verbosity=0,
+                                     partitions=3, partition=k)
+            client.router = TopicRouter((pattern, handler, key)
+                                        for (pattern, _, key) in SubscribeClient.routes)
+            client.loop_start()
+            client.client.join()
+            clients.append(client)
+
+        for seq in range(10):
+            for k in range(30):
+                broker.publish('user/u/client/c{0}/ambulance/{0}/data'.format(k), str(seq))
+        broker.publish('message', '"cache_clear"')
+
+        for client in clients:
+            client.client.join()
+            client.disconnect()
+            client.loop_stop()
+
+        # each object is handled by exactly one partition, in order
+        for k in range(30):
+            messages = handled['user/u/client/c{0}/ambulance/{0}/data'.format(k)]
+            self.assertEqual(len(set(clnt for (clnt, _) in messages)), 1)
+            self.assertEqual([payload for (_, payload) in messages], [str(seq).encode() for seq in range(10)])
+
+        # messages without a key are handled by all partitions
+        self.assertEqual(len(handled['message']), 3)
+
+        self.assertEqual(sum(client.skipped for client in clients), 2 * 300)
+
+        # partition must be in range
+        with self.assertRaises(ValueError):
+            SubscribeClient({'USERNAME': '', 'PASSWORD': '', 'HOST': 'localhost', 'PORT': 1883,
+                             'KEEPALIVE': 60, 'CLIENT_ID': '', 'CLEAN_SESSION': True},
+                            client_class=partial(LocalClient, broker=broker),
+                            verbosity=0,
+                            partitions=3, partition=3)
@@ -0,0 +1,98 @@
+import json
+
+from rest_framework.renderers import JSONRenderer
+
+from ambulance.models import Ambulance, Call, CallStatus
+from ambulance.serializers import AmbulanceSerializer, CallSerializer
+from hospital.serializers import HospitalSerializer
+from login.models import Client, ClientStatus
+from login.permissions import cache_clear as permissions_cache_clear
+from login.serializers import UserProfileSerializer
+from login.tests.setup_data import TestSetup
+from mqtt.payloads import PayloadCache
+
+
+class TestPayloadCache(TestSetup):
+
+    def setUp(self):
+        self.cache = PayloadCache(maxsize=2)
+        self.cache.connect()
+
+    def tearDown(self):
+        self.cache.disconnect()
+
+    def test_render(self):
+
+        payload = self.cache.render(AmbulanceSerializer(self.a1))
+        self.assertEqual(payload, JSONRenderer().render(AmbulanceSerializer(self.a1).data))
+
+        # unchanged, no queries
+        with self.assertNumQueries(0):
+            self.assertEqual(self.cache.render(AmbulanceSerializer(self.a1)), payload)
+
+        info = self.cache.info()
+        self.assertEqual((info.hits, info.misses, info.currsize), (1, 1, 1))
+
+        # saved
+        self.a1.comment = 'changed'
+        self.a1.save()
+        payload = self.cache.render(AmbulanceSerializer(self.a1))
+        self.assertEqual(json.loads(payload)['comment'], 'changed')
+        self.assertEqual(self.cache.info().misses, 2)
+
+        # changed elsewhere, newer updated_on
+        self.a1.refresh_from_db()
+        self.a1.updated_on = self.a1.updated_on.replace(year=self.a1.updated_on.year + 1)
+        self.cache.render(AmbulanceSerializer(self.a1))
+        self.assertEqual(self.cache.info().misses, 3)
+
+        # least recently used is evicted
+        self.cache.render(AmbulanceSerializer(self.a2))
+        self.cache.render(HospitalSerializer(self.h1))
+        self.cache.render(AmbulanceSerializer(self.a2))
+        self.cache.render(AmbulanceSerializer(self.a1))
+        info = self.cache.info()
+        self.assertEqual((info.hits, info.misses, info.currsize), (2, 6, 2))
+
+    def test_related(self):
+
+        self.cache.render(AmbulanceSerializer(self.a1))
+
+        # logging in a client changes client_id, even if saved by another process
+        self.cache.disconnect()
+        Client.objects.create(client_id='client_id_1', user=self.u1,
+                              status=ClientStatus.O.name, ambulance=self.a1)
+        ambulance = Ambulance.objects.get(id=self.a1.id)
+        payload = self.cache.render(AmbulanceSerializer(ambulance))
+        self.assertEqual(json.loads(payload)['client_id'], 'client_id_1')
+        self.assertEqual(self.cache.info().misses, 2)
+
+        # client saved without changing client_id
+        self.cache.connect()
+        client = Client.objects.get(client_id='client_id_1')
+        client.status = ClientStatus.R.name
+        client.save()
+        ambulance = Ambulance.objects.get(id=self.a1.id)
+        self.assertEqual(self.cache.render(AmbulanceSerializer(ambulance)), payload)
+        self.assertEqual(self.cache.info().hits, 1)
+
+    def test_call(self):
+
+        # calls depend on rows without a version, never cached
+        call = Call.objects.create(status=CallStatus.P.name, updated_by=self.u1)
+        payload = self.cache.render(CallSerializer(call))
+        self.assertEqual(payload, JSONRenderer().render(CallSerializer(call).data))
+        self.cache.render(CallSerializer(call))
+        info = self.cache.info()
+        self.assertEqual((info.hits, info.misses, info.currsize), (0, 0, 0))
+
+    def test_profile(self):
+
+        self.cache.render(UserProfileSerializer(self.u2))
+        self.cache.render(UserProfileSerializer(self.u2))
+        self.assertEqual(self.cache.info().hits, 1)
+
+        # permissions changed
+        permissions_cache_clear()
+        self.cache.render(UserProfileSerializer(self.u2))
+        self.assertEqual(self.cache.info().misses, 2)
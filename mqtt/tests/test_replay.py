@@ -0,0 +1,103 @@
+import os
+import tempfile
+
+from django.test import SimpleTestCase
+
+from mqtt.broker import LocalBroker, LocalClient
+from mqtt.metrics import HandlerMetrics, percentile
+from mqtt.recording import RecordWriter, read_records
+
+
+class TestRecording(SimpleTestCase):
+
+    def test_round_trip(self):
+
+        records = [(0., 'user/a/client/b/ambulance/1/data', b'{"location": {"latitude": 1, "longitude": 2}}', 2),
+                   (0.5, 'user/a/client/b/status', b'online', 2),
+                   (1.25, 'user/a/client/b/hospital/3/data', b'', 0)]
+
+        with tempfile.TemporaryDirectory() as directory:
+
+            path = os.path.join(directory, 'traffic.rec')
+            with RecordWriter(path) as writer:
+                for record in records:
+                    writer.write(*record)
+            self.assertEqual(writer.count, 3)
+
+            self.assertEqual([tuple(record) for record in read_records(path)], records)
+
+            # not a recording
+            path = os.path.join(directory, 'other')
+            with open(path, 'wb') as file:
+                file.write(b'not a recording')
+            with self.assertRaises(OSError):
+                list(read_records(path))
+
+
+class TestLocalClient(SimpleTestCase):
+
+    def test_publish_subscribe(self):
+
+        broker = LocalBroker()
+        received = []
+
+        client = LocalClient(broker=broker)
+        client.on_message = lambda clnt, userdata, msg: received.append((msg.topic, msg.payload, msg.retain))
+        client.connect()
+        client.subscribe('ambulance/+/data', 2)
+
+        publisher = LocalClient(broker=broker)
+        publisher.connect()
+        publisher.publish('ambulance/1/data', b'retained', retain=True)
+        publisher.publish('ambulance/2/data', '2')
+        publisher.publish('hospital/1/data', '3')
+        self.assertEqual(publisher.publish('ambulance/3/data', '4').rc, 0)
+
+        # messages are processed by the loop
+        self.assertEqual(received, [])
+        client.loop_start()
+        client.join()
+        self.assertEqual(received, [('ambulance/1/data', b'retained', False),
+                                    ('ambulance/2/data', b'2', False),
+                                    ('ambulance/3/data', b'4', False)])
+
+        # retained messages are delivered on subscribe
+        received.clear()
+        other = LocalClient(broker=broker)
+        other.on_message = client.on_message
+        other.connect()
+        other.subscribe('ambulance/#')
+        other.loop(timeout=0)
+        other.loop(timeout=0)
+        self.assertEqual(received, [('ambulance/1/data', b'retained', True)])
+
+        client.loop_stop()
+        self.assertFalse(client.is_connected())
+
+
+class TestHandlerMetrics(SimpleTestCase):
+
+    def test_percentile(self):
+
+        values = list(range(1, 101))
+        self.assertEqual(percentile(values, 50), 50)
+        self.assertEqual(percentile(values, 95), 95)
+        self.assertEqual(percentile(values, 99), 99)
+        self.assertEqual(percentile([7], 99), 7)
+        self.assertIsNone(percentile([], 50))
+
+    def test_summary(self):
+
+        metrics = HandlerMetrics()
+        for k in range(10):
+            metrics.record('on_ambulance', 0.001 * (k + 1), 2)
+        metrics.record('on_hospital', 0.5, 3)
+
+        summary = dict(metrics.summary())
+        self.assertEqual(summary['on_ambulance']['calls'], 10)
+        self.assertEqual(summary['on_ambulance']['p50 ms'], 5.)
+        self.assertEqual(summary['on_ambulance']['queries/call'], 2)
+        self.assertEqual(summary['total']['calls'], 11)
+        self.assertEqual(summary['total']['queries'], 23)
+        self.assertEqual(summary['total']['p99 ms'], 500.)
+        self.assertEqual(metrics.count(), 11)
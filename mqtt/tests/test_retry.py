@@ -0,0 +1,109 @@
+import threading
+import time
+from functools import partial
+
+from django.test import SimpleTestCase
+
+from mqtt.broker import LocalBroker, LocalClient
+from mqtt.client import BaseClient
+
+
+class TestRetryWorker(SimpleTestCase):
+
+    def test_outage(self):
+
+        broker = LocalBroker()
+        client = BaseClient({'USERNAME': '', 'PASSWORD': '', 'HOST': 'localhost', 'PORT': 1883,
+                             'KEEPALIVE': 60, 'CLIENT_ID': '', 'CLEAN_SESSION': True},
+                            client_class=partial(LocalClient, broker=broker),
+                            verbosity=0)
+        client.loop()
+        self.assertTrue(client.is_connected())
+
+        subscriber = LocalClient(broker=broker)
+        subscriber.connect()
+        subscriber.subscribe('ambulance/#')
+
+        # broker goes away
+        client.client.disconnect()
+        client.loop()
+        self.assertFalse(client.is_connected())
+
+        threads = threading.active_count()
+
+        # failed publishes are buffered by a single retry worker
+        for k in range(200):
+            client.publish('ambulance/{}/data'.format(k), 'payload', qos=2)
+        self.assertEqual(len(client.buffer), 200)
+        self.assertEqual(threading.active_count(), threads + 1)
+
+        # retries during the outage do not add threads
+        time.sleep(0.5)
+        self.assertEqual(threading.active_count(), threads + 1)
+
+        # reconnect wakes the worker up
+        client.client.connect()
+        client.loop()
+        self.assertTrue(client.is_connected())
+
+        for _ in range(50):
+            if len(client.buffer) == 0:
+                break
+            time.sleep(0.1)
+        self.assertEqual(len(client.buffer), 0)
+
+        # connect event and buffered messages
+        self.assertEqual(subscriber.pending(), 201)
+
+        # disconnect stops the worker
+        client.disconnect()
+        for _ in range(50):
+            if threading.active_count() == threads:
+                break
+            time.sleep(0.1)
+        self.assertEqual(threading.active_count(), threads)
+
+    def test_order(self):
+
+        broker = LocalBroker()
+        client = BaseClient({'USERNAME': '', 'PASSWORD': '', 'HOST': 'localhost', 'PORT': 1883,
+                             'KEEPALIVE': 60, 'CLIENT_ID': '', 'CLEAN_SESSION': True},
+                            client_class=partial(LocalClient, broker=broker),
+                            verbosity=0)
+        client.loop()
+
+        received = []
+        subscriber = LocalClient(broker=broker)
+        subscriber.on_message = lambda clnt, userdata, msg: received.append(msg.payload)
+        subscriber.connect()
+        subscriber.subscribe('ambulance/#')
+
+        # spooled before a restart
+        client.buffer.append('ambulance/1/data', b'old', 2)
+
+        # newer publishes queue behind it
+        client.publish('ambulance/1/data', b'new', qos=2)
+
+        for _ in range(50):
+            if len(client.buffer) == 0:
+                break
+            time.sleep(0.1)
+        self.assertEqual(len(client.buffer), 0)
+
+        # published directly once the spool is empty
+        for _ in range(50):
+            if not client.retry_pending.is_set():
+                break
+            time.sleep(0.1)
+        client.publish('ambulance/1/data', b'newest', qos=2)
+        self.assertEqual(len(client.buffer), 0)
+
+        while subscriber.pending():
+            subscriber.loop(timeout=0)
+        self.assertEqual(received, [b'old', b'new', b'newest'])
+
+        # disconnect stops the worker
+        worker = client.retry_thread
+        client.disconnect()
+        worker.join(5)
+        self.assertFalse(worker.is_alive())
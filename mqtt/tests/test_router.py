@@ -0,0 +1,101 @@
+from django.test import SimpleTestCase
+
+from mqtt.router import TopicRouter
+from mqtt.subscribe import SubscribeClient
+
+
+class TestTopicRouter(SimpleTestCase):
+
+    def setUp(self):
+        self.router = TopicRouter((pattern, handler, key)
+                                  for (pattern, handler, key) in SubscribeClient.routes)
+
+    def test_subscriptions(self):
+
+        self.assertCountEqual(self.router.subscriptions(),
+                              ['message',
+                               'user/+/client/+/ambulance/+/data',
+                               'user/+/client/+/hospital/+/data',
+                               'user/+/client/+/equipment/+/item/+/data',
+                               'user/+/client/+/status',
+                               'user/+/client/+/ambulance/+/call/+/status',
+                               'user/+/client/+/ambulance/+/call/+/waypoint/+/data'])
+
+    def test_match(self):
+
+        route, params = self.router.match('message')
+        self.assertEqual(route.handler, 'on_message')
+        self.assertEqual(params, {})
+
+        route, params = self.router.match('user/admin/client/client_1/ambulance/12/data')
+        self.assertEqual(route.handler, 'on_ambulance')
+        self.assertEqual(params, {'username': 'admin', 'client_id': 'client_1', 'ambulance_id': 12})
+        self.assertEqual(route.key.format(**params), 'ambulance/12')
+
+        route, params = self.router.match('user/admin/client/client_1/hospital/3/data')
+        self.assertEqual(route.handler, 'on_hospital')
+        self.assertEqual(params, {'username': 'admin', 'client_id': 'client_1', 'hospital_id': 3})
+
+        route, params = self.router.match('user/admin/client/client_1/equipment/4/item/5/data')
+        self.assertEqual(route.handler, 'on_equipment_item')
+        self.assertEqual(params, {'username': 'admin', 'client_id': 'client_1',
+                                  'equipmentholder_id': 4, 'equipment_id': 5})
+        self.assertEqual(route.key.format(**params), 'equipment/4')
+
+        route, params = self.router.match('user/admin/client/client_1/status')
+        self.assertEqual(route.handler, 'on_client_status')
+        self.assertEqual(params, {'username': 'admin', 'client_id': 'client_1'})
+
+        route, params = self.router.match('user/admin/client/client_1/ambulance/12/call/7/status')
+        self.assertEqual(route.handler, 'on_call_ambulance')
+        self.assertEqual(params, {'username': 'admin', 'client_id': 'client_1',
+                                  'ambulance_id': 12, 'call_id': 7})
+
+        route, params = self.router.match('user/admin/client/client_1/ambulance/12/call/7/waypoint/-1/data')
+        self.assertEqual(route.handler, 'on_call_ambulance_waypoint')
+        self.assertEqual(params, {'username': 'admin', 'client_id': 'client_1',
+                                  'ambulance_id': 12, 'call_id': 7, 'waypoint_id': -1})
+
+    def test_no_match(self):
+
+        # wrong size
+        self.assertIsNone(self.router.match('user/admin/client/client_1'))
+        self.assertIsNone(self.router.match('user/admin/client/client_1/ambulance/12'))
+        self.assertIsNone(self.router.match('user/admin/client/client_1/ambulance/12/data/more'))
+
+        # wrong literal
+        self.assertIsNone(self.router.match('user/admin/client/client_1/ambulance/12/status'))
+
+        # wrong type
+        self.assertIsNone(self.router.match('user/admin/client/client_1/ambulance/abc/data'))
+
+    def test_conflict(self):
+
+        router = TopicRouter()
+        router.add('a/{x:int}/b', 'h1')
+        with self.assertRaises(ValueError):
+            router.add('a/{x:int}/b', 'h2')
+        with self.assertRaises(ValueError):
+            router.add('a/{y}/c', 'h3')
+
+    def test_backtrack(self):
+
+        router = TopicRouter()
+        router.add('a/b/c', 'literal')
+        router.add('a/{x}/d', 'param')
+
+        route, params = router.match('a/b/c')
+        self.assertEqual(route.handler, 'literal')
+        self.assertEqual(params, {})
+
+        # literal branch dead-ends, parameter matches
+        route, params = router.match('a/b/d')
+        self.assertEqual(route.handler, 'param')
+        self.assertEqual(params, {'x': 'b'})
+
+        # no parameters left behind by failed branches
+        router.add('a/{x}/{y:int}/e', 'nested')
+        self.assertIsNone(router.match('a/b/c/e'))
+        route, params = router.match('a/b/1/e')
+        self.assertEqual(route.handler, 'nested')
+        self.assertEqual(params, {'x': 'b', 'y': 1})
@@ -0,0 +1,229 @@
+from functools import partial
+
+from django.utils import timezone
+
+from ambulance.models import Ambulance, AmbulanceCall, AmbulanceCallStatus, Call, CallStatus
+from login.models import UserAmbulancePermission
+from login.tests.setup_data import TestSetup
+from mqtt.broker import LocalBroker, LocalClient
+from mqtt.cache_clear import mqtt_cache_clear
+from mqtt.management.commands.mqttseed import Client
+from mqtt.models import Tombstone
+from mqtt.seed import chunked
+from mqtt.watermark import get_watermark, SEED_WATERMARK, WATERMARK_OVERLAP
+
+
+class TestSeed(TestSetup):
+
+    def setUp(self):
+
+        self.broker = LocalBroker()
+        self.received = {}
+        self.subscriber = LocalClient(broker=self.broker)
+        self.subscriber.on_message = lambda client, userdata, msg: self.received.update({msg.topic: msg.payload})
+        self.subscriber.connect()
+        self.subscriber.subscribe('#')
+        self.subscriber.loop()
+
+        settings = {'USERNAME': '', 'PASSWORD': '', 'HOST': 'localhost', 'PORT': 1883,
+                    'KEEPALIVE': 60, 'CLIENT_ID': '', 'CLEAN_SESSION': True}
+        self.seeder = Client(settings, client_class=partial(LocalClient, broker=self.broker),
+                             chunk_size=2, window=3, verbosity=0)
+        self.seeder.loop()
+
+    def tearDown(self):
+        self.seeder.disconnect()
+
+    def test_chunked(self):
+
+        # one query per chunk
+        with self.assertNumQueries(2):
+            ambulances = list(chunked(Ambulance.objects.all(), 2))
+        self.assertEqual([ambulance.id for ambulance in ambulances],
+                         sorted([self.a1.id, self.a2.id, self.a3.id]))
+
+        with self.assertNumQueries(1):
+            self.assertEqual(list(chunked(Ambulance.objects.none(), 2)), [])
+
+    def test_seed(self):
+
+        # active call
+        call = Call.objects.create(status=CallStatus.P.name, updated_by=self.u1)
+        AmbulanceCall.objects.create(call=call, ambulance=self.a1,
+                                     status=AmbulanceCallStatus.R.name, updated_by=self.u1)
+
+        # ended call, removed from the retained messages
+        ended = Call.objects.create(status=CallStatus.E.name, updated_by=self.u1)
+        AmbulanceCall.objects.create(call=ended, ambulance=self.a2,
+                                     status=AmbulanceCallStatus.C.name, updated_by=self.u1)
+        self.broker.retained['call/{}/data'.format(ended.id)] = b'{}'
+        self.broker.retained['ambulance/{}/call/{}/status'.format(self.a2.id, ended.id)] = b'"C"'
+
+        self.seeder.seed()
+        while self.subscriber.pending():
+            self.subscriber.loop(timeout=0)
+        received = self.received
+        retained = self.broker.retained
+
+        self.assertIn('settings', received)
+        for ambulance in (self.a1, self.a2, self.a3):
+            self.assertIn('ambulance/{}/data'.format(ambulance.id), received)
+        for hospital in (self.h1, self.h2, self.h3):
+            self.assertIn('hospital/{}/data'.format(hospital.id), received)
+        self.assertIn('equipment/{}/item/{}/data'.format(self.h1.equipmentholder.id, self.e1.id), received)
+        self.assertIn('user/{}/profile'.format(self.u1.username), received)
+
+        self.assertIn('call/{}/data'.format(call.id), received)
+        self.assertEqual(received['ambulance/{}/call/{}/status'.format(self.a1.id, call.id)], b'"R"')
+        self.assertNotIn('call/{}/data'.format(ended.id), retained)
+        self.assertNotIn('ambulance/{}/call/{}/status'.format(self.a2.id, ended.id), retained)
+
+        # everything was acknowledged
+        self.assertEqual(self.seeder.pubset, set())
+        self.assertEqual(self.seeder.acked, set())
+        self.assertEqual([name for (name, count, elapsed) in self.seeder.phases],
+                         ['deleted objects', 'settings', 'hospital data', 'equipment data', 'equipment metadata',
+                          'ambulance data', 'profile data', 'call data', 'ended calls'])
+        self.assertEqual(dict((name, count) for (name, count, elapsed) in self.seeder.phases)['ended calls'], 1)
+
+
+class TestIncrementalSeed(TestSetup):
+
+    def setUp(self):
+        self.broker = LocalBroker()
+        self.since = timezone.now()
+
+    def seed(self):
+
+        received = {}
+        subscriber = LocalClient(broker=self.broker)
+        subscriber.on_message = lambda client, userdata, msg: received.update({msg.topic: msg.payload})
+        subscriber.connect()
+        subscriber.subscribe('#')
+        subscriber.loop()
+
+        settings = {'USERNAME': '', 'PASSWORD': '', 'HOST': 'localhost', 'PORT': 1883,
+                    'KEEPALIVE': 60, 'CLIENT_ID': '', 'CLEAN_SESSION': True}
+        seeder = Client(settings, client_class=partial(LocalClient, broker=self.broker),
+                        since=self.since, verbosity=0)
+        seeder.loop()
+        seeder.seed()
+        seeder.disconnect()
+
+        while subscriber.pending():
+            subscriber.loop(timeout=0)
+        subscriber.disconnect()
+
+        return received
+
+    def test_ambulances(self):
+
+        self.a1.comment = 'changed'
+        self.a1.save()
+
+        received = self.seed()
+        self.assertIn('ambulance/{}/data'.format(self.a1.id), received)
+        self.assertNotIn('ambulance/{}/data'.format(self.a2.id), received)
+        self.assertNotIn('ambulance/{}/data'.format(self.a3.id), received)
+
+        # watermark is the start of the seed
+        self.assertGreater(get_watermark(SEED_WATERMARK), self.since)
+
+    def test_hospitals(self):
+
+        self.h2.comment = 'changed'
+        self.h2.save()
+
+        received = self.seed()
+        self.assertIn('hospital/{}/data'.format(self.h2.id), received)
+        self.assertNotIn('hospital/{}/data'.format(self.h1.id), received)
+        self.assertNotIn('hospital/{}/data'.format(self.h3.id), received)
+
+    def test_equipment(self):
+
+        self.he1.value = 'False'
+        self.he1.save()
+
+        received = self.seed()
+        self.assertIn('equipment/{}/item/{}/data'.format(self.h1.equipmentholder.id, self.e1.id), received)
+        self.assertIn('equipment/{}/metadata'.format(self.h1.equipmentholder.id), received)
+        self.assertNotIn('equipment/{}/item/{}/data'.format(self.h1.equipmentholder.id, self.e2.id), received)
+        self.assertNotIn('equipment/{}/metadata'.format(self.h2.equipmentholder.id), received)
+
+    def test_deleted_equipment(self):
+
+        self.he2.delete()
+
+        # metadata no longer lists the deleted item
+        received = self.seed()
+        self.assertEqual(received['equipment/{}/item/{}/data'.format(self.h1.equipmentholder.id, self.e2.id)], b'')
+        self.assertIn('equipment/{}/metadata'.format(self.h1.equipmentholder.id), received)
+        self.assertNotIn('equipment/{}/metadata'.format(self.h2.equipmentholder.id), received)
+
+    def test_profiles(self):
+
+        # permissions did not change
+        received = self.seed()
+        self.assertNotIn('user/{}/profile'.format(self.u1.username), received)
+
+        # only the users whose permissions changed
+        UserAmbulancePermission.objects.create(user=self.u2, ambulance=self.a1)
+        received = self.seed()
+        self.assertIn('user/{}/profile'.format(self.u2.username), received)
+        self.assertNotIn('user/{}/profile'.format(self.u1.username), received)
+        self.assertNotIn('user/{}/profile'.format(self.u3.username), received)
+
+        # every user once all permissions change
+        mqtt_cache_clear()
+        received = self.seed()
+        self.assertIn('user/{}/profile'.format(self.u1.username), received)
+        self.assertIn('user/{}/profile'.format(self.u3.username), received)
+
+    def test_calls(self):
+
+        # calls before since are not seeded
+        old = Call.objects.create(status=CallStatus.P.name, updated_by=self.u1)
+        ended = Call.objects.create(status=CallStatus.P.name, updated_by=self.u1)
+        ambulancecall = AmbulanceCall.objects.create(call=ended, ambulance=self.a2,
+                                                     status=AmbulanceCallStatus.A.name, updated_by=self.u1)
+        self.since = timezone.now()
+
+        call = Call.objects.create(status=CallStatus.P.name, updated_by=self.u1)
+        AmbulanceCall.objects.create(call=call, ambulance=self.a1,
+                                     status=AmbulanceCallStatus.R.name, updated_by=self.u1)
+        ended.status = CallStatus.E.name
+        ended.save()
+
+        self.broker.retained['call/{}/data'.format(ended.id)] = b'{}'
+        self.broker.retained['ambulance/{}/call/{}/status'.format(self.a2.id, ended.id)] = b'"A"'
+
+        received = self.seed()
+        self.assertIn('call/{}/data'.format(call.id), received)
+        self.assertEqual(received['ambulance/{}/call/{}/status'.format(self.a1.id, call.id)], b'"R"')
+        self.assertNotIn('call/{}/data'.format(old.id), received)
+        self.assertEqual(received['call/{}/data'.format(ended.id)], b'')
+        self.assertEqual(received['ambulance/{}/call/{}/status'.format(ambulancecall.ambulance_id, ended.id)], b'')
+        self.assertNotIn('call/{}/data'.format(ended.id), self.broker.retained)
+
+    def test_deleted(self):
+
+        self.broker.retained['ambulance/{}/data'.format(self.a3.id)] = b'{}'
+        self.broker.retained['equipment/{}/item/{}/data'.format(self.h1.equipmentholder.id, self.e2.id)] = b'{}'
+
+        ambulance_id = self.a3.id
+        self.a3.delete()
+        self.he2.delete()
+
+        received = self.seed()
+        self.assertEqual(received['ambulance/{}/data'.format(ambulance_id)], b'')
+        self.assertEqual(received['ambulance/{}/delta'.format(ambulance_id)], b'')
+        self.assertEqual(received['equipment/{}/item/{}/data'.format(self.h1.equipmentholder.id, self.e2.id)], b'')
+        self.assertNotIn('ambulance/{}/data'.format(ambulance_id), self.broker.retained)
+
+        # tombstones are kept for the overlap
+        self.assertTrue(Tombstone.objects.exists())
+        Tombstone.objects.update(deleted_on=timezone.now() - 2 * WATERMARK_OVERLAP)
+        self.since = timezone.now() - 3 * WATERMARK_OVERLAP
+        received = self.seed()
+        self.assertIn('ambulance/{}/data'.format(ambulance_id), received)
+        self.assertFalse(Tombstone.objects.exists())
@@ -0,0 +1,129 @@
+import os
+import tempfile
+
+from django.test import SimpleTestCase
+
+from mqtt.spool import MemorySpool, SQLiteSpool, COALESCE
+
+
+class Clock:
+
+    def __init__(self):
+        self.now = 0.
+
+    def __call__(self):
+        return self.now
+
+
+class SpoolTests:
+
+    def make_spool(self, **kwargs):
+        raise NotImplementedError
+
+    def test_fifo(self):
+
+        spool = self.make_spool(maxsize=10)
+        for k in range(5):
+            spool.append('topic/{}'.format(k), 'payload {}'.format(k).encode(), 2, k % 2 == 0)
+        self.assertEqual(len(spool), 5)
+
+        # drain in batches, in order
+        sent = []
+        self.assertEqual(spool.drain(sent.append, batch_size=3), 3)
+        self.assertEqual(spool.drain(sent.append, batch_size=3), 2)
+        self.assertEqual(spool.drain(sent.append, batch_size=3), 0)
+        self.assertEqual(sent, [{'topic': 'topic/{}'.format(k), 'payload': 'payload {}'.format(k).encode(),
+                                 'qos': 2, 'retain': k % 2 == 0} for k in range(5)])
+        self.assertEqual(len(spool), 0)
+        self.assertEqual(spool.info().sent, 5)
+
+    def test_drain_failure(self):
+
+        spool = self.make_spool()
+        for k in range(5):
+            spool.append('topic', str(k).encode())
+
+        def send(message):
+            if message['payload'] == b'2':
+                raise ValueError('could not send')
+
+        # messages that were not sent stay on the spool
+        with self.assertRaises(ValueError):
+            spool.drain(send)
+        self.assertEqual(len(spool), 3)
+
+        sent = []
+        spool.drain(sent.append)
+        self.assertEqual([message['payload'] for message in sent], [b'2', b'3', b'4'])
+
+    def test_drop_oldest(self):
+
+        clock = Clock()
+        spool = self.make_spool(maxsize=3, clock=clock)
+        for k in range(5):
+            clock.now = k
+            spool.append('topic/{}'.format(k % 2), str(k).encode())
+
+        info = spool.info()
+        self.assertEqual(info.depth, 3)
+        self.assertEqual(info.dropped, 2)
+        self.assertEqual(info.age, 2)
+
+        sent = []
+        spool.drain(sent.append)
+        self.assertEqual([message['payload'] for message in sent], [b'2', b'3', b'4'])
+
+    def test_coalesce(self):
+
+        spool = self.make_spool(maxsize=3, overflow=COALESCE)
+        for k in range(6):
+            spool.append('topic/{}'.format(k % 2), str(k).encode())
+        spool.append('other', b'6')
+
+        info = spool.info()
+        self.assertEqual(info.depth, 3)
+        self.assertEqual(info.coalesced, 3)
+        self.assertEqual(info.dropped, 1)
+
+        sent = []
+        spool.drain(sent.append)
+        self.assertEqual([(message['topic'], message['payload']) for message in sent],
+                         [('topic/0', b'4'), ('topic/1', b'5'), ('other', b'6')])
+
+    def test_policy(self):
+        with self.assertRaises(ValueError):
+            self.make_spool(overflow='drop-newest')
+
+
+class TestMemorySpool(SpoolTests, SimpleTestCase):
+
+    def make_spool(self, **kwargs):
+        return MemorySpool(**kwargs)
+
+
+class TestSQLiteSpool(SpoolTests, SimpleTestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'spool.sqlite')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def make_spool(self, **kwargs):
+        return SQLiteSpool(self.path, **kwargs)
+
+    def test_restart(self):
+
+        spool = self.make_spool()
+        spool.append('topic', b'payload', 1, True)
+        spool.append('topic', None)
+        spool.close()
+
+        # messages survive restarts
+        spool = self.make_spool()
+        sent = []
+        spool.drain(sent.append)
+        self.assertEqual(sent, [{'topic': 'topic', 'payload': b'payload', 'qos': 1, 'retain': True},
+                                {'topic': 'topic', 'payload': None, 'qos': 0, 'retain': False}])
+        spool.close()
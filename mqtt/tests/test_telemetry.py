@@ -0,0 +1,181 @@
+import json
+import struct
+from datetime import datetime, timezone as dt_timezone
+
+from django.contrib.gis.geos import Point
+from django.test import SimpleTestCase
+from django.utils import timezone
+from rest_framework.exceptions import PermissionDenied
+
+from ambulance.models import Ambulance, AmbulanceStatus
+from ambulance.serializers import AmbulanceSerializer
+from login.tests.setup_data import TestSetup
+from mqtt.telemetry import AmbulanceTelemetry, DecodedTelemetry, parse_json, \
+    encode_telemetry, decode_telemetry, TELEMETRY_STATUS
+
+
+class TestAmbulanceTelemetry(TestSetup):
+
+    def assertEquivalent(self, data, expected):
+
+        telemetry = AmbulanceTelemetry()
+        validated_data = telemetry.validate(data)
+
+        serializer = AmbulanceSerializer(self.a1, data=data, partial=True)
+        is_valid = serializer.is_valid()
+
+        if not expected:
+            # falls back to the serializer
+            self.assertIsNone(validated_data, data)
+            return
+
+        # same validated data as the serializer
+        self.assertTrue(is_valid, data)
+        self.assertIsNotNone(validated_data, data)
+        self.assertCountEqual(validated_data.keys(), serializer.validated_data.keys())
+        for (key, value) in serializer.validated_data.items():
+            if key == 'location':
+                self.assertEqual(validated_data[key].coords, value.coords)
+                self.assertEqual(validated_data[key].srid, value.srid)
+            else:
+                self.assertEqual(validated_data[key], value, key)
+                self.assertEqual(type(validated_data[key]), type(value), key)
+
+    def test_equivalence(self):
+
+        timestamp = timezone.now().isoformat()
+
+        # common payloads take the fast path
+        for data in (
+                {'location': {'latitude': -2., 'longitude': 7.}},
+                {'location': {'latitude': -2, 'longitude': 7}},
+                {'location': {'latitude': 32.5149, 'longitude': -117.0382}, 'orientation': 45},
+                {'location': {'latitude': -2., 'longitude': 7.}, 'timestamp': timestamp},
+                {'orientation': 12.5},
+                {'status': AmbulanceStatus.AV.name},
+                {'status': AmbulanceStatus.OS.name, 'timestamp': timestamp},
+                {'comment': '  needs fuel  '},
+                {'comment': ''},
+                {'comment': 'x' * 254},
+                {'location': {'latitude': -2., 'longitude': 7.}, 'orientation': 1.,
+                 'status': AmbulanceStatus.PB.name, 'timestamp': timestamp, 'comment': 'en route'},
+        ):
+            self.assertEquivalent(data, True)
+
+        # everything else falls back to the serializer
+        for data in (
+                {},
+                [],
+                'string',
+                {'capability': 'B'},
+                {'identifier': 'BC-999'},
+                {'location': {'latitude': -2., 'longitude': 7.}, 'capability': 'B'},
+                {'location': 'POINT(7 -2)'},
+                {'location': {'latitude': '-2', 'longitude': '7'}},
+                {'location': {'latitude': -2., 'longitude': 7., 'altitude': 3.}},
+                {'location': None},
+                {'orientation': '12.5'},
+                {'orientation': True},
+                {'status': 'XX'},
+                {'status': None},
+                {'timestamp': timestamp},
+                {'timestamp': timestamp, 'orientation': 1.},
+                {'status': AmbulanceStatus.AV.name, 'timestamp': 'yesterday'},
+                {'status': AmbulanceStatus.AV.name, 'timestamp': 1},
+                {'comment': 'x' * 255},
+                {'comment': 'null\x00'},
+                {'comment': 3},
+        ):
+            self.assertEquivalent(data, False)
+
+    def test_parse_json(self):
+
+        self.assertEqual(parse_json(b'{"orientation": 1.5}'), {'orientation': 1.5})
+
+        for payload in (b'{"orientation": NaN}', b'{"orientation": Infinity}', b'{', b'\xff'):
+            with self.assertRaises(ValueError):
+                parse_json(payload)
+
+    def test_save(self):
+
+        telemetry = AmbulanceTelemetry()
+        data = json.loads('{"location": {"latitude": -2.0, "longitude": 7.0}, "status": "AV"}')
+
+        # superuser
+        ambulance = Ambulance.objects.get(id=self.a1.id)
+        telemetry.save(ambulance, telemetry.validate(data), updated_by=self.u1)
+        ambulance = Ambulance.objects.get(id=self.a1.id)
+        self.assertEqual(ambulance.location.coords, (7.0, -2.0))
+        self.assertEqual(ambulance.status, AmbulanceStatus.AV.name)
+        self.assertEqual(ambulance.updated_by, self.u1)
+
+        # user without write permission
+        ambulance = Ambulance.objects.get(id=self.a1.id)
+        with self.assertRaises(PermissionDenied):
+            telemetry.save(ambulance, telemetry.validate(data), updated_by=self.u2)
+
+
+class TestBinaryTelemetry(SimpleTestCase):
+
+    def test_round_trip(self):
+
+        timestamp = datetime(2020, 5, 1, 12, 30, 15, 123000, tzinfo=dt_timezone.utc)
+        payload = encode_telemetry(location=Point(-117.1611649, 32.7156723),
+                                   orientation=359.99,
+                                   status=AmbulanceStatus.PB.name,
+                                   timestamp=timestamp)
+        self.assertEqual(len(payload), 2 + 8 + 2 + 1 + 8)
+
+        data = decode_telemetry(payload)
+        self.assertIsInstance(data, DecodedTelemetry)
+        self.assertEqual(data['location'].coords, (-117.1611649, 32.7156723))
+        self.assertEqual(data['location'].srid, 4326)
+        self.assertEqual(data['orientation'], 359.99)
+        self.assertEqual(data['status'], AmbulanceStatus.PB.name)
+        self.assertEqual(data['timestamp'], timestamp)
+
+        # fields are optional
+        data = decode_telemetry(encode_telemetry(status=AmbulanceStatus.AV.name))
+        self.assertEqual(data, {'status': AmbulanceStatus.AV.name})
+
+        data = decode_telemetry(encode_telemetry(location=Point(7.0, -2.0), orientation=360.0))
+        self.assertEqual(data['location'].coords, (7.0, -2.0))
+        self.assertEqual(data['orientation'], 0.0)
+
+    def test_status(self):
+
+        # every status has a code
+        self.assertCountEqual(TELEMETRY_STATUS, [status.name for status in AmbulanceStatus])
+        for status in AmbulanceStatus:
+            self.assertEqual(decode_telemetry(encode_telemetry(status=status.name))['status'], status.name)
+
+    def test_invalid(self):
+
+        payload = encode_telemetry(location=Point(7.0, -2.0), status=AmbulanceStatus.AV.name)
+        for invalid in (b'',
+                        b'\x01',
+                        b'\x02' + payload[1:],
+                        b'\x01\x00',
+                        b'\x01\x10',
+                        payload[:-1],
+                        payload + b'\x00',
+                        b'\x01\x04' + bytes([len(TELEMETRY_STATUS)]),
+                        b'\x01\x02' + struct.pack('<H', 36000),
+                        b'\x01\x08' + struct.pack('<q', 2**62),
+                        encode_telemetry(orientation=1.0, timestamp=timezone.now())):
+            with self.assertRaises(ValueError, msg=invalid):
+                decode_telemetry(invalid)
+
+    def test_equivalence(self):
+
+        # same validated data as the json fast path
+        telemetry = AmbulanceTelemetry()
+        data = telemetry.validate(json.loads('{"location": {"latitude": 32.5, "longitude": -117.25}, '
+                                             '"orientation": 12.5, "status": "AH", '
+                                             '"timestamp": "2020-05-01T12:30:15.123Z"}'))
+        decoded = telemetry.decode(encode_telemetry(**data))
+        self.assertCountEqual(decoded.keys(), data.keys())
+        self.assertEqual(decoded['location'].coords, data['location'].coords)
+        self.assertEqual(decoded['location'].srid, data['location'].srid)
+        for key in ('orientation', 'status', 'timestamp'):
+            self.assertEqual(decoded[key], data[key], key)
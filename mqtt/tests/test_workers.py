@@ -0,0 +1,55 @@
+import threading
+import time
+
+from django.test import SimpleTestCase
+
+from mqtt.workers import WorkerPool, shard
+
+
+class TestWorkerPool(SimpleTestCase):
+
+    def test_shard(self):
+
+        # shards are stable and within range
+        for key in ('ambulance/1', 'ambulance/2', 'hospital/1', 'user/a/client/b'):
+            self.assertEqual(shard(key, 8), shard(key, 8))
+            self.assertIn(shard(key, 8), range(8))
+
+    def test_ordering(self):
+
+        lock = threading.Lock()
+        processed = {}
+
+        def handler(key, seq):
+            # make later tasks finish faster to expose reordering
+            time.sleep(0.001 * ((10 - seq) % 3))
+            with lock:
+                processed.setdefault(key, []).append(seq)
+
+        pool = WorkerPool(4, queue_size=2)
+        for seq in range(10):
+            for key in range(10):
+                pool.submit(key, handler, key, seq)
+        pool.join()
+        pool.shutdown()
+
+        # each key is processed in order
+        self.assertEqual(len(processed), 10)
+        for key, seqs in processed.items():
+            self.assertEqual(seqs, list(range(10)))
+
+    def test_exception(self):
+
+        processed = []
+
+        def fail():
+            raise Exception('failed')
+
+        pool = WorkerPool(1)
+        pool.submit('key', fail)
+        pool.submit('key', processed.append, 1)
+        pool.join()
+        pool.shutdown()
+
+        # worker survives exceptions
+        self.assertEqual(processed, [1])
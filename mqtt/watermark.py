@@ -0,0 +1,119 @@
+import logging
+from datetime import timedelta
+
+from django.apps import apps
+from django.db.models.signals import post_delete
+from django.utils import timezone
+
+from .models import Watermark, Tombstone
+
+logger = logging.getLogger(__name__)
+
+SEED_WATERMARK = 'mqttseed'
+PERMISSIONS_WATERMARK = 'permissions'
+USER_PERMISSIONS_WATERMARK = 'permissions:user:{}'
+EFFECTIVE_PERMISSIONS_WATERMARK = 'permissions:effective'
+
+# changes made this long before a watermark are seeded again, to absorb clock skew between hosts
+WATERMARK_OVERLAP = timedelta(seconds=60)
+
+# retained topics of a deleted object
+TOMBSTONES = {
+    'ambulance.Ambulance': lambda ambulance: ['ambulance/{}/data'.format(ambulance.id),
+                                              'ambulance/{}/delta'.format(ambulance.id),
+                                              'ambulance/{}/telemetry'.format(ambulance.id)],
+    'hospital.Hospital': lambda hospital: ['hospital/{}/data'.format(hospital.id),
+                                           'hospital/{}/delta'.format(hospital.id),
+                                           'equipment/{}/metadata'.format(hospital.equipmentholder_id)],
+    'equipment.EquipmentItem': lambda item: ['equipment/{}/item/{}/data'.format(item.equipmentholder_id,
+                                                                                item.equipment_id)],
+    'ambulance.Call': lambda call: ['call/{}/data'.format(call.id)],
+    'ambulance.AmbulanceCall': lambda ambulancecall: ['ambulance/{}/call/{}/status'.format(ambulancecall.ambulance_id,
+                                                                                         ambulancecall.call_id)],
+    'auth.User': lambda user: ['user/{}/profile'.format(user.username)],
+}
+
+
+def get_watermark(name):
+    """
+    Returns the timestamp of watermark name or None if it was never set.
+    """
+    return Watermark.objects.filter(name=name).values_list('timestamp', flat=True).first()
+
+
+def set_watermark(name, timestamp=None):
+    """
+    Sets the timestamp of watermark name, now if timestamp is None.
+    """
+
+    if timestamp is None:
+        timestamp = timezone.now()
+
+    if not Watermark.objects.filter(name=name).update(timestamp=timestamp):
+        Watermark.objects.get_or_create(name=name, defaults={'timestamp': timestamp})
+
+
+def set_user_watermarks(user_ids, timestamp=None):
+    """
+    Sets the permissions watermark of every user in user_ids, now if timestamp is None.
+    """
+
+    if timestamp is None:
+        timestamp = timezone.now()
+
+    names = set(USER_PERMISSIONS_WATERMARK.format(user_id) for user_id in user_ids)
+    existing = set(Watermark.objects.filter(name__in=names).values_list('name', flat=True))
+    Watermark.objects.filter(name__in=existing).update(timestamp=timestamp)
+    Watermark.objects.bulk_create([Watermark(name=name, timestamp=timestamp) for name in names - existing],
+                                  ignore_conflicts=True)
+
+
+def get_user_watermarks(since):
+    """
+    Returns the ids of the users whose permissions changed after since.
+    """
+    prefix = USER_PERMISSIONS_WATERMARK.format('')
+    names = Watermark.objects.filter(name__startswith=prefix, timestamp__gt=since).values_list('name', flat=True)
+    return [int(name[len(prefix):]) for name in names]
+
+
+def get_tombstones(since=None):
+    """
+    Returns the topics of the objects deleted after since, or of all of them if since is None.
+    """
+    tombstones = Tombstone.objects.all()
+    if since is not None:
+        tombstones = tombstones.filter(deleted_on__gt=since)
+    return tombstones.values_list('topic', flat=True)
+
+
+def get_tombstone_holders(since=None):
+    """
+    Returns the ids of the equipment holders of the items deleted after since.
+    """
+    topics = get_tombstones(since).filter(topic__startswith='equipment/', topic__contains='/item/')
+    return set(int(topic.split('/')[1]) for topic in topics)
+
+
+def purge_tombstones(until):
+    """
+    Deletes the tombstones of objects deleted until until.
+    """
+    return Tombstone.objects.filter(deleted_on__lte=until).delete()[0]
+
+
+def record_tombstone(sender, instance, **kwargs):
+    Tombstone.objects.bulk_create([Tombstone(topic=topic)
+                                   for topic in TOMBSTONES[sender._meta.label](instance)])
+
+
+def connect():
+    for label in TOMBSTONES:
+        post_delete.connect(record_tombstone, sender=apps.get_model(label),
+                            dispatch_uid=('mqtt_tombstone', label))
+
+
+def disconnect():
+    for label in TOMBSTONES:
+        post_delete.disconnect(sender=apps.get_model(label),
+                               dispatch_uid=('mqtt_tombstone', label))
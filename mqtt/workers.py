@@ -0,0 +1,102 @@
+import hashlib
+import logging
+import queue
+import threading
+import zlib
+
+from django.db import connection, close_old_connections
+
+logger = logging.getLogger(__name__)
+
+
+def shard(key, n):
+    """
+    Returns the shard in range(n) that key belongs to.
+    Uses crc32 so that the result is stable across processes.
+    """
+    return zlib.crc32(str(key).encode()) % n
+
+
+def partition(key, n):
+    """
+    Returns the partition in range(n) that key belongs to.
+    Uses a hash unrelated to shard() so that the keys of one partition
+    still spread over all the shards of a worker pool.
+    """
+    return int.from_bytes(hashlib.blake2b(str(key).encode(), digest_size=4).digest(), 'little') % n
+
+
+# WorkerPool
+
+class WorkerPool:
+    """
+    A bounded pool of worker threads sharded by key.
+
+    All tasks submitted with the same key run on the same worker in submission order,
+    tasks with different keys may run in parallel. Each worker has a bounded queue and
+    submit() blocks when it is full, pushing back on the producer.
+    """
+
+    def __init__(self, workers, queue_size=100, name='mqtt-worker'):
+
+        if workers < 1:
+            raise ValueError('WorkerPool needs at least one worker')
+
+        self.queues = [queue.Queue(maxsize=queue_size) for _ in range(workers)]
+        self.threads = []
+        for k, q in enumerate(self.queues):
+            thread = threading.Thread(target=self.worker, args=(q,),
+                                      name='{}-{}'.format(name, k),
+                                      daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def __len__(self):
+        return len(self.queues)
+
+    def submit(self, key, fn, *args, **kwargs):
+
+        # blocks if queue is full
+        self.queues[shard(key, len(self.queues))].put((fn, args, kwargs))
+
+    def worker(self, q):
+
+        while True:
+
+            task = q.get()
+            try:
+
+                # shutdown?
+                if task is None:
+                    break
+
+                # make sure connection is still good
+                close_old_connections()
+
+                fn, args, kwargs = task
+                fn(*args, **kwargs)
+
+            except Exception as e:
+                logger.exception('WorkerPool: unhandled exception: {}'.format(e))
+
+            finally:
+                q.task_done()
+
+        # release database connection
+        connection.close()
+
+    def join(self):
+
+        # wait until all submitted tasks are done
+        for q in self.queues:
+            q.join()
+
+    def shutdown(self, wait=True):
+
+        # workers quit once queues are drained
+        for q in self.queues:
+            q.put(None)
+
+        if wait:
+            for thread in self.threads:
+                thread.join()
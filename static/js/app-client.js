@@ -8,8 +8,9 @@ export class AppClient extends TopicObserver {
      *
      * @param {MqttClient} mqttClient
      * @param httpClient
+     * @param options useDelta: subscribe to ambulance and hospital deltas instead of data
      */
-    constructor(mqttClient, httpClient) {
+    constructor(mqttClient, httpClient, options = {}) {
 
         // call super
         super();
@@ -25,6 +26,10 @@ export class AppClient extends TopicObserver {
         // http client
         this.httpClient = httpClient;
 
+        // deltas?
+        this.useDelta = options.useDelta || false;
+        this.deltas = {};
+
         // initialize
         this.ambulances = undefined;
         this.hospitals = undefined;
@@ -36,6 +41,8 @@ export class AppClient extends TopicObserver {
         this.updateHospital = (message) => { this._updateHospital(message) };
         this.updateCall = (message) => { this._updateCall(message) };
         this.updateAmbulanceCallStatus = (message) => { this._updateAmbulanceCallStatus(message) };
+        this.updateAmbulanceDelta = (message) => { this._updateDelta(message, this.ambulances, 'ambulance') };
+        this.updateHospitalDelta = (message) => { this._updateDelta(message, this.hospitals, 'hospital') };
 
     }
 
@@ -77,8 +84,12 @@ export class AppClient extends TopicObserver {
                     
                     // subscribe
                     // TODO: check if already subscribed
-                    this._subscribe('ambulance/' + ambulance.id + '/data',
-                        this.updateAmbulance);
+                    if (this.useDelta)
+                        this._subscribe('ambulance/' + ambulance.id + '/delta',
+                            this.updateAmbulanceDelta);
+                    else
+                        this._subscribe('ambulance/' + ambulance.id + '/data',
+                            this.updateAmbulance);
                     this._subscribe('ambulance/' + ambulance.id + '/call/+/status',
                         this.updateAmbulanceCallStatus);
                     
@@ -109,8 +120,12 @@ export class AppClient extends TopicObserver {
                     
                     // subscribe
                     // TODO: check if already subscribed
-                    this._subscribe('hospital/' + hospital.id + '/data',
-                        this.updateHospital);
+                    if (this.useDelta)
+                        this._subscribe('hospital/' + hospital.id + '/delta',
+                            this.updateHospitalDelta);
+                    else
+                        this._subscribe('hospital/' + hospital.id + '/data',
+                            this.updateHospital);
                     
                 });
 
@@ -206,6 +221,77 @@ export class AppClient extends TopicObserver {
         this.hospitals[hospital.id] = hospital;
     }
 
+    /**
+     * Applies a snapshot or delta from '{name}/{id}/delta' to objects[id]
+     * and broadcasts the updated object on '{name}/{id}/data'.
+     *
+     * Deltas are applied only if they follow the last message applied in the
+     * same stream; otherwise messages were missed and the object is retrieved
+     * from the api before applying the deltas that follow.
+     */
+    _updateDelta(message, objects, name) {
+        const delta = message.payload;
+        const id = message.topic.split('/')[1];
+        const state = this.deltas[message.topic];
+
+        if (delta.v !== 2) {
+            logger.log('warn', "Unknown delta version '%s' on '%s'", delta.v, message.topic);
+            return;
+        }
+
+        if (delta.type === 'snapshot') {
+
+            // replace object
+            objects[id] = delta.data;
+
+        } else if (typeof state !== 'undefined' && !state.resyncing &&
+            state.stream === delta.stream && state.seq + 1 === delta.seq && objects.hasOwnProperty(id)) {
+
+            // apply changes and removals
+            const object = Object.assign({}, objects[id], delta.data);
+            (delta.removed || []).forEach( (key) => {
+                delete object[key];
+            });
+            objects[id] = object;
+
+        } else {
+
+            // continue after resync
+            if (typeof state !== 'undefined' && state.resyncing) {
+                state.stream = delta.stream;
+                state.seq = delta.seq;
+                return;
+            }
+
+            logger.log('debug', "Missed messages on '%s', resyncing", message.topic);
+            const resync = {stream: delta.stream, seq: delta.seq, resyncing: true};
+            this.deltas[message.topic] = resync;
+            this.httpClient.get(name + '/' + id + '/')
+                .then( (response) => {
+                    resync.resyncing = false;
+                    if (this.deltas[message.topic] !== resync)
+                        return;
+                    objects[id] = response.data;
+                    this._broadcastData(name, id, objects[id]);
+                })
+                .catch( (error) => {
+                    resync.resyncing = false;
+                    resync.stream = undefined;
+                    logger.log('error', "Could not retrieve %s with id '%d': '%s'", name, id, error);
+                });
+            return;
+
+        }
+
+        this.deltas[message.topic] = {stream: delta.stream, seq: delta.seq, resyncing: false};
+        this._broadcastData(name, id, objects[id]);
+    }
+
+    _broadcastData(name, id, object) {
+        const topic = name + '/' + id + '/data';
+        this.broadcast(topic, {topic: topic, payload: object});
+    }
+
     _updateCall(message) {
         const call = message.payload;
 
@@ -59,7 +59,7 @@ $(function () {
         .then( () => {
 
             // instantiate client
-            apiClient = new AppClient(mqttClient, httpClient);
+            apiClient = new AppClient(mqttClient, httpClient, {useDelta: mqttBroker.delta === 1});
 
             // retrieve ambulances
             console.log('Retrieving ambulances');
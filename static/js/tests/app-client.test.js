@@ -66,6 +66,52 @@ describe('client observe', () => {
 
 });
 
+describe('client deltas', () => {
+
+    it('apply deltas and resync', (done) => {
+
+        const mqttClient = new MockMqttClient();
+        const httpClient = {
+            get: (url) => Promise.resolve({data: {id: 1, identifier: 'resynced', status: 'AV'}})
+        };
+
+        const client = new AppClient(mqttClient, httpClient, {useDelta: true});
+        client.ambulances = {};
+
+        const received = [];
+        client._subscribe('ambulance/1/delta', client.updateAmbulanceDelta);
+        client.observe('ambulance/+/data', (message) => received.push(message.payload));
+
+        const publish = (message) => client.publish('ambulance/1/delta', JSON.stringify(message), 2, false);
+
+        // snapshot, then deltas in sequence
+        publish({v: 2, stream: 's', seq: 1, type: 'snapshot', data: {id: 1, identifier: 'A1', status: 'AV', comment: 'x'}});
+        publish({v: 2, stream: 's', seq: 2, type: 'delta', data: {status: 'PB'}, removed: ['comment']});
+        publish({v: 2, stream: 's', seq: 3, type: 'delta', data: {identifier: null}});
+        expect(received).to.eql([
+            {id: 1, identifier: 'A1', status: 'AV', comment: 'x'},
+            {id: 1, identifier: 'A1', status: 'PB'},
+            {id: 1, identifier: null, status: 'PB'}
+        ]);
+
+        // gap, resync from the api
+        publish({v: 2, stream: 's', seq: 6, type: 'delta', data: {status: 'AV'}});
+        publish({v: 2, stream: 's', seq: 7, type: 'delta', data: {status: 'OS'}});
+        expect(received.length).to.equal(3);
+
+        setTimeout(() => {
+            expect(received[3]).to.eql({id: 1, identifier: 'resynced', status: 'AV'});
+
+            // continues after the last delta seen
+            publish({v: 2, stream: 's', seq: 8, type: 'delta', data: {status: 'PB'}});
+            expect(received[4]).to.eql({id: 1, identifier: 'resynced', status: 'PB'});
+            done();
+        }, 10);
+
+    });
+
+});
+
 describe('client connection', () => {
 
     const userName = 'admin';